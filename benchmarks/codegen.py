@@ -0,0 +1,61 @@
+"""
+Measures code generation for a large program which mixes all statements,
+with the dispatch tables of cma.backend and with the isinstance ladders in
+benchmarks.ladder which they replaced.
+
+    python -m benchmarks.codegen [repetitions]
+"""
+
+import sys
+from timeit import repeat
+
+from benchmarks import ladder
+from cma.backend import Array, Basic, EnvEntry, LazyStruct, Pointer, Struct, code
+from cma.backend import render_symbolic_addresses
+from cma.pratt_frontend import P
+
+STATEMENTS = """
+x = a[i] + p->v * (y - 3);
+if (x > y) { y = y + x; } else { x = x - y; }
+while (i < 10) { a[i] = i * 2; i = i + 1; }
+for (j = 0; j < 4; j = j + 1) s.b[j] = !(x == j) && y || -x;
+switch (x % 3) { case 0: y = 1; break; case 1: p = p->n; break; default: *q = y; }
+q = &s.c;
+p->n->v = malloc(2);
+free(q);
+"""
+
+
+def environment():
+    structs = {}
+    structs["node"] = Struct(
+        ("v", Basic()), ("n", Pointer(LazyStruct(lambda: structs["node"])))
+    )
+    return {
+        "i": EnvEntry(1, Basic()),
+        "j": EnvEntry(2, Basic()),
+        "x": EnvEntry(3, Basic()),
+        "y": EnvEntry(4, Basic()),
+        "q": EnvEntry(5, Pointer(Basic())),
+        "p": EnvEntry(6, Pointer(structs["node"])),
+        "a": EnvEntry(7, Array(Basic(), 10)),
+        "s": EnvEntry(17, Struct(("b", Array(Basic(), 4)), ("c", Basic()))),
+    }
+
+
+def main(repetitions: int = 500):
+    (node,) = P.StatementSequence.parseString(STATEMENTS * repetitions)
+    env = environment()
+    instructions = list(render_symbolic_addresses(code(node, env)))
+    if list(render_symbolic_addresses(ladder.code(node, env))) != instructions:
+        raise AssertionError("The baseline generates different code")
+    tables = min(repeat(lambda: list(code(node, env)), number=1, repeat=5))
+    ladders = min(repeat(lambda: list(ladder.code(node, env)), number=1, repeat=5))
+    print(f"{len(node)} statements, {len(instructions)} instructions")
+    print(f"dispatch tables:    {tables * 1000:.1f} ms")
+    print(f"isinstance ladders: {ladders * 1000:.1f} ms")
+    print(f"speedup: {ladders / tables:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
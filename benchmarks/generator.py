@@ -0,0 +1,178 @@
+"""
+Seeded generator of random but valid programs for the benchmarks.
+
+Programs only use the variables of the environment returned alongside them
+and are well-typed, so that every phase of the compiler accepts them. They
+are meant to be compiled, not run, loops need not terminate.
+"""
+
+from dataclasses import dataclass
+from random import Random
+from typing import Dict, List, Tuple
+
+from cma.backend import Array, Basic, EnvEntry, LazyStruct, Pointer, Struct
+
+INTS = ("i", "j", "x", "y", "z")
+ARRAY_LENGTH = 10
+BINARY_OPS = ("+", "-", "*", "/", "%", "<", "<=", ">", ">=", "==", "!=", "^")
+LOGICAL_OPS = ("&&", "||")
+
+
+@dataclass(frozen=True)
+class Shape:
+    # top-level statements
+    statements: int = 200
+    # operations between the leaves of an expression
+    expression_depth: int = 3
+    # how deep while, for, switch and if statements are nested
+    nesting: int = 2
+    # at most this many "->n" in pointer chains and ".inner" in struct chains
+    chain_length: int = 2
+    # statements in a block
+    block_size: int = 3
+
+
+def environment(shape: Shape) -> Dict[str, EnvEntry]:
+    """
+    Globals: some ints, an int array a, an int pointer q, a pointer p into a
+    linked list of nodes and a struct s which nests chain_length structs.
+    """
+    structs = {}
+    structs["node"] = Struct(
+        ("v", Basic()), ("n", Pointer(LazyStruct(lambda: structs["node"])))
+    )
+    nested = Struct(("v", Basic()), ("w", Array(Basic(), 4)))
+    for _ in range(shape.chain_length):
+        nested = Struct(("v", Basic()), ("w", Array(Basic(), 4)), ("inner", nested))
+    env = {name: EnvEntry(address, Basic()) for address, name in enumerate(INTS)}
+    address = len(INTS)
+    for name, datatype in [
+        ("a", Array(Basic(), ARRAY_LENGTH)),
+        ("q", Pointer(Basic())),
+        ("p", Pointer(structs["node"])),
+        ("s", nested),
+    ]:
+        env[name] = EnvEntry(address, datatype)
+        address += datatype.size if isinstance(datatype, (Array, Struct)) else 1
+    return env
+
+
+class Generator:
+    def __init__(self, shape: Shape, seed: int):
+        self.shape = shape
+        self.random = Random(seed)
+
+    def constant(self) -> str:
+        return str(self.random.randrange(ARRAY_LENGTH))
+
+    def struct_chain(self) -> str:
+        depth = self.random.randint(0, self.shape.chain_length)
+        return "s" + ".inner" * depth
+
+    def pointer_chain(self) -> str:
+        return "p" + "->n" * self.random.randint(0, self.shape.chain_length)
+
+    def lvalue(self, depth: int) -> str:
+        """
+        An int which may be assigned to.
+        """
+        choice = self.random.randrange(6)
+        if choice == 0:
+            return f"a[{self.expression(depth - 1)}]"
+        elif choice == 1:
+            return self.struct_chain() + ".v"
+        elif choice == 2:
+            return f"{self.struct_chain()}.w[{self.expression(depth - 1)}]"
+        elif choice == 3:
+            return self.pointer_chain() + "->v"
+        elif choice == 4:
+            return "*q"
+        return self.random.choice(INTS)
+
+    def expression(self, depth: int) -> str:
+        """
+        An int valued expression with up to depth nested operations.
+        """
+        random = self.random
+        if depth <= 0 or random.random() < 0.25:
+            return self.constant() if random.random() < 0.3 else self.lvalue(0)
+        choice = random.randrange(8)
+        if choice == 0:
+            return random.choice("-!") + f"({self.expression(depth - 1)})"
+        op = random.choice(LOGICAL_OPS if choice == 1 else BINARY_OPS)
+        left = self.expression(depth - 1)
+        right = self.expression(depth - 1)
+        return f"({left} {op} {right})"
+
+    def condition(self) -> str:
+        return self.expression(self.shape.expression_depth)
+
+    def block(self, nesting: int, indent: str) -> List[str]:
+        lines = []
+        for _ in range(self.random.randint(1, self.shape.block_size)):
+            lines += self.statement(nesting, indent)
+        return lines
+
+    def braced(self, header: str, nesting: int, indent: str) -> List[str]:
+        return [
+            f"{indent}{header} {{",
+            *self.block(nesting, indent + "    "),
+            indent + "}",
+        ]
+
+    def pointer_statement(self, indent: str) -> str:
+        choice = self.random.randrange(5)
+        if choice == 0:
+            return f"{indent}p = {self.pointer_chain()}->n;"
+        elif choice == 1:
+            return f"{indent}{self.pointer_chain()}->n = malloc(2);"
+        elif choice == 2:
+            return f"{indent}q = &{self.lvalue(1)};"
+        elif choice == 3:
+            return f"{indent}q = malloc({self.constant()} + 1);"
+        return f"{indent}free({self.random.choice('pq')});"
+
+    def statement(self, nesting: int, indent: str = "") -> List[str]:
+        random = self.random
+        kind = random.randrange(10) if nesting < self.shape.nesting else 0
+        depth = self.shape.expression_depth
+        if kind <= 4:
+            if random.random() < 0.2:
+                return [self.pointer_statement(indent)]
+            return [f"{indent}{self.lvalue(depth)} = {self.expression(depth)};"]
+        elif kind == 5:
+            return self.braced(f"while ({self.condition()})", nesting + 1, indent)
+        elif kind == 6:
+            variable = random.choice(INTS)
+            header = (
+                f"for ({variable} = 0; {variable} < {self.condition()};"
+                f" {variable} = {variable} + 1)"
+            )
+            return self.braced(header, nesting + 1, indent)
+        elif kind == 7:
+            lines = self.braced(f"if ({self.condition()})", nesting + 1, indent)
+            if random.random() < 0.5:
+                lines[-1] += " else {"
+                lines += self.block(nesting + 1, indent + "    ") + [indent + "}"]
+            return lines
+        lines = [f"{indent}switch ({self.condition()}) {{"]
+        values = random.sample(range(2 * ARRAY_LENGTH), random.randint(1, 6))
+        for value in values:
+            lines.append(f"{indent}    case {value}:")
+            lines += self.block(nesting + 1, indent + "        ")
+            lines.append(f"{indent}        break;")
+        lines.append(f"{indent}    default:")
+        lines += self.block(nesting + 1, indent + "        ")
+        return lines + [indent + "}"]
+
+
+def program(shape: Shape = Shape(), seed: int = 0) -> Tuple[str, Dict[str, EnvEntry]]:
+    """
+    Returns the source of a random program and the environment it uses.
+    The same shape and seed always give the same program.
+    """
+    generator = Generator(shape, seed)
+    lines = []
+    for _ in range(shape.statements):
+        lines += generator.statement(0)
+    return "\n".join(lines) + "\n", environment(shape)
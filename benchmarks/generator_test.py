@@ -0,0 +1,38 @@
+import unittest
+
+from benchmarks.generator import Shape, program
+from cma.backend import code, link
+from cma.frontend import C
+from cma.pratt_frontend import P
+
+
+class TestGenerator(unittest.TestCase):
+    def test_programs_compile(self):
+        shapes = [
+            Shape(statements=10),
+            Shape(statements=3, nesting=3, chain_length=5, block_size=2),
+        ]
+        for shape in shapes:
+            for seed in range(3):
+                with self.subTest(shape=shape, seed=seed):
+                    source, environment = program(shape, seed)
+                    (node,) = P.StatementSequence.parseString(source, parseAll=True)
+                    self.assertEqual(len(node), shape.statements)
+                    self.assertEqual(
+                        C.StatementSequence.parseString(source, parseAll=True)[0],
+                        node,
+                    )
+                    self.assertTrue(link(code(node, environment)))
+
+    def test_seeded(self):
+        shape = Shape(statements=20)
+        self.assertEqual(program(shape, 1)[0], program(shape, 1)[0])
+        self.assertNotEqual(program(shape, 1)[0], program(shape, 2)[0])
+
+    def test_shape(self):
+        source, _ = program(Shape(statements=50, nesting=0, chain_length=0), 0)
+        for word in ["while", "for", "switch", "if", "->n->", ".inner"]:
+            self.assertNotIn(word, source)
+        source, _ = program(Shape(statements=50, chain_length=3), 0)
+        self.assertIn("->n->n->n", source)
+        self.assertIn(".inner.inner.inner", source)
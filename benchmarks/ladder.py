@@ -0,0 +1,308 @@
+"""
+The code generation of cma.backend before its handlers were dispatched
+through tables, i.e. with isinstance ladders. benchmarks.codegen measures
+the dispatch tables against it, it is not used otherwise.
+"""
+
+from dataclasses import fields, is_dataclass
+from typing import Any, Dict, Optional
+
+from cma.backend import (
+    ADD,
+    BINARY_OP_TO_INSTR,
+    DUP,
+    GEQ,
+    LE,
+    LOAD,
+    MUL,
+    NEW,
+    POP,
+    STORE,
+    UNARY_OP_TO_INSTR,
+    Array,
+    Basic,
+    Context,
+    Datatype,
+    EnvEntry,
+    LazyStruct,
+    Pointer,
+    Struct,
+    SymbolicAddress,
+)
+from cma.frontend import (
+    AddressOf,
+    ArrayAccess,
+    Assignment,
+    BinaryOp,
+    Case,
+    Constant,
+    For,
+    FreeCall,
+    Identifier,
+    IfElse,
+    MallocCall,
+    PlainStatement,
+    PointerDereference,
+    StatementSequence,
+    StructAccess,
+    StructPointerAccess,
+    Switch,
+    UnaryOp,
+    While,
+)
+from cma.instructions import Instruction, Opcode, loadc
+
+
+def code_l(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    if isinstance(node, Identifier):
+        yield loadc(environment[node.name].address)
+    elif isinstance(node, ArrayAccess):
+        yield from code_r(node.accessee, environment, context)
+        yield from code_r(node.expr, environment, context)
+        yield loadc(sizeof(datatype(node, environment, context.types)))
+        yield MUL
+        yield ADD
+    elif isinstance(node, StructAccess):
+        yield from code_l(node.accessee, environment, context)
+        struct_type = datatype(node.accessee, environment, context.types)
+        yield loadc(struct_type.fields[node.field.name].offset)
+        yield ADD
+    elif isinstance(node, PointerDereference):
+        yield from code_r(node.pointer, environment, context)
+    elif isinstance(node, StructPointerAccess):
+        yield from code_r(node.pointer, environment, context)
+        struct_type = datatype(node.pointer, environment, context.types).datatype
+        yield loadc(struct_type.fields[node.field.name].offset)
+        yield ADD
+    else:
+        raise AssertionError(f"Cannot generate code_l for {repr(node)}")
+
+
+def code_r(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    if isinstance(datatype(node, environment, context.types), Array):
+        yield from code_l(node, environment, context)
+    elif isinstance(node, BinaryOp):
+        yield from code_r(node.left, environment, context)
+        yield from code_r(node.right, environment, context)
+        yield BINARY_OP_TO_INSTR[node.op]
+    elif isinstance(node, UnaryOp):
+        yield from code_r(node.expr, environment, context)
+        yield UNARY_OP_TO_INSTR[node.op]
+    elif isinstance(node, Constant):
+        yield loadc(node.value)
+    elif isinstance(node, Assignment):
+        yield from code_r(node.right, environment, context)
+        yield from code_l(node.left, environment, context)
+        yield STORE
+    elif isinstance(node, MallocCall):
+        yield from code_r(node.expr, environment, context)
+        yield NEW
+    elif isinstance(node, AddressOf):
+        yield from code_l(node.value, environment, context)
+    else:
+        yield from code_l(node, environment, context)
+        yield LOAD
+
+
+def check(start: int, end: int, b: SymbolicAddress, context: Context):
+    a = context.label()
+    yield DUP
+    yield loadc(start)
+    yield GEQ
+    yield Instruction(Opcode.JUMPZ, a)
+    yield DUP
+    yield loadc(end)
+    yield LE
+    yield Instruction(Opcode.JUMPZ, a)
+    yield Instruction(Opcode.JUMPI, b)
+    yield Instruction(Opcode.LABEL, a)
+    yield POP
+    yield loadc(end)
+    yield Instruction(Opcode.JUMPI, b)
+
+
+def code(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    if isinstance(node, PlainStatement):
+        yield from code_r(node.expr, environment, context)
+        yield POP
+    elif isinstance(node, StatementSequence):
+        for statement in node:
+            yield from code(statement, environment, context)
+    elif isinstance(node, IfElse) and node.else_branch is None:
+        a = context.label()
+        yield from code_r(node.expr, environment, context)
+        yield Instruction(Opcode.JUMPZ, a)
+        yield from code(node.then_branch, environment, context)
+        yield Instruction(Opcode.LABEL, a)
+    elif isinstance(node, IfElse) and node.else_branch is not None:
+        a = context.label()
+        b = context.label()
+        yield from code_r(node.expr, environment, context)
+        yield Instruction(Opcode.JUMPZ, a)
+        yield from code(node.then_branch, environment, context)
+        yield Instruction(Opcode.JUMP, b)
+        yield Instruction(Opcode.LABEL, a)
+        yield from code(node.else_branch, environment, context)
+        yield Instruction(Opcode.LABEL, b)
+    elif isinstance(node, While):
+        a = context.label()
+        b = context.label()
+        yield Instruction(Opcode.LABEL, a)
+        yield from code_r(node.expr, environment, context)
+        yield Instruction(Opcode.JUMPZ, b)
+        yield from code(node.body, environment, context)
+        yield Instruction(Opcode.JUMP, a)
+        yield Instruction(Opcode.LABEL, b)
+    elif isinstance(node, For):
+        a = context.label()
+        b = context.label()
+        yield from code_r(node.expr1, environment, context)
+        yield POP
+        yield Instruction(Opcode.LABEL, a)
+        yield from code_r(node.expr2, environment, context)
+        yield Instruction(Opcode.JUMPZ, b)
+        yield from code(node.body, environment, context)
+        yield from code_r(node.expr3, environment, context)
+        yield POP
+        yield Instruction(Opcode.JUMP, a)
+        yield Instruction(Opcode.LABEL, b)
+    elif isinstance(node, Switch):
+        b = context.label()
+        cs = []
+        d = context.label()
+        k = len(node.cases)
+        yield from code_r(node.expr, environment, context)
+        yield from check(0, k, b, context)
+
+        # cases
+        for case in node.cases:
+            c = context.label()
+            cs.append(c)
+            yield Instruction(Opcode.LABEL, c)
+            yield from code(case.body, environment, context)
+            yield Instruction(Opcode.JUMP, d)
+
+        # default case
+        c = context.label()
+        cs.append(c)
+        yield Instruction(Opcode.LABEL, c)
+        yield from code(node.default_case, environment, context)
+        yield Instruction(Opcode.JUMP, d)
+
+        # jump table
+        yield Instruction(Opcode.LABEL, b)
+        for c in cs:
+            yield Instruction(Opcode.JUMP, c)
+
+        yield Instruction(Opcode.LABEL, d)
+    elif isinstance(node, FreeCall):
+        # noop lulz
+        yield from code_r(node.expr, environment, context)
+        yield POP
+    else:
+        raise AssertionError(f"Cannot generate code for {repr(node)}")
+
+
+def sizeof(t: Datatype):
+    if isinstance(t, (Basic, Pointer)):
+        return 1
+    elif isinstance(t, (Array, Struct, LazyStruct)):
+        return t.size
+
+
+def datatype(
+    node: Any,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]] = None,
+):
+    """
+    Returns the datatype of an expression. If types is given, datatypes are
+    looked up in it first and the ones computed are added, so that each node
+    of an accessor chain is only resolved once.
+    """
+    if types is not None:
+        result = types.get(id(node))
+        if result is not None:
+            return result
+
+    if isinstance(node, Identifier):
+        result = environment[node.name].datatype
+    elif isinstance(node, PointerDereference):
+        pointer_type = datatype(node.pointer, environment, types)
+        if not isinstance(pointer_type, Pointer):
+            raise AssertionError(f"Expected {repr(node)} to be a pointer")
+        result = pointer_type.datatype
+    elif isinstance(node, AddressOf):
+        value_type = datatype(node.value, environment, types)
+        result = Pointer(value_type)
+    elif isinstance(node, ArrayAccess):
+        array_or_pointer_type = datatype(node.accessee, environment, types)
+        if not isinstance(array_or_pointer_type, (Pointer, Array)):
+            raise AssertionError(f"Expected {repr(node)} to be a pointer or array")
+        result = array_or_pointer_type.datatype
+    elif isinstance(node, StructAccess):
+        struct_type = datatype(node.accessee, environment, types)
+        if not isinstance(struct_type, (Struct, LazyStruct)):
+            raise AssertionError(f"Expected {repr(node)} to be a struct")
+        result = struct_type.fields[node.field.name].datatype
+    elif isinstance(node, StructPointerAccess):
+        struct_pointer_type = datatype(node.pointer, environment, types)
+        if not (
+            isinstance(struct_pointer_type, Pointer)
+            and isinstance(struct_pointer_type.datatype, (Struct, LazyStruct))
+        ):
+            raise AssertionError(f"Expected {repr(node)} to be a struct")
+        result = struct_pointer_type.datatype.fields[node.field.name].datatype
+    else:
+        # TODO: Handle function return value, e.g. foo(42) -> bar
+        result = Basic()
+
+    if types is not None:
+        types[id(node)] = result
+    return result
+
+
+STATEMENTS = (PlainStatement, IfElse, While, For, Switch, Case, FreeCall)
+# fields which hold struct field or function names rather than variables
+NAMES = ("field", "identifier")
+
+
+def annotate(
+    node: Any,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]] = None,
+):
+    """
+    Resolves the datatype of every expression in the AST once. Returns the
+    table from node ids to datatypes, which code generation reads from.
+    """
+    if types is None:
+        types = {}
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            # StatementSequence, Cases and FuncCallArguments
+            stack.extend(node)
+        elif is_dataclass(node):
+            if not isinstance(node, STATEMENTS):
+                datatype(node, environment, types)
+            stack.extend(
+                getattr(node, f.name) for f in fields(node) if f.name not in NAMES
+            )
+    return types
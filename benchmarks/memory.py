@@ -0,0 +1,87 @@
+"""
+Measures the peak memory of every phase of the compiler on large generated
+programs.
+
+    python -m benchmarks.memory [--sites N] [--save FILE] [--compare FILE]
+
+Peaks are measured with tracemalloc, see cma.instrumentation, and are the
+bytes allocated on top of what was in use when the phase started. --sites
+also lists the lines which allocated the most memory that is still alive at
+the end of each phase. Baselines work like in benchmarks.suite, the default
+tolerance is smaller since the numbers hardly vary between runs.
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import asdict
+from typing import Dict, Tuple
+
+from benchmarks.generator import Shape, program
+from benchmarks.suite import compare
+from cma.compiler import compile_statements
+from cma.instrumentation import Instrumentation
+from cma.options import Options
+
+# pyparsing is much slower than the hand-written frontend, so its program
+# is smaller
+WORKLOADS: Dict[str, Tuple[Shape, str]] = {
+    "flat": (Shape(statements=5000, expression_depth=2, nesting=0), "pratt"),
+    "expressions": (Shape(statements=500, expression_depth=8, nesting=0), "pratt"),
+    "nested": (
+        Shape(statements=200, expression_depth=2, nesting=5, block_size=2),
+        "pratt",
+    ),
+    "pyparsing": (Shape(statements=30, expression_depth=2, nesting=1), "pyparsing"),
+}
+
+
+def measure(shape: Shape, frontend: str, seed: int = 0, top: int = 10):
+    source, environment = program(shape, seed)
+    instrumentation = Instrumentation(memory=True, top=top)
+    options = Options(frontend=frontend, simplify=True, peephole=True)
+    compile_statements(source, environment, options, instrumentation)
+    return instrumentation.memory_phases
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.memory")
+    parser.add_argument("--sites", type=int, default=0, help="sites per phase")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+    new = {"seed": args.seed, "workloads": {}}
+    for name, (shape, frontend) in WORKLOADS.items():
+        phases = measure(shape, frontend, args.seed, max(args.sites, 1))
+        new["workloads"][name] = {
+            "shape": {**asdict(shape), "frontend": frontend},
+            "bytes": {phase: stats.peak for phase, stats in phases.items()},
+        }
+        peaks = ", ".join(
+            f"{phase} {stats.peak / 1024:.0f}" for phase, stats in phases.items()
+        )
+        print(f"{name}: {peaks} (KiB)")
+        for phase, stats in phases.items():
+            for site, size, count in stats.top(args.sites):
+                print(f"    {phase:9} {size / 1024:8.0f} KiB {count:8} blocks  {site}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(new, file, indent=2)
+    if old is not None:
+        regressions = compare(old, new, args.tolerance, metric="bytes")
+        for name, phase, ratio in regressions:
+            print(f"regression: {name} {phase} {ratio:.2f}x", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
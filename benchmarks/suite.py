@@ -0,0 +1,160 @@
+"""
+Times the phases of the compiler on generated programs of several shapes.
+
+    python -m benchmarks.suite [--save FILE] [--compare FILE] [--tolerance T]
+
+With --save the results are written to a JSON baseline, with --compare they
+are checked against one: a phase which got slower than tolerance allows (20 %
+by default) is reported as a regression and the exit status is 1. Every
+phase reports the best of several runs. Parsing uses the hand-written
+frontend, whose tokenizer can be timed on its own.
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import asdict
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.generator import Shape, program
+from cma.backend import code, link
+from cma.pratt_frontend import Parser, tokenize
+
+WORKLOADS = {
+    "flat": Shape(statements=2000, expression_depth=2, nesting=0),
+    "expressions": Shape(statements=300, expression_depth=7, nesting=0),
+    "nested": Shape(statements=100, expression_depth=2, nesting=5, block_size=2),
+    "chains": Shape(statements=1000, expression_depth=2, nesting=1, chain_length=8),
+}
+PHASES = ("tokenize", "parse", "codegen", "link")
+
+# phase -> seconds
+Timings = Dict[str, float]
+
+
+def best_of(repeat: int, setup: Callable, run: Callable) -> float:
+    # setup is not timed, its result is passed to run
+    best = float("inf")
+    for _ in range(repeat):
+        argument = setup()
+        start = perf_counter()
+        run(argument)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def parse(parser: Parser):
+    node = parser.statement_sequence()
+    parser.expect_end()
+    return node
+
+
+def measure(shape: Shape, seed: int = 0, repeat: int = 5) -> Timings:
+    source, environment = program(shape, seed)
+    node = parse(Parser(source))
+    symbolic_code = list(code(node, environment))
+    return {
+        "tokenize": best_of(repeat, lambda: source, tokenize),
+        "parse": best_of(repeat, lambda: Parser(source), parse),
+        "codegen": best_of(repeat, lambda: node, lambda n: list(code(n, environment))),
+        "link": best_of(repeat, lambda: symbolic_code, link),
+    }
+
+
+def run_suite(
+    workloads: Dict[str, Shape] = WORKLOADS, seed: int = 0, repeat: int = 5
+) -> Dict[str, Timings]:
+    return {name: measure(shape, seed, repeat) for name, shape in workloads.items()}
+
+
+def baseline(
+    results: Dict[str, Timings], workloads: Dict[str, Shape] = WORKLOADS, seed: int = 0
+):
+    """
+    The JSON object stored by --save, which includes the shapes and seed so
+    that it is clear what was measured.
+    """
+    return {
+        "seed": seed,
+        "workloads": {
+            name: {"shape": asdict(workloads[name]), "seconds": timings}
+            for name, timings in results.items()
+        },
+    }
+
+
+def ratio(value: float, before: float) -> float:
+    # a phase which took no measurable time before is not compared
+    return value / before if before else 1.0
+
+
+def compare(
+    old: dict, new: dict, tolerance: float = 0.2, metric: str = "seconds"
+) -> List[Tuple[str, str, float]]:
+    """
+    Returns (workload, phase, ratio) for every phase of the baseline new
+    whose metric is more than 1 + tolerance times as large as in old.
+    Workloads which were generated from a different shape or seed are not
+    compared, nor are phases which are missing on either side.
+    """
+    regressions = []
+    if old["seed"] != new["seed"]:
+        return regressions
+    for name, entry in new["workloads"].items():
+        before = old["workloads"].get(name)
+        if before is None or before["shape"] != entry["shape"]:
+            continue
+        old_values = before.get(metric, {})
+        for phase, value in entry.get(metric, {}).items():
+            if phase not in old_values:
+                continue
+            change = ratio(value, old_values[phase])
+            if change > 1 + tolerance:
+                regressions.append((name, phase, change))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+    new = baseline(run_suite(seed=args.seed, repeat=args.repeat), seed=args.seed)
+
+    width = 10 if old is None else 17
+    print(f"{'':12}" + "".join(f"{phase:>{width}}" for phase in PHASES))
+    for name, entry in new["workloads"].items():
+        columns = []
+        for phase in PHASES:
+            seconds = entry["seconds"][phase]
+            column = f"{seconds * 1000:.1f}"
+            if old is not None and name in old["workloads"]:
+                before = old["workloads"][name].get("seconds", {}).get(phase)
+                if before is not None:
+                    column += f" ({ratio(seconds, before):.2f}x)"
+            columns.append(f"{column:>{width}}")
+        print(f"{name:12}" + "".join(columns))
+    print("milliseconds" + (", relative to the baseline" if old is not None else ""))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(new, file, indent=2)
+    if old is not None:
+        regressions = compare(old, new, args.tolerance)
+        for name, phase, change in regressions:
+            print(f"regression: {name} {phase} {change:.2f}x", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+import unittest
+
+from benchmarks.generator import Shape
+from benchmarks.suite import PHASES, baseline, compare, run_suite
+
+
+class TestSuite(unittest.TestCase):
+    def test_run_suite(self):
+        workloads = {"tiny": Shape(statements=3)}
+        results = run_suite(workloads, repeat=1)
+        self.assertEqual(list(results["tiny"]), list(PHASES))
+        self.assertTrue(all(seconds > 0 for seconds in results["tiny"].values()))
+
+    def test_compare(self):
+        workloads = {"a": Shape(statements=1), "b": Shape(statements=2)}
+        seconds = {"parse": 1.0, "codegen": 2.0}
+        old = baseline({"a": seconds, "b": seconds}, workloads)
+        slower = {"parse": 1.1, "codegen": 3.0}
+        new = baseline({"a": slower, "b": slower}, workloads)
+        self.assertEqual(
+            compare(old, new), [("a", "codegen", 1.5), ("b", "codegen", 1.5)]
+        )
+        self.assertEqual(compare(old, new, tolerance=0.05)[0], ("a", "parse", 1.1))
+        self.assertEqual(compare(new, old), [])
+        # workloads which were generated differently are not compared
+        workloads["b"] = Shape(statements=3)
+        self.assertEqual(len(compare(old, baseline({"b": slower}, workloads))), 0)
+        self.assertEqual(compare(old, baseline({"a": slower}, workloads, seed=1)), [])
+
+    def test_compare_missing_and_zero(self):
+        workloads = {"a": Shape(statements=1)}
+        old = baseline({"a": {"parse": 0.0}}, workloads)
+        new = baseline({"a": {"parse": 1.0, "link": 5.0}}, workloads)
+        self.assertEqual(compare(old, new), [])
+        self.assertEqual(compare(new, old), [])
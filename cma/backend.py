@@ -1,13 +1,15 @@
-from collections import deque
-from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Tuple, Union
-from weakref import WeakKeyDictionary
+from dataclasses import dataclass, field, fields, is_dataclass
+from functools import cached_property, lru_cache
+from itertools import count
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from typing import Union
 
 from cma.frontend import (
     AddressOf,
     ArrayAccess,
     Assignment,
     BinaryOp,
+    Case,
     Constant,
     For,
     FreeCall,
@@ -23,10 +25,19 @@ from cma.frontend import (
     UnaryOp,
     While,
 )
+from cma.instructions import Instruction, Opcode, loadc
+from util.dispatch import DispatchTable
 
 
 class SymbolicAddress:
-    pass
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        # labels of one code generation are numbered densely from 0
+        self.id = id
+
+    def __repr__(self):
+        return f"SymbolicAddress({self.id})"
 
 
 Datatype = Union["Array", "Basic", "Struct", "Pointer", "StructByName"]
@@ -44,12 +55,19 @@ class Array:
     datatype: Datatype
     length: int
 
+    @cached_property
+    def size(self):
+        return sizeof(self.datatype) * self.length
+
 
 @dataclass(frozen=True)
 class Basic:
     pass
 
 
+BASIC = Basic()
+
+
 @dataclass(frozen=True)
 class Pointer:
     datatype: Datatype
@@ -68,256 +86,873 @@ class Struct:
         for name, field_type in fields:
             self.fields[name] = StructEntry(offset, field_type)
             offset += sizeof(field_type)
+        self.size = offset
 
 
 @dataclass(frozen=True)
 class LazyStruct:
     struct: Callable[[], Struct]
 
+    @cached_property
+    def resolved(self) -> Struct:
+        # the factory is only called once
+        return self.struct()
+
     @property
     def fields(self):
-        return self.struct().fields
+        return self.resolved.fields
+
+    @property
+    def size(self):
+        return self.resolved.size
+
+
+@dataclass
+class Context:
+    """
+    State which is shared by the code functions during one code generation.
+    """
+
+    labels: Iterator[int] = field(default_factory=count)
+    # id of an AST node -> its datatype, only valid while the AST is alive
+    types: Dict[int, Datatype] = field(default_factory=dict)
+    # whether conditions evaluate && and || lazily, see Options
+    short_circuit: bool = False
+    # whether constant parts of addresses are computed statically, see Options
+    fold_addresses: bool = False
+    # whether loops test their condition at the bottom, see code_while
+    rotate_loops: bool = False
+
+    def label(self):
+        return SymbolicAddress(next(self.labels))
 
 
 BINARY_OP_TO_INSTR = {
-    "*": "mul",
-    "/": "div",
-    "%": "mod",
-    "+": "add",
-    "-": "sub",
-    "<": "le",
-    "<=": "leq",
-    ">": "gr",
-    ">=": "geq",
-    "==": "eq",
-    "!=": "neq",
-    "^": "xor",
-    "&&": "and",
-    "||": "or",
+    "*": Instruction(Opcode.MUL),
+    "/": Instruction(Opcode.DIV),
+    "%": Instruction(Opcode.MOD),
+    "+": Instruction(Opcode.ADD),
+    "-": Instruction(Opcode.SUB),
+    "<": Instruction(Opcode.LE),
+    "<=": Instruction(Opcode.LEQ),
+    ">": Instruction(Opcode.GR),
+    ">=": Instruction(Opcode.GEQ),
+    "==": Instruction(Opcode.EQ),
+    "!=": Instruction(Opcode.NEQ),
+    "^": Instruction(Opcode.XOR),
+    "&&": Instruction(Opcode.AND),
+    "||": Instruction(Opcode.OR),
 }
 
-UNARY_OP_TO_INSTR = {"-": "neg", "!": "not"}
-
-
-def code_l(node: Any, environment: Dict[str, EnvEntry]):
-    if isinstance(node, Identifier):
-        yield f"loadc {environment[node.name].address}"
-    elif isinstance(node, ArrayAccess):
-        yield from code_r(node.accessee, environment)
-        yield from code_r(node.expr, environment)
-        yield f"loadc {sizeof(datatype(node, environment))}"
-        yield "mul"
-        yield "add"
-    elif isinstance(node, StructAccess):
-        yield from code_l(node.accessee, environment)
-        yield f"loadc {datatype(node.accessee, environment).fields[node.field.name].offset}"
-        yield "add"
-    elif isinstance(node, PointerDereference):
-        yield from code_r(node.pointer, environment)
-    elif isinstance(node, StructPointerAccess):
-        yield from code_r(node.pointer, environment)
-        yield f"loadc {datatype(node.pointer, environment).datatype.fields[node.field.name].offset}"
-        yield "add"
+# the comparison which holds where the one of the operator does not
+NEGATED_COMPARISON = {
+    "<": Instruction(Opcode.GEQ),
+    "<=": Instruction(Opcode.GR),
+    ">": Instruction(Opcode.LEQ),
+    ">=": Instruction(Opcode.LE),
+    "==": Instruction(Opcode.NEQ),
+    "!=": Instruction(Opcode.EQ),
+}
+
+UNARY_OP_TO_INSTR = {"-": Instruction(Opcode.NEG), "!": Instruction(Opcode.NOT)}
+
+# instructions without operand are shared
+LOAD = Instruction(Opcode.LOAD)
+STORE = Instruction(Opcode.STORE)
+POP = Instruction(Opcode.POP)
+DUP = Instruction(Opcode.DUP)
+NEW = Instruction(Opcode.NEW)
+ADD = BINARY_OP_TO_INSTR["+"]
+MUL = BINARY_OP_TO_INSTR["*"]
+SUB = BINARY_OP_TO_INSTR["-"]
+LE = BINARY_OP_TO_INSTR["<"]
+GEQ = BINARY_OP_TO_INSTR[">="]
+EQ = BINARY_OP_TO_INSTR["=="]
+NOT = UNARY_OP_TO_INSTR["!"]
+
+
+CODE_L = DispatchTable()
+CODE_R = DispatchTable()
+CODE = DispatchTable()
+SIZEOF = DispatchTable()
+DATATYPE = DispatchTable()
+
+# datatypes for which code_r does not need to check for arrays
+SCALARS = (Basic, Pointer)
+# the code function of a table, for error messages
+TABLE_NAMES = {id(CODE_L): "code_l", id(CODE_R): "code_r", id(CODE): "code"}
+
+
+def handle(
+    table: DispatchTable, node: Any, environment: Dict[str, EnvEntry], context: Context
+) -> Iterator:
+    """
+    Calls the handler for node from table, e.g. CODE_R for code_r. Values of
+    type array are addressed by their start, so code_r uses code_l for them.
+    """
+    if table is CODE_R and isinstance(
+        datatype(node, environment, context.types), Array
+    ):
+        table = CODE_L
+    try:
+        handler = table[type(node)]
+    except KeyError:
+        name = TABLE_NAMES[id(table)]
+        raise AssertionError(f"Cannot generate {name} for {repr(node)}") from None
+    return handler(node, environment, context)
+
+
+def emit(handler: Iterator, environment: Dict[str, EnvEntry], context: Context):
+    """
+    Runs the generator of a handler and yields its instructions. Handlers do
+    not generate the code of their children themselves, they yield the
+    table and the child instead, such as (CODE_R, node.left), or a generator
+    which does it, which is then run on an explicit stack. Thus every
+    instruction is passed on only once, however deep the AST is nested, and
+    there is no recursion.
+    """
+    types = context.types
+    # the handlers waiting for the one which is running
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    while True:
+        for item in handler:
+            if type(item) is Instruction:
+                yield item
+                continue
+            push(handler)
+            if type(item) is not tuple:
+                # the generator of a helper, such as jump_unless
+                handler = item
+                break
+            table, node = item
+            child = table.get(type(node))
+            if child is None or (
+                table is CODE_R and type(types.get(id(node))) not in SCALARS
+            ):
+                # subclasses, errors and arrays
+                handler = handle(table, node, environment, context)
+            else:
+                handler = child(node, environment, context)
+            break
+        else:
+            if not stack:
+                return
+            handler = pop()
+
+
+def code_l(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    return emit(handle(CODE_L, node, environment, context), environment, context)
+
+
+@CODE_L.register(Identifier)
+def code_l_identifier(
+    node: Identifier, environment: Dict[str, EnvEntry], context: Context
+):
+    yield loadc(environment[node.name].address)
+
+
+def constant_offset(node: Any, environment: Dict[str, EnvEntry], context: Context):
+    """
+    Splits the address of an access chain into a part computed at runtime
+    and a constant offset. Returns the table and node which compute the
+    former, e.g. (CODE_L, s) and the offset of .a[3].b for s.a[3].b, or
+    (CODE_R, p) and the offset of .b for p->b.
+    """
+    types = context.types
+    offset = 0
+    while True:
+        if isinstance(node, StructAccess):
+            struct_type = datatype(node.accessee, environment, types)
+            offset += struct_type.fields[node.field.name].offset
+            node = node.accessee
+        elif isinstance(node, ArrayAccess) and isinstance(node.expr, Constant):
+            offset += node.expr.value * sizeof(datatype(node, environment, types))
+            node = node.accessee
+            if not isinstance(datatype(node, environment, types), Array):
+                return CODE_R, node, offset
+        elif isinstance(node, StructPointerAccess):
+            struct_type = datatype(node.pointer, environment, types).datatype
+            offset += struct_type.fields[node.field.name].offset
+            return CODE_R, node.pointer, offset
+        else:
+            return CODE_L, node, offset
+
+
+def code_l_folded(node: Any, environment: Dict[str, EnvEntry], context: Context):
+    table, base, offset = constant_offset(node, environment, context)
+    if table is CODE_L and isinstance(base, Identifier):
+        yield loadc(environment[base.name].address + offset)
+        return
+    yield table, base
+    if offset:
+        yield loadc(offset)
+        yield ADD
+
+
+@CODE_L.register(ArrayAccess)
+def code_l_array_access(
+    node: ArrayAccess, environment: Dict[str, EnvEntry], context: Context
+):
+    if context.fold_addresses and isinstance(node.expr, Constant):
+        yield code_l_folded(node, environment, context)
+        return
+    yield CODE_R, node.accessee
+    yield CODE_R, node.expr
+    size = sizeof(datatype(node, environment, context.types))
+    if size != 1 or not context.fold_addresses:
+        yield loadc(size)
+        yield MUL
+    yield ADD
+
+
+@CODE_L.register(StructAccess)
+def code_l_struct_access(
+    node: StructAccess, environment: Dict[str, EnvEntry], context: Context
+):
+    if context.fold_addresses:
+        yield code_l_folded(node, environment, context)
+        return
+    yield CODE_L, node.accessee
+    struct_type = datatype(node.accessee, environment, context.types)
+    yield loadc(struct_type.fields[node.field.name].offset)
+    yield ADD
+
+
+@CODE_L.register(PointerDereference)
+def code_l_pointer_dereference(
+    node: PointerDereference, environment: Dict[str, EnvEntry], context: Context
+):
+    yield CODE_R, node.pointer
+
+
+@CODE_L.register(StructPointerAccess)
+def code_l_struct_pointer_access(
+    node: StructPointerAccess, environment: Dict[str, EnvEntry], context: Context
+):
+    if context.fold_addresses:
+        yield code_l_folded(node, environment, context)
+        return
+    yield CODE_R, node.pointer
+    struct_type = datatype(node.pointer, environment, context.types).datatype
+    yield loadc(struct_type.fields[node.field.name].offset)
+    yield ADD
+
+
+def code_r(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    return emit(handle(CODE_R, node, environment, context), environment, context)
+
+
+@CODE_R.register(BinaryOp)
+def code_r_binary_op(
+    node: BinaryOp, environment: Dict[str, EnvEntry], context: Context
+):
+    yield CODE_R, node.left
+    yield CODE_R, node.right
+    yield BINARY_OP_TO_INSTR[node.op]
+
+
+@CODE_R.register(UnaryOp)
+def code_r_unary_op(node: UnaryOp, environment: Dict[str, EnvEntry], context: Context):
+    yield CODE_R, node.expr
+    yield UNARY_OP_TO_INSTR[node.op]
+
+
+@CODE_R.register(Constant)
+def code_r_constant(node: Constant, environment: Dict[str, EnvEntry], context: Context):
+    yield loadc(node.value)
+
+
+@CODE_R.register(Assignment)
+def code_r_assignment(
+    node: Assignment, environment: Dict[str, EnvEntry], context: Context
+):
+    yield CODE_R, node.right
+    yield CODE_L, node.left
+    yield STORE
+
+
+@CODE_R.register(MallocCall)
+def code_r_malloc_call(
+    node: MallocCall, environment: Dict[str, EnvEntry], context: Context
+):
+    yield CODE_R, node.expr
+    yield NEW
+
+
+@CODE_R.register(AddressOf)
+def code_r_address_of(
+    node: AddressOf, environment: Dict[str, EnvEntry], context: Context
+):
+    yield CODE_L, node.value
+
+
+@CODE_R.register(object)
+def code_r_load(node: Any, environment: Dict[str, EnvEntry], context: Context):
+    yield CODE_L, node
+    yield LOAD
+
+
+def check(start: int, end: int, b: SymbolicAddress, context: Context):
+    a = context.label()
+    yield DUP
+    yield loadc(start)
+    yield GEQ
+    yield Instruction(Opcode.JUMPZ, a)
+    yield DUP
+    yield loadc(end)
+    yield LE
+    yield Instruction(Opcode.JUMPZ, a)
+    yield Instruction(Opcode.JUMPI, b)
+    yield Instruction(Opcode.LABEL, a)
+    yield POP
+    yield loadc(end)
+    yield Instruction(Opcode.JUMPI, b)
+
+
+def is_logical(node: Any):
+    return isinstance(node, BinaryOp) and node.op in ("&&", "||")
+
+
+def jump_unless(node: Any, label: SymbolicAddress, context: Context):
+    """
+    Jumps to label if node evaluates to 0 and continues otherwise, with the
+    operands of && and || evaluated only as far as needed.
+    """
+    if is_logical(node) and node.op == "&&":
+        yield jump_unless(node.left, label, context)
+        yield jump_unless(node.right, label, context)
+    elif is_logical(node):
+        true = context.label()
+        yield jump_if(node.left, true, context)
+        yield jump_unless(node.right, label, context)
+        yield Instruction(Opcode.LABEL, true)
+    elif isinstance(node, UnaryOp) and node.op == "!":
+        yield jump_if(node.expr, label, context)
     else:
-        raise AssertionError(f"Cannot generate code_l for {repr(node)}")
-
-
-def code_r(node: Any, environment: Dict[str, EnvEntry]):
-    if isinstance(datatype(node, environment), Array):
-        yield from code_l(node, environment)
-    elif isinstance(node, BinaryOp):
-        yield from code_r(node.left, environment)
-        yield from code_r(node.right, environment)
-        yield BINARY_OP_TO_INSTR[node.op]
-    elif isinstance(node, UnaryOp):
-        yield from code_r(node.expr, environment)
-        yield UNARY_OP_TO_INSTR[node.op]
-    elif isinstance(node, Constant):
-        yield f"loadc {node.value}"
-    elif isinstance(node, Assignment):
-        yield from code_r(node.right, environment)
-        yield from code_l(node.left, environment)
-        yield "store"
-    elif isinstance(node, MallocCall):
-        yield from code_r(node.expr, environment)
-        yield "new"
-    elif isinstance(node, AddressOf):
-        yield from code_l(node.value, environment)
+        yield CODE_R, node
+        yield Instruction(Opcode.JUMPZ, label)
+
+
+def jump_if(node: Any, label: SymbolicAddress, context: Context):
+    """
+    Jumps to label unless node evaluates to 0, see jump_unless.
+    """
+    if is_logical(node) and node.op == "||":
+        yield jump_if(node.left, label, context)
+        yield jump_if(node.right, label, context)
+    elif is_logical(node):
+        false = context.label()
+        yield jump_unless(node.left, false, context)
+        yield jump_if(node.right, label, context)
+        yield Instruction(Opcode.LABEL, false)
+    elif isinstance(node, UnaryOp) and node.op == "!":
+        yield jump_unless(node.expr, label, context)
     else:
-        yield from code_l(node, environment)
-        yield "load"
-
-
-def check(start: int, end: int, b: SymbolicAddress):
-    a = SymbolicAddress()
-    yield "dup"
-    yield f"loadc {start}"
-    yield "geq"
-    yield "jumpz", a
-    yield "dup"
-    yield f"loadc {end}"
-    yield "le"
-    yield "jumpz", a
-    yield "jumpi", b
-    yield a
-    yield "pop"
-    yield f"loadc {end}"
-    yield "jumpi", b
-
-
-def code(node: Any, environment: Dict[str, EnvEntry]):
-    if isinstance(node, PlainStatement):
-        yield from code_r(node.expr, environment)
-        yield "pop"
-    elif isinstance(node, StatementSequence):
-        for statement in node:
-            yield from code(statement, environment)
-    elif isinstance(node, IfElse) and node.else_branch is None:
-        a = SymbolicAddress()
-        yield from code_r(node.expr, environment)
-        yield "jumpz", a
-        yield from code(node.then_branch, environment)
-        yield a
-    elif isinstance(node, IfElse) and node.else_branch is not None:
-        a = SymbolicAddress()
-        b = SymbolicAddress()
-        yield from code_r(node.expr, environment)
-        yield "jumpz", a
-        yield from code(node.then_branch, environment)
-        yield "jump", b
-        yield a
-        yield from code(node.else_branch, environment)
-        yield b
-    elif isinstance(node, While):
-        a = SymbolicAddress()
-        b = SymbolicAddress()
-        yield a
-        yield from code_r(node.expr, environment)
-        yield "jumpz", b
-        yield from code(node.body, environment)
-        yield "jump", a
-        yield b
-    elif isinstance(node, For):
-        a = SymbolicAddress()
-        b = SymbolicAddress()
-        yield from code_r(node.expr1, environment)
-        yield "pop"
-        yield a
-        yield from code_r(node.expr2, environment)
-        yield "jumpz", b
-        yield from code(node.body, environment)
-        yield from code_r(node.expr3, environment)
-        yield "pop"
-        yield "jump", a
-        yield b
-    elif isinstance(node, Switch):
-        b = SymbolicAddress()
-        cs = []
-        d = SymbolicAddress()
-        k = len(node.cases)
-        yield from code_r(node.expr, environment)
-        yield from check(0, k, b)
-
-        # cases
-        for case in node.cases:
-            c = SymbolicAddress()
-            cs.append(c)
-            yield c
-            yield from code(case.body, environment)
-            yield "jump", d
-
-        # default case
-        c = SymbolicAddress()
-        cs.append(c)
-        yield c
-        yield from code(node.default_case, environment)
-        yield "jump", d
-
-        # jump table
-        yield b
-        for c in cs:
-            yield "jump", c
-
-        yield d
-    elif isinstance(node, FreeCall):
-        # noop lulz
-        yield from code_r(node.expr, environment)
-        yield "pop"
+        yield CODE_R, node
+        yield NOT
+        yield Instruction(Opcode.JUMPZ, label)
+
+
+def condition(node: Any, label: SymbolicAddress, context: Context):
+    # jumps to label if the condition node does not hold
+    if context.short_circuit and is_logical(node):
+        yield jump_unless(node, label, context)
+    else:
+        yield CODE_R, node
+        yield Instruction(Opcode.JUMPZ, label)
+
+
+def back_edge(node: Any, label: SymbolicAddress, context: Context):
+    # jumps to label if the condition node holds, with a single jumpz
+    if context.short_circuit and is_logical(node):
+        yield jump_if(node, label, context)
+    elif isinstance(node, BinaryOp) and node.op in NEGATED_COMPARISON:
+        yield CODE_R, node.left
+        yield CODE_R, node.right
+        yield NEGATED_COMPARISON[node.op]
+        yield Instruction(Opcode.JUMPZ, label)
+    elif isinstance(node, UnaryOp) and node.op == "!":
+        yield CODE_R, node.expr
+        yield Instruction(Opcode.JUMPZ, label)
+    else:
+        yield CODE_R, node
+        yield NOT
+        yield Instruction(Opcode.JUMPZ, label)
+
+
+def code(
+    node: Any, environment: Dict[str, EnvEntry], context: Optional[Context] = None
+):
+    if context is None:
+        context = Context()
+        annotate(node, environment, context.types)
+    return emit(handle(CODE, node, environment, context), environment, context)
+
+
+@CODE.register(PlainStatement, FreeCall)
+def code_plain_statement(
+    node: PlainStatement, environment: Dict[str, EnvEntry], context: Context
+):
+    # free is a noop lulz
+    yield CODE_R, node.expr
+    yield POP
+
+
+@CODE.register(StatementSequence)
+def code_statement_sequence(
+    node: StatementSequence, environment: Dict[str, EnvEntry], context: Context
+):
+    for statement in node:
+        yield CODE, statement
+
+
+@CODE.register(IfElse)
+def code_if_else(node: IfElse, environment: Dict[str, EnvEntry], context: Context):
+    if node.else_branch is None:
+        a = context.label()
+        yield from condition(node.expr, a, context)
+        yield CODE, node.then_branch
+        yield Instruction(Opcode.LABEL, a)
     else:
-        raise AssertionError(f"Cannot generate code for {repr(node)}")
+        a = context.label()
+        b = context.label()
+        yield from condition(node.expr, a, context)
+        yield CODE, node.then_branch
+        yield Instruction(Opcode.JUMP, b)
+        yield Instruction(Opcode.LABEL, a)
+        yield CODE, node.else_branch
+        yield Instruction(Opcode.LABEL, b)
+
+
+@CODE.register(While)
+def code_while(node: While, environment: Dict[str, EnvEntry], context: Context):
+    """
+    A rotated loop tests its condition once in front of the loop and then
+    at the bottom, so that each iteration only takes the conditional jump
+    back instead of a conditional and an unconditional jump.
+    """
+    a = context.label()
+    b = context.label()
+    if context.rotate_loops:
+        yield from condition(node.expr, b, context)
+        yield Instruction(Opcode.LABEL, a)
+        yield CODE, node.body
+        yield from back_edge(node.expr, a, context)
+        yield Instruction(Opcode.LABEL, b)
+        return
+    yield Instruction(Opcode.LABEL, a)
+    yield from condition(node.expr, b, context)
+    yield CODE, node.body
+    yield Instruction(Opcode.JUMP, a)
+    yield Instruction(Opcode.LABEL, b)
+
+
+@CODE.register(For)
+def code_for(node: For, environment: Dict[str, EnvEntry], context: Context):
+    a = context.label()
+    b = context.label()
+    yield CODE_R, node.expr1
+    yield POP
+    if context.rotate_loops:
+        # see code_while
+        yield from condition(node.expr2, b, context)
+        yield Instruction(Opcode.LABEL, a)
+        yield CODE, node.body
+        yield CODE_R, node.expr3
+        yield POP
+        yield from back_edge(node.expr2, a, context)
+        yield Instruction(Opcode.LABEL, b)
+        return
+    yield Instruction(Opcode.LABEL, a)
+    yield from condition(node.expr2, b, context)
+    yield CODE, node.body
+    yield CODE_R, node.expr3
+    yield POP
+    yield Instruction(Opcode.JUMP, a)
+    yield Instruction(Opcode.LABEL, b)
+
+
+# cost model of the switch lowering, in instructions: a jump table has one
+# jump per value in its range, on top of the range check and the default
+TABLE_OVERHEAD = 16
+# dup, loadc, eq, jumpz, pop and jump for a single value
+COMPARE_SIZE = 6
+# a branch of the compare tree between two clusters, its size plus a penalty
+# for the time it takes to pass
+BRANCH_COST = 8
+
+
+def switch_clusters(values: List[int]) -> List[Tuple[int, int]]:
+    """
+    Partitions the sorted case values into ranges (lo, hi) which are
+    dispatched by a jump table, or by a comparison if lo == hi, so that the
+    cost of the tables, comparisons and branches between them is minimal.
+    """
+    n = len(values)
+    # cost of the best partition of values[:i] and where its last range starts
+    best = [0] + [None] * n
+    start = [0] * (n + 1)
+    for i in range(1, n + 1):
+        for j in range(i):
+            if i - j == 1:
+                cost = COMPARE_SIZE
+            else:
+                cost = values[i - 1] - values[j] + 1 + TABLE_OVERHEAD
+            cost += best[j] + BRANCH_COST
+            if best[i] is None or cost < best[i]:
+                best[i] = cost
+                start[i] = j
+    clusters = []
+    i = n
+    while i:
+        clusters.append((values[start[i]], values[i - 1]))
+        i = start[i]
+    return clusters[::-1]
+
+
+def dispatch(
+    clusters: List[Tuple[int, int]],
+    labels: Dict[int, SymbolicAddress],
+    miss: SymbolicAddress,
+    tables: List[Tuple[SymbolicAddress, int, int]],
+    context: Context,
+):
+    """
+    Jumps to the label of the value on top of the stack by a binary search
+    over the clusters. Case labels are entered with an empty stack, the
+    value is left on it when jumping to miss. Jump tables of the clusters
+    are added to tables, to be emitted later.
+    """
+    if len(clusters) > 1:
+        middle = len(clusters) // 2
+        right = context.label()
+        yield DUP
+        yield loadc(clusters[middle][0])
+        yield LE
+        yield Instruction(Opcode.JUMPZ, right)
+        yield from dispatch(clusters[:middle], labels, miss, tables, context)
+        yield Instruction(Opcode.LABEL, right)
+        yield from dispatch(clusters[middle:], labels, miss, tables, context)
+        return
+    ((lo, hi),) = clusters
+    if lo == hi:
+        yield DUP
+        yield loadc(lo)
+        yield EQ
+        yield Instruction(Opcode.JUMPZ, miss)
+        yield POP
+        yield Instruction(Opcode.JUMP, labels[lo])
+    else:
+        table = context.label()
+        tables.append((table, lo, hi))
+        if lo != 0:
+            yield loadc(lo)
+            yield SUB
+        yield from check(0, hi - lo + 1, table, context)
+
+
+@CODE.register(Switch)
+def code_switch(node: Switch, environment: Dict[str, EnvEntry], context: Context):
+    """
+    Cases 0 to k - 1 use a jump table as in the lecture. Otherwise the case
+    values are grouped into clusters by switch_clusters, which are found by
+    a binary search and use a jump table or a comparison each.
+    """
+    values = [case.value.value for case in node.cases]
+    if len(set(values)) != len(values):
+        raise AssertionError(f"Duplicate case value in {repr(node)}")
+    if sorted(values) != list(range(len(values))):
+        yield from code_sparse_switch(node, values, context)
+        return
+
+    b = context.label()
+    cs = []
+    d = context.label()
+    k = len(node.cases)
+    yield CODE_R, node.expr
+    yield from check(0, k, b, context)
+
+    # cases
+    for case in node.cases:
+        c = context.label()
+        cs.append(c)
+        yield Instruction(Opcode.LABEL, c)
+        yield CODE, case.body
+        yield Instruction(Opcode.JUMP, d)
+
+    # default case
+    c = context.label()
+    cs.append(c)
+    yield Instruction(Opcode.LABEL, c)
+    yield CODE, node.default_case
+    yield Instruction(Opcode.JUMP, d)
+
+    # jump table, in the order of the values
+    yield Instruction(Opcode.LABEL, b)
+    for value in range(k):
+        yield Instruction(Opcode.JUMP, cs[values.index(value)])
+    yield Instruction(Opcode.JUMP, cs[k])
+
+    yield Instruction(Opcode.LABEL, d)
+
+
+def code_sparse_switch(node: Switch, values: List[int], context: Context):
+    d = context.label()
+    labels = {value: context.label() for value in values}
+    default = context.label()
+    miss = context.label()
+    tables = []
+    yield CODE_R, node.expr
+    yield from dispatch(switch_clusters(sorted(values)), labels, miss, tables, context)
+
+    for case in node.cases:
+        yield Instruction(Opcode.LABEL, labels[case.value.value])
+        yield CODE, case.body
+        yield Instruction(Opcode.JUMP, d)
+
+    yield Instruction(Opcode.LABEL, default)
+    yield CODE, node.default_case
+    yield Instruction(Opcode.JUMP, d)
+
+    yield Instruction(Opcode.LABEL, miss)
+    yield POP
+    yield Instruction(Opcode.JUMP, default)
+    for table, lo, hi in tables:
+        yield Instruction(Opcode.LABEL, table)
+        for value in range(lo, hi + 1):
+            yield Instruction(Opcode.JUMP, labels.get(value, default))
+        yield Instruction(Opcode.JUMP, default)
+
+    yield Instruction(Opcode.LABEL, d)
 
 
 def sizeof(t: Datatype):
-    if isinstance(t, (Basic, Pointer)):
-        return 1
-    elif isinstance(t, Array):
-        return sizeof(t.datatype) * t.length
-    elif isinstance(t, (Struct, LazyStruct)):
-        return sum(sizeof(entry.datatype) for entry in t.fields.values())
-
-
-def datatype(node: Any, environment: Dict[str, EnvEntry]):
-    if isinstance(node, Identifier):
-        return environment[node.name].datatype
-    elif isinstance(node, PointerDereference):
-        pointer_type = datatype(node.pointer, environment)
-        if not isinstance(pointer_type, Pointer):
-            raise AssertionError(f"Expected {repr(node)} to be a pointer")
-        return pointer_type.datatype
-    elif isinstance(node, AddressOf):
-        value_type = datatype(node.value, environment)
-        return Pointer(value_type)
-    elif isinstance(node, ArrayAccess):
-        array_or_pointer_type = datatype(node.accessee, environment)
-        if not isinstance(array_or_pointer_type, (Pointer, Array)):
-            raise AssertionError(f"Expected {repr(node)} to be a pointer or array")
-        return array_or_pointer_type.datatype
-    elif isinstance(node, StructAccess):
-        struct_type = datatype(node.accessee, environment)
-        if not isinstance(struct_type, (Struct, LazyStruct)):
-            raise AssertionError(f"Expected {repr(node)} to be a struct")
-        return struct_type.fields[node.field.name].datatype
-    elif isinstance(node, StructPointerAccess):
-        struct_pointer_type = datatype(node.pointer, environment)
-        if not (
-            isinstance(struct_pointer_type, Pointer)
-            and isinstance(struct_pointer_type.datatype, (Struct, LazyStruct))
-        ):
-            raise AssertionError(f"Expected {repr(node)} to be a struct")
-        return struct_pointer_type.datatype.fields[node.field.name].datatype
-    else:
-        # TODO: Handle function return value, e.g. foo(42) -> bar
-        return Basic()
+    return SIZEOF[type(t)](t)
+
+
+SIZEOF.register(Basic, Pointer)(lambda t: 1)
+SIZEOF.register(Array, Struct, LazyStruct)(lambda t: t.size)
+
+
+def datatype(
+    node: Any,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]] = None,
+):
+    """
+    Returns the datatype of an expression. If types is given, datatypes are
+    looked up in it first and the ones computed are added, so that each node
+    of an accessor chain is only resolved once.
+    """
+    if types is not None:
+        result = types.get(id(node))
+        if result is not None:
+            return result
+
+    result = DATATYPE[type(node)](node, environment, types)
+
+    if types is not None:
+        types[id(node)] = result
+    return result
+
+
+@DATATYPE.register(Identifier)
+def datatype_identifier(
+    node: Identifier,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    return environment[node.name].datatype
+
+
+@DATATYPE.register(PointerDereference)
+def datatype_pointer_dereference(
+    node: PointerDereference,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    pointer_type = datatype(node.pointer, environment, types)
+    if not isinstance(pointer_type, Pointer):
+        raise AssertionError(f"Expected {repr(node)} to be a pointer")
+    return pointer_type.datatype
+
+
+@DATATYPE.register(AddressOf)
+def datatype_address_of(
+    node: AddressOf,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    value_type = datatype(node.value, environment, types)
+    return Pointer(value_type)
+
+
+@DATATYPE.register(ArrayAccess)
+def datatype_array_access(
+    node: ArrayAccess,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    array_or_pointer_type = datatype(node.accessee, environment, types)
+    if not isinstance(array_or_pointer_type, (Pointer, Array)):
+        raise AssertionError(f"Expected {repr(node)} to be a pointer or array")
+    return array_or_pointer_type.datatype
+
+
+@DATATYPE.register(StructAccess)
+def datatype_struct_access(
+    node: StructAccess,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    struct_type = datatype(node.accessee, environment, types)
+    if not isinstance(struct_type, (Struct, LazyStruct)):
+        raise AssertionError(f"Expected {repr(node)} to be a struct")
+    return struct_type.fields[node.field.name].datatype
+
+
+@DATATYPE.register(StructPointerAccess)
+def datatype_struct_pointer_access(
+    node: StructPointerAccess,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]],
+):
+    struct_pointer_type = datatype(node.pointer, environment, types)
+    if not (
+        isinstance(struct_pointer_type, Pointer)
+        and isinstance(struct_pointer_type.datatype, (Struct, LazyStruct))
+    ):
+        raise AssertionError(f"Expected {repr(node)} to be a struct")
+    return struct_pointer_type.datatype.fields[node.field.name].datatype
+
+
+@DATATYPE.register(object)
+def datatype_other(
+    node: Any, environment: Dict[str, EnvEntry], types: Optional[Dict[int, Datatype]]
+):
+    # TODO: Handle function return value, e.g. foo(42) -> bar
+    return BASIC
+
+
+STATEMENTS = (PlainStatement, IfElse, While, For, Switch, Case, FreeCall)
+# fields which hold struct field or function names rather than variables
+NAMES = ("field", "identifier")
+
+
+@lru_cache(maxsize=None)
+def traversal(cls: type) -> Optional[Tuple[bool, Tuple[str, ...]]]:
+    # whether nodes of a class are expressions and which fields hold subtrees
+    if not is_dataclass(cls):
+        return None
+    names = tuple(f.name for f in fields(cls) if f.name not in NAMES)
+    return not issubclass(cls, STATEMENTS), names
+
+
+def annotate(
+    node: Any,
+    environment: Dict[str, EnvEntry],
+    types: Optional[Dict[int, Datatype]] = None,
+):
+    """
+    Resolves the datatype of every expression in the AST once. Returns the
+    table from node ids to datatypes, which code generation reads from.
+    """
+    if types is None:
+        types = {}
+    # in pre-order, so reversed the children of a node come before it and
+    # its datatype is resolved from theirs, without recursion
+    expressions = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            # StatementSequence, Cases and FuncCallArguments
+            stack.extend(node)
+            continue
+        kind = traversal(type(node))
+        if kind is None:
+            continue
+        expression, names = kind
+        if expression:
+            expressions.append(node)
+        for name in names:
+            stack.append(getattr(node, name))
+    for node in reversed(expressions):
+        if id(node) not in types:
+            types[id(node)] = DATATYPE[type(node)](node, environment, types)
+    return types
+
+
+def link(
+    symbolic_code: Iterable[Instruction], labels: Optional[Dict[int, int]] = None
+) -> List[Instruction]:
+    """
+    Replaces symbolic addresses by real ones and drops the labels. Jumps to
+    labels which are not defined yet are emitted as they are and patched once
+    the whole program is through. If labels is given, it receives the
+    address of every label id.
+    """
+    code = []
+    # label id -> address and the label object defining it
+    addresses = []
+    definitions = []
+    # positions in code which reference a label defined later
+    fixups = []
+
+    for instruction in symbolic_code:
+        operand = instruction.operand
+        if instruction.opcode == Opcode.LABEL:
+            if operand.id >= len(addresses):
+                missing = operand.id + 1 - len(addresses)
+                addresses.extend([None] * missing)
+                definitions.extend([None] * missing)
+            elif definitions[operand.id] is not None:
+                raise AssertionError(f"Label {operand.id} defined twice")
+            addresses[operand.id] = len(code)
+            definitions[operand.id] = operand
+        elif isinstance(operand, SymbolicAddress):
+            if operand.id < len(addresses) and definitions[operand.id] is operand:
+                code.append(Instruction(instruction.opcode, addresses[operand.id]))
+            else:
+                fixups.append(len(code))
+                code.append(instruction)
+        else:
+            code.append(instruction)
+
+    for position in fixups:
+        instruction = code[position]
+        label = instruction.operand
+        if label.id >= len(addresses) or definitions[label.id] is not label:
+            raise AssertionError(f"Undefined label {label.id}")
+        code[position] = Instruction(instruction.opcode, addresses[label.id])
+
+    if labels is not None:
+        labels.update(
+            (label, address)
+            for label, address in enumerate(addresses)
+            if address is not None
+        )
+    return code
+
+
+def render(code):
+    """
+    Renders linked instructions in the textual CMa syntax.
+    """
+    return (str(instruction) for instruction in code)
 
 
 def render_symbolic_addresses(symbolic_code):
-    curr_real_address = 0
-    real_address_table = WeakKeyDictionary()
-    unprocessed_instructions = deque()
-
-    for line in symbolic_code:
-        if isinstance(line, SymbolicAddress):
-            # symbolic address -> set the real address of that address
-            real_address_table[line] = curr_real_address
-        else:
-            # instruction -> queue it and increment the curr_real_address
-            unprocessed_instructions.append(line)
-            curr_real_address += 1
-
-        # iterates until the queue is empty or until we hit a unresolved address
-        # effectively a noop when we're waiting for a symbolic address to be resolved
-        while unprocessed_instructions:
-            instruction = unprocessed_instructions.popleft()
-            if isinstance(instruction, tuple):
-                # tuple -> instruction references a symbolic address
-                opcode, address = instruction
-                if address not in real_address_table:
-                    # unresolved address -> put the line back to the front of the queue
-                    unprocessed_instructions.appendleft(instruction)
-                    # break out of the inner loop to spin the outer loop until the address is resolved
-                    break
-                else:
-                    yield f"{opcode} {real_address_table[address]}"
-            else:
-                # plain instruction
-                yield instruction
+    return render(link(symbolic_code))
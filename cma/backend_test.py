@@ -3,26 +3,43 @@ import unittest
 from cma.backend import (
     Array,
     Basic,
+    Context,
     EnvEntry,
     LazyStruct,
     Pointer,
     Struct,
+    SymbolicAddress,
+    annotate,
     code,
     code_r,
     datatype,
+    link,
+    render,
     render_symbolic_addresses,
     sizeof,
+    switch_clusters,
 )
+from cma.compiler import compile_statements
 from cma.frontend import (
     AddressOf,
     ArrayAccess,
+    Assignment,
+    BinaryOp,
     C,
     Constant,
     Identifier,
+    PlainStatement,
     PointerDereference,
+    StatementSequence,
     StructAccess,
     StructPointerAccess,
+    UnaryOp,
+    While,
 )
+from cma.instructions import Instruction, Opcode
+from cma.options import Options
+from cma.simplify import simplify
+from cma.vm import VMError, run
 
 
 def generate_expression_code(c_code, environment):
@@ -35,6 +52,17 @@ def generate_statement_code(c_code, environment):
     return list(render_symbolic_addresses(code(node, environment)))
 
 
+def context_code(c_code, environment, **flags):
+    """
+    The linked code of a statement sequence, generated with the flags of
+    Context which are given, e.g. short_circuit=True.
+    """
+    (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+    context = Context(**flags)
+    annotate(node, environment, context.types)
+    return link(code(node, environment, context))
+
+
 def basic_addr(addr: int):
     return EnvEntry(addr, Basic())
 
@@ -64,6 +92,87 @@ class TestExpressionCodeGeneration(unittest.TestCase):
         self.assertEqual(result, desired)
 
 
+class TestInstructions(unittest.TestCase):
+    def test_symbolic_code(self):
+        (node,) = C.Statement.parseString("if (x) x = 1;", parseAll=True)
+        environment = {"x": basic_addr(4)}
+        result = list(code(node, environment))
+        label = result[2].operand
+        self.assertIsInstance(label, SymbolicAddress)
+        desired = [
+            Instruction(Opcode.LOADC, 4),
+            Instruction(Opcode.LOAD),
+            Instruction(Opcode.JUMPZ, label),
+            Instruction(Opcode.LOADC, 1),
+            Instruction(Opcode.LOADC, 4),
+            Instruction(Opcode.STORE),
+            Instruction(Opcode.POP),
+            Instruction(Opcode.LABEL, label),
+        ]
+        self.assertEqual(result, desired)
+
+    def test_link(self):
+        a = SymbolicAddress(0)
+        symbolic_code = [
+            Instruction(Opcode.JUMP, a),
+            Instruction(Opcode.LOADC, 1),
+            Instruction(Opcode.LABEL, a),
+            Instruction(Opcode.POP),
+        ]
+        result = list(link(symbolic_code))
+        desired = [
+            Instruction(Opcode.JUMP, 2),
+            Instruction(Opcode.LOADC, 1),
+            Instruction(Opcode.POP),
+        ]
+        self.assertEqual(result, desired)
+        self.assertEqual([str(i) for i in result], ["jump 2", "loadc 1", "pop"])
+
+    def test_link_labels(self):
+        a, b = SymbolicAddress(0), SymbolicAddress(1)
+        symbolic_code = [
+            Instruction(Opcode.LABEL, a),
+            Instruction(Opcode.JUMPZ, b),
+            Instruction(Opcode.JUMP, a),
+            Instruction(Opcode.LABEL, b),
+        ]
+        labels = {}
+        result = list(render(link(symbolic_code, labels)))
+        self.assertEqual(result, ["jumpz 2", "jump 0"])
+        self.assertEqual(labels, {0: 0, 1: 2})
+
+    def test_link_undefined_label(self):
+        symbolic_code = [Instruction(Opcode.JUMP, SymbolicAddress(0))]
+        with self.assertRaises(AssertionError):
+            link(symbolic_code)
+        # a label of another code generation with the same id
+        symbolic_code.append(Instruction(Opcode.LABEL, SymbolicAddress(0)))
+        with self.assertRaises(AssertionError):
+            link(symbolic_code)
+
+    def test_labels_are_dense(self):
+        (node,) = C.Statement.parseString(
+            "while (x) if (x) x = 1; else x = 2;", parseAll=True
+        )
+        labels = {}
+        link(code(node, {"x": basic_addr(4)}), labels)
+        self.assertEqual(sorted(labels), [0, 1, 2, 3])
+
+
+class TestDispatch(unittest.TestCase):
+    def test_subclass_uses_handler_of_base_class(self):
+        class Answer(Constant):
+            pass
+
+        self.assertEqual(list(render(code_r(Answer(42), {}))), ["loadc 42"])
+
+    def test_unknown_node(self):
+        with self.assertRaises(AssertionError):
+            code(42, {})
+        with self.assertRaises(AssertionError):
+            list(code(StatementSequence(42), {}))
+
+
 class TestSizeof(unittest.TestCase):
     def test_array_of_stucts(self):
         data = Array(Struct(("a", Basic()), ("b", Pointer(Basic()))), 5)
@@ -77,6 +186,20 @@ class TestSizeof(unittest.TestCase):
         result = sizeof(data)
         self.assertEqual(result, desired)
 
+    def test_lazy_struct_is_resolved_once(self):
+        calls = []
+
+        def node():
+            calls.append(1)
+            return structs["node"]
+
+        structs = {}
+        structs["node"] = Struct(("v", Basic()), ("next", Pointer(LazyStruct(node))))
+        environment = {"p": EnvEntry(1, Pointer(structs["node"]))}
+        generate_expression_code("p->next->next->next->v", environment)
+        self.assertEqual(sizeof(structs["node"].fields["next"].datatype.datatype), 2)
+        self.assertEqual(len(calls), 1)
+
 
 class TestDatatype(unittest.TestCase):
     def test_basic(self):
@@ -132,6 +255,27 @@ class TestDatatype(unittest.TestCase):
         result = datatype(node, environment)
         self.assertEqual(result, desired)
 
+    def test_annotate(self):
+        (node,) = C.Statement.parseString("x = pt->b->a[i + 1];", parseAll=True)
+        structs = {}
+        structs["foo"] = Struct(
+            ("a", Array(Basic(), 7)), ("b", Pointer(LazyStruct(lambda: structs["foo"])))
+        )
+        environment = {
+            "x": basic_addr(0),
+            "i": basic_addr(1),
+            "pt": EnvEntry(3, Pointer(structs["foo"])),
+        }
+        types = annotate(node, environment)
+        access = node.expr.right
+        self.assertEqual(types[id(access)], Basic())
+        self.assertIs(types[id(access.accessee)], structs["foo"].fields["a"].datatype)
+        self.assertEqual(
+            types[id(access.accessee.pointer.pointer)], Pointer(structs["foo"])
+        )
+        # assignment, x, access, a, b, pt, i + 1, i, 1
+        self.assertEqual(len(types), 9)
+
 
 class TestStatementCodeGeneration(unittest.TestCase):
     def test_simple_statement_sequence(self):
@@ -340,3 +484,282 @@ class TestDataStructure(unittest.TestCase):
             "load",
         ]
         self.assertEqual(result, desired)
+
+
+class TestDeepNesting(unittest.TestCase):
+    # deeper than the recursion limit
+    DEPTH = 5000
+    SIMPLIFY = False
+
+    def prepare(self, node):
+        return simplify(node) if self.SIMPLIFY else node
+
+    def test_expression(self):
+        node = Identifier("x")
+        for _ in range(self.DEPTH):
+            node = BinaryOp(node, "+", Constant(1))
+        result = list(render(code_r(self.prepare(node), {"x": basic_addr(4)})))
+        self.assertEqual(result, ["loadc 4", "load"] + ["loadc 1", "add"] * self.DEPTH)
+
+    def test_statements(self):
+        node = PlainStatement(Assignment(Identifier("x"), Constant(0)))
+        for _ in range(self.DEPTH):
+            node = StatementSequence(While(Identifier("x"), node))
+        result = list(render(link(code(self.prepare(node), {"x": basic_addr(4)}))))
+        self.assertEqual(len(result), 4 * self.DEPTH + 4)
+        self.assertEqual(result[:3], ["loadc 4", "load", "jumpz " + str(len(result))])
+        self.assertEqual(result[-1], "jump 0")
+
+    def test_pointer_chain(self):
+        structs = {}
+        structs["node"] = Struct(
+            ("v", Basic()), ("n", Pointer(LazyStruct(lambda: structs["node"])))
+        )
+        node = Identifier("p")
+        for _ in range(self.DEPTH):
+            node = StructPointerAccess(node, Identifier("n"))
+        node = StructPointerAccess(node, Identifier("v"))
+        environment = {"p": EnvEntry(2, Pointer(structs["node"]))}
+        result = list(render(code_r(self.prepare(node), environment)))
+        self.assertEqual(result[:2], ["loadc 2", "load"])
+        self.assertEqual(len(result), 3 * self.DEPTH + 5)
+
+
+class TestDeepNestingSimplified(TestDeepNesting):
+    SIMPLIFY = True
+
+    def test_folding(self):
+        # alternates between -(1 + 1) and -(-2 + 1)
+        node = Constant(1)
+        for _ in range(self.DEPTH):
+            node = UnaryOp("-", BinaryOp(node, "+", Constant(1)))
+        self.assertEqual(simplify(PlainStatement(node)), PlainStatement(Constant(1)))
+
+
+class TestSwitchLowering(unittest.TestCase):
+    def run_switch(self, values, inputs):
+        cases = " ".join(f"case {v}: y = {i}; break;" for i, v in enumerate(values))
+        c_code = f"switch (x) {{ {cases} default: y = -1; }}"
+        (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+        environment = {"x": basic_addr(0), "y": basic_addr(1)}
+        program = link(code(node, environment))
+        for x in inputs:
+            memory = run(program, environment, {0: x}).memory
+            expected = values.index(x) if x in values else -1
+            self.assertEqual(memory[1], expected, f"x = {x}")
+            # the stack is empty again
+            self.assertEqual(run(program, environment, {0: x}).sp, 1)
+        return program
+
+    def test_clusters(self):
+        self.assertEqual(switch_clusters([]), [])
+        self.assertEqual(switch_clusters([1000]), [(1000, 1000)])
+        self.assertEqual(switch_clusters([3, 4, 5, 6]), [(3, 6)])
+        self.assertEqual(switch_clusters([0, 1000, 5000]), [(0, 0), (1000, 1000), (5000, 5000)])  # fmt: skip
+        self.assertEqual(
+            switch_clusters([1, 2, 3, 5, 6, 100, 200, 201, 202, 203, 204, 900]),
+            [(1, 6), (100, 100), (200, 204), (900, 900)],
+        )
+
+    def test_values_are_not_positions(self):
+        values = [2, 0, 1]
+        self.run_switch(values, range(-2, 5))
+
+    def test_offset_table(self):
+        values = [1003, 1001, 1000, 1002, 1005]
+        program = self.run_switch(values, range(995, 1010))
+        # a single table of six jumps and one for the default
+        self.assertLess(len(program), 60)
+
+    def test_sparse(self):
+        values = [7, 1 << 20, 300, 301, 302, 303, 304, 305, 99999]
+        inputs = values + [v + d for v in values for d in (-1, 1)] + [0, -(1 << 20)]
+        program = self.run_switch(values, inputs)
+        self.assertLess(len(program), 150)
+
+    def test_duplicate_values(self):
+        c_code = "switch (x) { case 1: break; case 1: break; default: }"
+        (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+        with self.assertRaises(AssertionError):
+            list(code(node, {"x": basic_addr(0)}))
+
+
+class TestShortCircuit(unittest.TestCase):
+    environment = {name: basic_addr(i) for i, name in enumerate("xyzr")}
+
+    def run_both(self, c_code, memory):
+        strict = run(context_code(c_code, self.environment), self.environment, memory)
+        lazy_code = context_code(c_code, self.environment, short_circuit=True)
+        lazy = run(lazy_code, self.environment, memory)
+        return strict, lazy
+
+    def test_same_result(self):
+        c_code = """
+        if (x && (y || !z)) r = 1; else r = 2;
+        while (!(x || y) && r < 5) r = r + 1;
+        for (r = r; z > 0 && (x && y || !x && !y); z = z - 1) r = r + 10;
+        """
+        for x in range(3):
+            for y in range(3):
+                for z in range(3):
+                    memory = {0: x, 1: y, 2: z}
+                    strict, lazy = self.run_both(c_code, memory)
+                    self.assertEqual(strict.memory[:4], lazy.memory[:4], memory)
+
+    def test_operands_are_skipped(self):
+        # y is 0, so evaluating 1 / y fails
+        c_code = "if (x || 1 / y) r = 1; if (!x && 1 / y) r = 2;"
+        with self.assertRaises(VMError):
+            self.run_both(c_code, {0: 1})
+        lazy_code = context_code(c_code, self.environment, short_circuit=True)
+        lazy = run(lazy_code, self.environment, {0: 1})
+        self.assertEqual(lazy.memory[3], 1)
+
+    def test_guarded_loop(self):
+        environment = {"i": basic_addr(0), "a": EnvEntry(1, Array(Basic(), 20))}
+        c_code = "i = 0; while (i < 20 && a[i] != 0 && a[i] < 100) i = i + 1;"
+        memory = {1 + i: i + 1 for i in range(15)}
+        strict = run(context_code(c_code, environment), environment, memory)
+        lazy_code = context_code(c_code, environment, short_circuit=True)
+        lazy = run(lazy_code, environment, memory)
+        self.assertEqual(lazy.memory[0], 15)
+        self.assertEqual(strict.memory[0], 15)
+        self.assertLess(lazy.instructions, strict.instructions)
+
+    def test_other_expressions_are_strict(self):
+        c_code = "r = x && y; if (x < y) r = 1;"
+        self.assertEqual(
+            context_code(c_code, self.environment, short_circuit=True),
+            context_code(c_code, self.environment),
+        )
+
+    def test_long_chain(self):
+        node = Identifier("x")
+        for _ in range(TestDeepNesting.DEPTH):
+            node = BinaryOp(node, "&&", Identifier("y"))
+        node = While(node, PlainStatement(Constant(0)))
+        context = Context(short_circuit=True)
+        annotate(node, self.environment, context.types)
+        result = link(code(node, self.environment, context))
+        self.assertEqual(len(result), 3 * TestDeepNesting.DEPTH + 6)
+
+
+class TestAddressFolding(unittest.TestCase):
+    inner = Struct(("v", Basic()), ("w", Array(Basic(), 4)))
+    outer = Struct(("v", Basic()), ("w", Array(inner, 3)), ("inner", inner))
+    environment = {
+        "i": basic_addr(1),
+        "s": EnvEntry(2, outer),
+        "a": EnvEntry(20, Array(Basic(), 5)),
+        "m": EnvEntry(25, Array(Array(Basic(), 3), 2)),
+        "q": EnvEntry(31, Pointer(Basic())),
+        "p": EnvEntry(32, Pointer(outer)),
+    }
+
+    def assertFolded(self, c_code, desired):
+        # as a statement, whose value is popped
+        folded = context_code(f"{c_code};", self.environment, fold_addresses=True)
+        self.assertEqual(list(render(folded)), [*desired, "pop"])
+
+    def test_constant_chains(self):
+        self.assertFolded("s.w[2].w[3]", ["loadc 17", "load"])
+        self.assertFolded("s.inner.v", ["loadc 18", "load"])
+        self.assertFolded("m[1][2]", ["loadc 30", "load"])
+        self.assertFolded("a[0]", ["loadc 20", "load"])
+
+    def test_constant_suffix(self):
+        self.assertFolded(
+            "s.w[i].w[3]",
+            ["loadc 3", "loadc 1", "load", "loadc 5", "mul", "add", "loadc 4", "add", "load"],  # fmt: skip
+        )
+        self.assertFolded("a[i]", ["loadc 20", "loadc 1", "load", "add", "load"])
+        self.assertFolded(
+            "m[i][2]",
+            ["loadc 25", "loadc 1", "load", "loadc 3", "mul", "add", "loadc 2", "add", "load"],  # fmt: skip
+        )
+
+    def test_pointers(self):
+        self.assertFolded("q[3]", ["loadc 31", "load", "loadc 3", "add", "load"])
+        self.assertFolded("p->w[1].v", ["loadc 32", "load", "loadc 6", "add", "load"])
+        self.assertFolded("p->v", ["loadc 32", "load", "load"])
+
+    def test_address_of(self):
+        self.assertFolded("&s.inner.w[1]", ["loadc 20"])
+        self.assertFolded("s.w[1].w", ["loadc 9"])
+
+    def test_same_result(self):
+        c_code = """
+        q = malloc(4); q[2] = 5; i = 1;
+        s.w[2].w[3] = q[2] + 1;
+        s.inner.w[i + 1] = s.w[2].w[3] * 2;
+        m[i][2] = s.inner.w[2] + m[0][i];
+        p = malloc(18); p->w[1].w[i] = m[1][2]; p->inner.v = p->w[i].w[1];
+        a[i * 2] = p->inner.v + a[0];
+        """
+        plain = context_code(c_code, self.environment)
+        folded = context_code(c_code, self.environment, fold_addresses=True)
+        self.assertLess(len(folded), len(plain) - 20)
+        desired = run(plain, self.environment).state()
+        self.assertEqual(run(folded, self.environment).state(), desired)
+        self.assertEqual(desired[0][22], 12)
+
+
+class TestLoopRotation(unittest.TestCase):
+    environment = {name: basic_addr(i) for i, name in enumerate("xyzr")}
+
+    def test_code(self):
+        self.assertEqual(
+            list(render(context_code("while (x < 3) x = x + 1;", self.environment, rotate_loops=True))),
+            [
+                "loadc 0", "load", "loadc 3", "le", "jumpz 17",
+                "loadc 0", "load", "loadc 1", "add", "loadc 0", "store", "pop",
+                "loadc 0", "load", "loadc 3", "geq", "jumpz 5",
+            ],  # fmt: skip
+        )
+
+    def test_same_result(self):
+        c_code = """
+        while (x < 3) x = x + 1;
+        while (!(r >= 4)) { r = r + x; y = y + 1; }
+        for (z = z; z; z = z - 1) r = r * 2;
+        for (x = x; x != 5 && y <= 20; y = y + 2) r = r - 1;
+        while (y == 100) r = 0;
+        """
+        plain = context_code(c_code, self.environment)
+        for x in range(-1, 7, 2):
+            for z in range(3):
+                memory = {0: x, 2: z}
+                desired = run(plain, self.environment, memory).state()
+                for short_circuit in [False, True]:
+                    rotated = context_code(
+                        c_code,
+                        self.environment,
+                        short_circuit=short_circuit,
+                        rotate_loops=True,
+                    )
+                    execution = run(rotated, self.environment, memory)
+                    self.assertEqual(execution.state(), desired, memory)
+
+    def test_one_jump_per_iteration(self):
+        c_code = "for (x = 0; x < 100; x = x + 1) r = r + x;"
+        plain = run(context_code(c_code, self.environment), self.environment)
+        rotated_code = context_code(c_code, self.environment, rotate_loops=True)
+        rotated = run(rotated_code, self.environment)
+        self.assertEqual(rotated.memory[3], plain.memory[3])
+        # the condition is tested as often, the jump back is gone
+        self.assertEqual(plain.instructions - rotated.instructions, 100)
+
+    def test_options(self):
+        c_code = "while (x < 3) x = x + 1;"
+
+        def executed(options):
+            compiled = compile_statements(c_code, self.environment, options)
+            return run(compiled, self.environment).instructions
+
+        # rotated when optimizing, unless the lecture's loops are asked for
+        self.assertLess(
+            executed(Options(peephole=True)),
+            executed(Options(peephole=True, rotate_loops=False)),
+        )
+        self.assertLess(executed(Options(rotate_loops=True)), executed(Options()))
+        self.assertFalse(Options().loops_rotated)
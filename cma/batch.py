@@ -0,0 +1,159 @@
+"""
+Compiles many programs at once on a process pool.
+
+    python -m cma.batch --environment env.json [--workers N] file.c ...
+
+The environment notation is described in cma.environment. Every file is
+printed as a comment with its name followed by its code. Files which fail
+to compile are reported on stderr and do not stop the others. With
+--records FILE, the compilations are instrumented and their records summed
+up in FILE, see cma.instrumentation.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+
+from cma.backend import EnvEntry, render
+from cma.compiler import DEFAULT_OPTIONS, compile_statements, parse
+from cma.environment import load_environment
+from cma.instructions import Instruction
+from cma.instrumentation import Instrumentation, aggregate
+from cma.options import Options
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    index: int
+    code: Optional[List[Instruction]] = None
+    error: Optional[str] = None
+    # see Instrumentation.records, if instrumented
+    records: Optional[List[Dict[str, Any]]] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def warm_up(options: Options):
+    # builds the packrat caches and parse actions of the grammar once per worker
+    parse("x = 1;", options)
+
+
+def compile_one(
+    index: int,
+    source: str,
+    environment: Dict[str, EnvEntry],
+    options: Options,
+    instrument: bool = False,
+):
+    instrumentation = Instrumentation() if instrument else None
+    records = None
+    try:
+        code = compile_statements(source, environment, options, instrumentation)
+        error = None
+    except Exception as e:
+        code = None
+        error = f"{type(e).__name__}: {e}"
+    if instrumentation is not None:
+        records = instrumentation.records()
+    return BatchResult(index, code, error, records)
+
+
+def compile_many(
+    sources: Iterable[str],
+    environments: Union[Mapping[str, EnvEntry], Iterable[Dict[str, EnvEntry]]],
+    workers: Optional[int] = None,
+    options: Options = DEFAULT_OPTIONS,
+    instrument: bool = False,
+):
+    """
+    Compiles every source against its environment, or against the same
+    environment if a single one is given. Yields a BatchResult per source in
+    the order of the sources, as soon as it and the ones before it are done.
+    If instrument is set, the results carry the records of their compilation.
+    """
+    sources = list(sources)
+    if isinstance(environments, Mapping):
+        environments = [environments] * len(sources)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=warm_up, initargs=(options,)
+    ) as executor:
+        futures = [
+            executor.submit(
+                compile_one, index, source, environment, options, instrument
+            )
+            for index, (source, environment) in enumerate(zip(sources, environments))
+        ]
+        for index, future in enumerate(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # e.g. the environment could not be pickled
+                yield BatchResult(index, error=f"{type(e).__name__}: {e}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--environment", required=True, help="JSON environment")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--frontend", default=DEFAULT_OPTIONS.frontend)
+    parser.add_argument("--simplify", action="store_true")
+    parser.add_argument("--peephole", action="store_true")
+    parser.add_argument("--short-circuit", action="store_true")
+    parser.add_argument("--fold-addresses", action="store_true")
+    parser.add_argument("--hoist-invariants", action="store_true")
+    parser.add_argument("--superinstructions", action="store_true")
+    parser.add_argument("--remove-dead-code", action="store_true")
+    parser.add_argument(
+        "--rotate-loops", action=argparse.BooleanOptionalAction, default=None
+    )
+    parser.add_argument("--records", help="write instrumentation records here")
+    args = parser.parse_args(argv)
+
+    with open(args.environment) as f:
+        environment = load_environment(json.load(f))
+    sources = []
+    for name in args.files:
+        with open(name) as f:
+            sources.append(f.read())
+    options = Options(
+        frontend=args.frontend,
+        simplify=args.simplify,
+        peephole=args.peephole,
+        short_circuit=args.short_circuit,
+        fold_addresses=args.fold_addresses,
+        hoist_invariants=args.hoist_invariants,
+        superinstructions=args.superinstructions,
+        remove_dead_code=args.remove_dead_code,
+        rotate_loops=args.rotate_loops,
+    )
+
+    failed = 0
+    records = []
+    results = compile_many(
+        sources, environment, args.workers, options, args.records is not None
+    )
+    for name, result in zip(args.files, results):
+        if result.records is not None:
+            records.append(result.records)
+        if result.ok:
+            print(f"# {name}")
+            print("\n".join(render(result.code)))
+        else:
+            failed += 1
+            print(f"{name}: {result.error}", file=sys.stderr)
+    if args.records is not None:
+        with open(args.records, "w") as f:
+            json.dump(aggregate(records).records(), f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from cma.backend import EnvEntry, LazyStruct, Pointer, render
+from cma.backend_test import basic_addr, generate_statement_code
+from cma.batch import compile_many, main
+from cma.options import Options
+
+ENVIRONMENT = {"x": basic_addr(1), "y": basic_addr(2)}
+
+SOURCES = [
+    "x = 1; y = x + 2;",
+    "while (x > y) x = x - y;",
+    "x = ;",
+    "switch (x) { case 0: y = 1; break; default: y = 2; }",
+]
+
+
+class TestCompileMany(unittest.TestCase):
+    def test_results_in_order(self):
+        results = list(compile_many(SOURCES, ENVIRONMENT, workers=2))
+        self.assertEqual([result.index for result in results], [0, 1, 2, 3])
+        self.assertEqual([result.ok for result in results], [True, True, False, True])
+        self.assertIn("ParseException", results[2].error)
+        for source, result in zip(SOURCES, results):
+            if result.ok:
+                self.assertEqual(
+                    list(render(result.code)),
+                    generate_statement_code(source, ENVIRONMENT),
+                )
+
+    def test_environment_per_source(self):
+        environments = [ENVIRONMENT, {"x": basic_addr(7)}]
+        # the lambda of the LazyStruct cannot be sent to a worker
+        environments.append({"x": EnvEntry(1, Pointer(LazyStruct(lambda: None)))})
+        results = list(compile_many(["x = 1;"] * 3, environments, workers=1))
+        self.assertEqual(list(render(results[0].code)), ["loadc 1", "loadc 1", "store", "pop"])  # fmt: skip
+        self.assertEqual(list(render(results[1].code)), ["loadc 1", "loadc 7", "store", "pop"])  # fmt: skip
+        self.assertFalse(results[2].ok)
+
+    def test_options(self):
+        options = Options(frontend="pratt", simplify=True, peephole=True)
+        (result,) = compile_many(["x = 2 * 3; x; y;"], ENVIRONMENT, 1, options)
+        self.assertEqual(list(render(result.code)), ["loadc 6", "loadc 1", "store", "pop"])  # fmt: skip
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            environment = os.path.join(directory, "env.json")
+            with open(environment, "w") as f:
+                json.dump({"variables": {"x": [1, "int"], "y": [2, "int"]}}, f)
+            files = []
+            for i, source in enumerate(SOURCES[:3]):
+                files.append(os.path.join(directory, f"{i}.c"))
+                with open(files[-1], "w") as f:
+                    f.write(source)
+
+            stdout, stderr = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                status = main([*files, "--environment", environment, "--workers", "2"])
+
+        self.assertEqual(status, 1)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], f"# {files[0]}")
+        self.assertEqual(lines[1:12], generate_statement_code(SOURCES[0], ENVIRONMENT))
+        self.assertIn(f"# {files[1]}", lines)
+        self.assertTrue(stderr.getvalue().startswith(f"{files[2]}: "))
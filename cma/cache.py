@@ -0,0 +1,154 @@
+"""
+Content-addressed on-disk cache for compiled programs.
+
+The key of a compilation is a hash of the source, the environment in its
+canonical JSON notation (see cma.environment), the options and the version
+of the compiler, which is a hash of the compiler's own modules and the util
+modules it uses. The value is the linked code, stored as the raw bytes of
+its operands and opcodes.
+
+Entries are evicted least recently used first once the cache directory
+exceeds its size limit. Reading an entry counts as a use.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from array import array
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cma.backend import EnvEntry
+from cma.compiler import DEFAULT_OPTIONS, compile_statements
+from cma.environment import dump_environment
+from cma.instructions import Instruction, Opcode, WITH_OPERAND, decode, loadc
+from cma.options import Options
+
+DEFAULT_DIRECTORY = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"), "cma"
+)
+DEFAULT_MAX_BYTES = 64 << 20
+OPERAND_SIZE = array("q").itemsize
+
+
+@lru_cache(maxsize=None)
+def compiler_version() -> str:
+    digest = hashlib.sha256()
+    package = Path(__file__).parent
+    modules = [*package.glob("*.py"), *package.parent.joinpath("util").glob("*.py")]
+    for module in sorted(modules):
+        if not module.name.endswith("_test.py"):
+            digest.update(module.read_bytes())
+    return digest.hexdigest()
+
+
+def cache_key(
+    source: str, environment: Dict[str, EnvEntry], options: Options = DEFAULT_OPTIONS
+) -> str:
+    digest = hashlib.sha256(compiler_version().encode())
+    for part in (
+        json.dumps(asdict(options), sort_keys=True),
+        json.dumps(dump_environment(environment)),
+        source,
+    ):
+        # the length keeps the parts apart
+        digest.update(f"{len(part)}:".encode())
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+def encode_entry(code: List[Instruction]) -> bytes:
+    opcodes, operands = decode(code)
+    return operands.tobytes() + opcodes.tobytes()
+
+
+def decode_entry(data: bytes) -> List[Instruction]:
+    n = len(data) // (OPERAND_SIZE + 1)
+    operands = array("q", data[: n * OPERAND_SIZE])
+    opcodes = data[n * OPERAND_SIZE :]
+    return [
+        (
+            loadc(operand)
+            if opcode == Opcode.LOADC
+            else Instruction(
+                Opcode(opcode), operand if opcode in WITH_OPERAND else None
+            )
+        )
+        for opcode, operand in zip(opcodes, operands)
+    ]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class Cache:
+    def __init__(
+        self,
+        directory: Path = DEFAULT_DIRECTORY,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        # key -> size of the entry, least recently used first
+        self.entries: Dict[str, int] = {}
+        for path in sorted(self.directory.iterdir(), key=lambda p: p.stat().st_mtime):
+            if path.is_file() and not path.name.startswith("."):
+                self.entries[path.name] = path.stat().st_size
+        self.size = sum(self.entries.values())
+
+    def get(self, key: str) -> Optional[List[Instruction]]:
+        path = self.directory / key
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.entries.pop(key, None)
+            self.stats.misses += 1
+            return None
+        # marks the entry as recently used, also for other processes
+        os.utime(path)
+        # the entry may have been written by another process
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        self.stats.hits += 1
+        self.evict()
+        return decode_entry(data)
+
+    def put(self, key: str, code: List[Instruction]):
+        data = encode_entry(code)
+        # written to a temporary file first, so readers never see half an entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self.directory / key)
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self.size -= self.entries.pop(key)
+            (self.directory / key).unlink(missing_ok=True)
+            self.stats.evictions += 1
+
+    def compile(
+        self,
+        source: str,
+        environment: Dict[str, EnvEntry],
+        options: Options = DEFAULT_OPTIONS,
+    ) -> List[Instruction]:
+        key = cache_key(source, environment, options)
+        code = self.get(key)
+        if code is None:
+            code = compile_statements(source, environment, options)
+            self.put(key, code)
+        return code
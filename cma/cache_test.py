@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from cma.backend import Basic, EnvEntry, LazyStruct, Pointer, Struct, render
+from cma.backend_test import basic_addr, generate_statement_code
+from cma.cache import Cache, cache_key, decode_entry, encode_entry
+from cma.compiler import compile_statements
+from cma.options import Options
+
+ENVIRONMENT = {"x": basic_addr(1), "y": basic_addr(2)}
+SOURCE = "while (x > y) { if (x) x = x - y; else y = -1; }"
+
+
+def linked_list():
+    structs = {}
+    structs["node"] = Struct(
+        ("v", Basic()), ("next", Pointer(LazyStruct(lambda: structs["node"])))
+    )
+    return {"p": EnvEntry(1, Pointer(structs["node"]))}
+
+
+class TestKey(unittest.TestCase):
+    def test_equal_inputs(self):
+        self.assertEqual(
+            cache_key(SOURCE, ENVIRONMENT),
+            cache_key(SOURCE, {"y": basic_addr(2), "x": basic_addr(1)}),
+        )
+        self.assertEqual(
+            cache_key("p->next->v;", linked_list()),
+            cache_key("p->next->v;", linked_list()),
+        )
+
+    def test_different_inputs(self):
+        keys = {
+            cache_key(SOURCE, ENVIRONMENT),
+            cache_key(SOURCE + " ", ENVIRONMENT),
+            cache_key(SOURCE, {"x": basic_addr(1), "y": basic_addr(3)}),
+            cache_key(SOURCE, ENVIRONMENT, Options(peephole=True)),
+            cache_key("p->next->v;", linked_list()),
+        }
+        self.assertEqual(len(keys), 5)
+
+    def test_entry(self):
+        code = compile_statements(SOURCE, ENVIRONMENT)
+        self.assertEqual(decode_entry(encode_entry(code)), code)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_hits_and_misses(self):
+        cache = Cache(self.directory.name)
+        first = cache.compile(SOURCE, ENVIRONMENT)
+        second = cache.compile(SOURCE, ENVIRONMENT)
+        self.assertEqual(
+            list(render(first)), generate_statement_code(SOURCE, ENVIRONMENT)
+        )
+        self.assertEqual(second, first)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 1))
+
+        # entries survive the cache object
+        cache = Cache(self.directory.name)
+        self.assertEqual(cache.compile(SOURCE, ENVIRONMENT), first)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 0))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        sources = [f"x = {i};" for i in range(3)]
+        # every entry takes 4 * 9 bytes
+        cache = Cache(self.directory.name, max_bytes=80)
+        cache.compile(sources[0], ENVIRONMENT)
+        cache.compile(sources[1], ENVIRONMENT)
+        cache.compile(sources[0], ENVIRONMENT)
+        cache.compile(sources[2], ENVIRONMENT)
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+        self.assertIsNone(cache.get(cache_key(sources[1], ENVIRONMENT)))
+        self.assertIsNotNone(cache.get(cache_key(sources[0], ENVIRONMENT)))
+        self.assertLessEqual(cache.size, 80)
+
+    def test_entries_of_other_processes(self):
+        cache = Cache(self.directory.name, max_bytes=80)
+        other = Cache(self.directory.name, max_bytes=80)
+        for i in range(3):
+            other.compile(f"x = {i};", ENVIRONMENT)
+            cache.get(cache_key(f"x = {i};", ENVIRONMENT))
+        self.assertEqual(cache.size, sum(cache.entries.values()))
+        self.assertLessEqual(cache.size, 80)
+        self.assertEqual(cache.stats.evictions, 1)
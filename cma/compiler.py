@@ -0,0 +1,101 @@
+"""
+The compiler pipeline from source text to linked instructions.
+"""
+
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+from cma.backend import Context, EnvEntry, annotate, code, link
+from cma.dead_code import remove_dead_code
+from cma.instructions import Instruction
+from cma.instrumentation import Instrumentation
+from cma.invariants import hoist, reserve
+from cma.options import Options
+from cma.peephole import BRANCH_RULES, RULES, peephole
+from cma.pratt_frontend import FRONTENDS
+from cma.simplify import simplify
+from cma.superinstructions import select
+
+DEFAULT_OPTIONS = Options()
+
+
+def peephole_rules(options: Options):
+    # conditions on constants are only decided where the dead code goes
+    return RULES + BRANCH_RULES if options.remove_dead_code else RULES
+
+
+def no_phase(_name: str):
+    return nullcontext()
+
+
+def parse(
+    source: str,
+    options: Options = DEFAULT_OPTIONS,
+    instrumentation: Optional[Instrumentation] = None,
+):
+    if instrumentation is not None:
+        packrat = options.frontend == "pyparsing"
+        with instrumentation.phase("parse"):
+            with instrumentation.packrat() if packrat else nullcontext():
+                return parse(source, options)
+    (node,) = FRONTENDS[options.frontend].StatementSequence.parseString(
+        source, parseAll=True
+    )
+    return node
+
+
+def generate(
+    node,
+    environment: Dict[str, EnvEntry],
+    options: Options = DEFAULT_OPTIONS,
+    instrumentation: Optional[Instrumentation] = None,
+) -> List[Instruction]:
+    """
+    Generates linked code for a parsed statement sequence.
+    """
+    phase = no_phase if instrumentation is None else instrumentation.phase
+    if options.simplify:
+        with phase("simplify"):
+            node = simplify(node)
+    temporaries = {}
+    if options.hoist_invariants:
+        with phase("hoist"):
+            node, temporaries = hoist(node, environment)
+        environment = {**environment, **temporaries}
+    context = Context(
+        short_circuit=options.short_circuit,
+        fold_addresses=options.fold_addresses,
+        rotate_loops=options.loops_rotated,
+    )
+    if instrumentation is None:
+        annotate(node, environment, context.types)
+        symbolic_code = code(node, environment, context)
+    else:
+        # the code is generated at once so that the phases can be told apart
+        with instrumentation.measure_handlers():
+            with phase("annotate"):
+                annotate(node, environment, context.types)
+            with phase("codegen"):
+                symbolic_code = list(code(node, environment, context))
+    if options.peephole:
+        with phase("peephole"):
+            symbolic_code = peephole(symbolic_code, peephole_rules(options))
+    if options.remove_dead_code:
+        with phase("dead_code"):
+            symbolic_code = remove_dead_code(symbolic_code)
+    symbolic_code = reserve(symbolic_code, len(temporaries))
+    if options.superinstructions:
+        with phase("select"):
+            symbolic_code = select(symbolic_code)
+    with phase("link"):
+        return link(symbolic_code)
+
+
+def compile_statements(
+    source: str,
+    environment: Dict[str, EnvEntry],
+    options: Options = DEFAULT_OPTIONS,
+    instrumentation: Optional[Instrumentation] = None,
+) -> List[Instruction]:
+    node = parse(source, options, instrumentation)
+    return generate(node, environment, options, instrumentation)
@@ -0,0 +1,168 @@
+"""
+Removes the code which can never run from symbolic code, i.e. the output of
+code() or peephole() before linking.
+
+Control flow is followed from the first instruction through jumps and
+conditional jumps. Indexed jumps reach the entries of their jump table
+which their index can select. It is bounded the way the backend bounds it
+for switch statements, see cma.stack_depth, otherwise everything from the
+start of the table on is kept. An indexed jump with a constant index is
+replaced by the jump in the selected entry, so that a table which is only
+used like that goes away entirely.
+
+Instructions and labels which are not reached are dropped, and so are the
+jumps which would only skip over labels. The peephole rules in BRANCH_RULES
+of cma.peephole decide conditions on constants first and thereby leave
+more code unreachable, e.g. all but one case of a switch on a constant.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from cma.instructions import Instruction, Opcode
+from cma.stack_depth import BOUNDS_CHECK
+
+
+@dataclass
+class DeadCodeStats:
+    before: int = 0
+    after: int = 0
+    # labels removed, they are not counted in before and after
+    labels: int = 0
+
+    @property
+    def removed(self):
+        return self.before - self.after
+
+
+def label_positions(symbolic_code: List[Instruction]) -> Dict[object, int]:
+    return {
+        instruction.operand: position
+        for position, instruction in enumerate(symbolic_code)
+        if instruction.opcode == Opcode.LABEL
+    }
+
+
+def table_entry(symbolic_code: List[Instruction], start: int, index: int):
+    # the position of the index-th instruction from start, labels not counted
+    for position in range(start, len(symbolic_code)):
+        if symbolic_code[position].opcode != Opcode.LABEL:
+            if index == 0:
+                return position
+            index -= 1
+    return None
+
+
+def resolve_constant_indices(symbolic_code: List[Instruction]) -> List[Instruction]:
+    # loadc c; jumpi B becomes the jump in entry c of the table at B
+    labels = label_positions(symbolic_code)
+    out: List[Instruction] = []
+    for instruction in symbolic_code:
+        if (
+            instruction.opcode == Opcode.JUMPI
+            and out
+            and out[-1].opcode == Opcode.LOADC
+            and out[-1].operand >= 0
+        ):
+            start = labels[instruction.operand]
+            entry = table_entry(symbolic_code, start, out[-1].operand)
+            if entry is not None and symbolic_code[entry].opcode == Opcode.JUMP:
+                out[-1] = symbolic_code[entry]
+                continue
+        out.append(instruction)
+    return out
+
+
+def table_size(symbolic_code: List[Instruction], position: int) -> Optional[int]:
+    """
+    The number of entries of the jump table which the indexed jump at
+    position may use, or None if its index is not bounded.
+    """
+    if position >= 1 and symbolic_code[position - 1].opcode == Opcode.LOADC:
+        return symbolic_code[position - 1].operand + 1
+    start = position - len(BOUNDS_CHECK)
+    opcodes = tuple(i.opcode for i in symbolic_code[max(start, 0) : position])
+    if start >= 0 and opcodes == BOUNDS_CHECK:
+        # the index is at least the start of the check, which is not negative
+        return symbolic_code[start + 5].operand
+    return None
+
+
+def reachable(symbolic_code: List[Instruction]) -> Tuple[bytearray, Set[int]]:
+    """
+    Whether each instruction can be reached from the first one, and the
+    positions of the jump tables, which must be kept together.
+    """
+    labels = label_positions(symbolic_code)
+    n = len(symbolic_code)
+    result = bytearray(n)
+    tables: Set[int] = set()
+    pending = [0]
+    while pending:
+        position = pending.pop()
+        while position < n and not result[position]:
+            result[position] = 1
+            instruction = symbolic_code[position]
+            opcode = instruction.opcode
+            if opcode == Opcode.JUMP:
+                position = labels[instruction.operand]
+                continue
+            if opcode == Opcode.JUMPZ:
+                pending.append(labels[instruction.operand])
+            elif opcode == Opcode.JUMPI:
+                start = labels[instruction.operand]
+                size = table_size(symbolic_code, position)
+                # entries may only go if they are behind all used ones
+                end = n if size is None else table_entry(symbolic_code, start, size - 1)
+                table = range(start, n if end is None else end + 1)
+                tables.update(table)
+                pending.extend(table)
+                break
+            elif opcode == Opcode.HALT:
+                break
+            position += 1
+    return result, tables
+
+
+def label_skipping_jumps(symbolic_code: List[Instruction]) -> Set[int]:
+    # the positions of the jumps which only jump over labels
+    labels = label_positions(symbolic_code)
+    result = set()
+    # the position of the next instruction which is not a label
+    following = len(symbolic_code)
+    for position in range(len(symbolic_code) - 1, -1, -1):
+        instruction = symbolic_code[position]
+        if instruction.opcode == Opcode.LABEL:
+            continue
+        if (
+            instruction.opcode == Opcode.JUMP
+            and position < labels[instruction.operand] < following
+        ):
+            result.add(position)
+        following = position
+    return result
+
+
+def count_instructions(symbolic_code: List[Instruction]):
+    return sum(instruction.opcode != Opcode.LABEL for instruction in symbolic_code)
+
+
+def remove_dead_code(
+    symbolic_code: Iterable[Instruction], stats: Optional[DeadCodeStats] = None
+) -> List[Instruction]:
+    symbolic_code = resolve_constant_indices(list(symbolic_code))
+    keep, tables = reachable(symbolic_code)
+    live = [position for position in range(len(symbolic_code)) if keep[position]]
+    live_code = [symbolic_code[position] for position in live]
+    skipping = label_skipping_jumps(live_code)
+    out = [
+        instruction
+        for index, (position, instruction) in enumerate(zip(live, live_code))
+        if index not in skipping or position in tables
+    ]
+    if stats is not None:
+        before, after = count_instructions(symbolic_code), count_instructions(out)
+        stats.before += before
+        stats.after += after
+        stats.labels += len(symbolic_code) - before - (len(out) - after)
+    return out
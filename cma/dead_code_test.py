@@ -0,0 +1,176 @@
+import unittest
+from time import perf_counter
+
+from cma.backend import SymbolicAddress, link, render
+from cma.backend_test import basic_addr
+from cma.compiler import compile_statements
+from cma.dead_code import DeadCodeStats, remove_dead_code
+from cma.instructions import Instruction, Opcode, parse
+from cma.jit import JIT
+from cma.options import Options
+from cma.peephole import BRANCH_RULES, RULES, peephole
+from cma.stack_depth import stack_depth
+from cma.vm import VM
+
+ENVIRONMENT = {name: basic_addr(i) for i, name in enumerate("xyz")}
+DEAD_CODE = Options(peephole=True, remove_dead_code=True)
+
+
+def label(address):
+    return Instruction(Opcode.LABEL, address)
+
+
+def jump(opcode, address):
+    return Instruction(opcode, address)
+
+
+def removed(symbolic_code, stats=None):
+    return list(render(link(remove_dead_code(symbolic_code, stats))))
+
+
+class TestRemoveDeadCode(unittest.TestCase):
+    def test_after_jump(self):
+        a, b = SymbolicAddress(0), SymbolicAddress(1)
+        symbolic_code = [
+            parse("loadc 1"),
+            jump(Opcode.JUMPZ, a),
+            parse("loadc 2"),
+            jump(Opcode.JUMP, b),
+            parse("loadc 3"),
+            parse("pop"),
+            label(a),
+            parse("loadc 4"),
+            label(b),
+            parse("pop"),
+            parse("halt"),
+            parse("loadc 5"),
+        ]
+        self.assertEqual(
+            removed(symbolic_code),
+            ["loadc 1", "jumpz 4", "loadc 2", "jump 5", "loadc 4", "pop", "halt"],
+        )
+
+    def test_jump_over_labels(self):
+        a, b = SymbolicAddress(0), SymbolicAddress(1)
+        symbolic_code = [jump(Opcode.JUMP, b), parse("loadc 1"), label(a), label(b)]
+        self.assertEqual(removed(symbolic_code), [])
+
+    def test_endless_loop(self):
+        a = SymbolicAddress(0)
+        symbolic_code = [label(a), parse("loadc 1"), parse("pop"), jump(Opcode.JUMP, a)]
+        lines = removed(symbolic_code + [parse("loadc 2"), parse("pop")])
+        self.assertEqual(lines, ["loadc 1", "pop", "jump 0"])
+
+    def test_constant_index(self):
+        a, b, table = SymbolicAddress(0), SymbolicAddress(1), SymbolicAddress(2)
+        symbolic_code = [
+            parse("loadc 1"),
+            jump(Opcode.JUMPI, table),
+            label(a),
+            parse("loadc 2"),
+            label(b),
+            parse("loadc 3"),
+            parse("halt"),
+            label(table),
+            jump(Opcode.JUMP, a),
+            jump(Opcode.JUMP, b),
+        ]
+        self.assertEqual(removed(symbolic_code), ["loadc 3", "halt"])
+
+    def test_unbounded_index(self):
+        # without a bound, everything behind the table is kept
+        a, b, table = SymbolicAddress(0), SymbolicAddress(1), SymbolicAddress(2)
+        symbolic_code = [
+            parse("loadc 0"),
+            parse("load"),
+            jump(Opcode.JUMPI, table),
+            label(table),
+            jump(Opcode.JUMP, a),
+            jump(Opcode.JUMP, b),
+            label(a),
+            parse("halt"),
+            label(b),
+            parse("loadc 3"),
+        ]
+        lines = ["loadc 0", "load", "jumpi 3", "jump 5", "jump 6", "halt", "loadc 3"]
+        self.assertEqual(removed(symbolic_code), lines)
+
+    def test_stats(self):
+        a, b = SymbolicAddress(0), SymbolicAddress(1)
+        symbolic_code = [jump(Opcode.JUMP, a), parse("loadc 1"), label(b), label(a)]
+        stats = DeadCodeStats()
+        removed(symbolic_code, stats)
+        self.assertEqual((stats.before, stats.after, stats.labels), (2, 0, 1))
+        self.assertEqual(stats.removed, 2)
+
+    def test_linear_time(self):
+        def seconds(blocks):
+            symbolic_code = []
+            for i in range(blocks):
+                a = SymbolicAddress(i)
+                symbolic_code += [jump(Opcode.JUMP, a), label(a), parse("loadc 1")]
+                symbolic_code += [parse("pop")]
+            best = float("inf")
+            for _ in range(3):
+                start = perf_counter()
+                remove_dead_code(symbolic_code)
+                best = min(best, perf_counter() - start)
+            return best
+
+        # 8 times the code, which would take 64 times as long if quadratic
+        self.assertLess(seconds(16000), 24 * seconds(2000))
+
+
+class TestBranchRules(unittest.TestCase):
+    def optimize(self, lines):
+        code = peephole(map(parse, lines), RULES + BRANCH_RULES)
+        return list(render(link(code)))
+
+    def test_constant_conditions(self):
+        a = SymbolicAddress(0)
+        for value, desired in [(0, ["jump 2", "loadc 5"]), (3, ["loadc 5"])]:
+            symbolic_code = [parse(f"loadc {value}"), jump(Opcode.JUMPZ, a)]
+            symbolic_code += [parse("loadc 5"), label(a)]
+            symbolic_code = peephole(symbolic_code, RULES + BRANCH_RULES)
+            self.assertEqual(list(render(link(symbolic_code))), desired)
+
+    def test_dup_constant(self):
+        self.assertEqual(self.optimize(["loadc 2", "dup", "add"]), ["loadc 4"])
+
+
+class TestExecution(unittest.TestCase):
+    PROGRAMS = [
+        "switch (2) { case 0: x = 1; break; case 1: x = 2; break; case 2: x = 3; break; default: x = 4; }",  # fmt: skip
+        "switch (x) { case 0: y = 1; break; case 5: y = 2; break; case 6: y = 7; break; default: y = 4; }",  # fmt: skip
+        "switch (x - 5) { case 3: y = 1; break; case 40: y = 2; break; default: y = 4; }",  # fmt: skip
+        "while (x < 9) { if (0) y = y + 1; else z = z + x; x = x + 1; }",
+        "x = 3; if (x) y = 1; else y = 2; while (0) z = 1;",
+    ]
+
+    def run_program(self, code, executor=VM, x=5):
+        self.assertEqual(stack_depth(code).problems, [])
+        return executor(code, len(ENVIRONMENT)).run({0: x})
+
+    def test_same_result(self):
+        for source in self.PROGRAMS:
+            for x in [0, 5, 8, 45]:
+                plain = compile_statements(source, ENVIRONMENT)
+                desired = self.run_program(plain, x=x)
+                for options in [DEAD_CODE, Options(remove_dead_code=True)]:
+                    code = compile_statements(source, ENVIRONMENT, options)
+                    for executor in [VM, JIT]:
+                        execution = self.run_program(code, executor, x)
+                        self.assertEqual(execution.state(), desired.state(), source)
+
+    def test_constant_switch(self):
+        code = compile_statements(self.PROGRAMS[0], ENVIRONMENT, DEAD_CODE)
+        self.assertEqual(list(render(code)), ["loadc 3", "loadc 0", "store", "pop"])
+        code = compile_statements(self.PROGRAMS[0], ENVIRONMENT, Options(peephole=True))
+        self.assertIn(Opcode.JUMPI, [instruction.opcode for instruction in code])
+
+    def test_default_unchanged(self):
+        source = self.PROGRAMS[3]
+        self.assertEqual(
+            compile_statements(source, ENVIRONMENT),
+            compile_statements(source, ENVIRONMENT, Options(remove_dead_code=False)),
+        )
@@ -0,0 +1,84 @@
+"""
+Environments in a JSON compatible notation, for the command line tools.
+
+    {
+        "structs": {"node": [["value", "int"], ["next", {"pointer": "node"}]]},
+        "variables": {"x": [1, "int"], "list": [2, {"pointer": "node"}]}
+    }
+
+A type is "int", the name of a struct, {"pointer": type},
+{"array": type, "length": n} or an anonymous {"struct": [[field, type], ...]}.
+Named structs may point to any named struct, including themselves, but can
+only contain structs which are defined before them.
+"""
+
+from functools import partial
+from operator import getitem
+from typing import Any, Dict
+
+from cma.backend import Array, Basic, EnvEntry, LazyStruct, Pointer, Struct
+
+
+def load_datatype(obj: Any, structs: Dict[str, Struct]):
+    if obj == "int":
+        return Basic()
+    elif isinstance(obj, str):
+        # a partial instead of a lambda, so that the environment can be pickled
+        return LazyStruct(partial(getitem, structs, obj))
+    elif "pointer" in obj:
+        return Pointer(load_datatype(obj["pointer"], structs))
+    elif "array" in obj:
+        return Array(load_datatype(obj["array"], structs), obj["length"])
+    elif "struct" in obj:
+        return load_struct(obj["struct"], structs)
+    raise AssertionError(f"Unknown datatype {obj!r}")
+
+
+def load_struct(obj: Any, structs: Dict[str, Struct]):
+    return Struct(*((name, load_datatype(field, structs)) for name, field in obj))
+
+
+def load_environment(obj: Dict[str, Any]) -> Dict[str, EnvEntry]:
+    structs = {}
+    for name, fields in obj.get("structs", {}).items():
+        structs[name] = load_struct(fields, structs)
+    return {
+        name: EnvEntry(address, load_datatype(datatype, structs))
+        for name, (address, datatype) in obj["variables"].items()
+    }
+
+
+def dump_datatype(datatype: Any, structs: Dict[int, list], names: Dict[int, str]):
+    if isinstance(datatype, Basic):
+        return "int"
+    elif isinstance(datatype, Pointer):
+        return {"pointer": dump_datatype(datatype.datatype, structs, names)}
+    elif isinstance(datatype, Array):
+        element = dump_datatype(datatype.datatype, structs, names)
+        return {"array": element, "length": datatype.length}
+    elif isinstance(datatype, (Struct, LazyStruct)):
+        struct = datatype.resolved if isinstance(datatype, LazyStruct) else datatype
+        if id(struct) not in names:
+            # structs are named in the order they are reached
+            names[id(struct)] = name = f"struct{len(names)}"
+            structs[name] = [
+                [field, dump_datatype(entry.datatype, structs, names)]
+                for field, entry in struct.fields.items()
+            ]
+        return names[id(struct)]
+    raise AssertionError(f"Unknown datatype {datatype!r}")
+
+
+def dump_environment(environment: Dict[str, EnvEntry]) -> Dict[str, Any]:
+    """
+    The inverse of load_environment. Every struct becomes a named struct, so
+    that equal environments give equal results.
+    """
+    structs = {}
+    names = {}
+    variables = {}
+    for name in sorted(environment):
+        entry = environment[name]
+        datatype = dump_datatype(entry.datatype, structs, names)
+        variables[name] = [entry.address, datatype]
+    return {"structs": structs, "variables": variables}
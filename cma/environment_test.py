@@ -0,0 +1,48 @@
+import pickle
+import unittest
+
+from cma.backend import Array, Basic, EnvEntry, Pointer, sizeof
+from cma.backend_test import generate_expression_code
+from cma.environment import load_environment
+
+
+class TestLoadEnvironment(unittest.TestCase):
+    def test_basic_types(self):
+        environment = load_environment(
+            {
+                "variables": {
+                    "x": [1, "int"],
+                    "p": [2, {"pointer": "int"}],
+                    "a": [3, {"array": {"pointer": "int"}, "length": 4}],
+                }
+            }
+        )
+        self.assertEqual(environment["x"], EnvEntry(1, Basic()))
+        self.assertEqual(environment["p"], EnvEntry(2, Pointer(Basic())))
+        self.assertEqual(environment["a"], EnvEntry(3, Array(Pointer(Basic()), 4)))
+
+    def test_structs(self):
+        environment = load_environment(
+            {
+                "structs": {
+                    "pair": [["a", "int"], ["b", "int"]],
+                    "node": [["pair", "pair"], ["next", {"pointer": "node"}]],
+                },
+                "variables": {
+                    "n": [1, "node"],
+                    "s": [4, {"struct": [["x", "int"], ["y", "pair"]]}],
+                },
+            }
+        )
+        self.assertEqual(sizeof(environment["n"].datatype), 3)
+        self.assertEqual(sizeof(environment["s"].datatype), 3)
+        self.assertEqual(
+            generate_expression_code("n.next->next->pair.b", environment),
+            ["loadc 1", "loadc 2", "add", "load", "loadc 2", "add", "load"]
+            + ["loadc 0", "add", "loadc 1", "add", "load"],
+        )
+        # recursive structs can be sent to other processes
+        self.assertEqual(
+            pickle.loads(pickle.dumps(environment))["n"].datatype.fields.keys(),
+            environment["n"].datatype.fields.keys(),
+        )
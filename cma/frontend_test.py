@@ -29,42 +29,46 @@ from cma.frontend import (
 )
 
 
-class TestParserConstant(unittest.TestCase):
+class ParserTestCase(unittest.TestCase):
+    grammar = C
+
+
+class TestParserConstant(ParserTestCase):
     def test_parsing_constant(self):
         data = "42"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Constant(value=42)
         self.assertEqual(result, desired)
 
     def test_parsing_constant_truncation(self):
         data = "42 43"
         with self.assertRaises(ParseException):
-            C.Expression.parseString(data, parseAll=True)
+            self.grammar.Expression.parseString(data, parseAll=True)
 
 
-class TestParserIdentifier(unittest.TestCase):
+class TestParserIdentifier(ParserTestCase):
     def test_parsing_identifier(self):
         data = "asdf"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Identifier(name="asdf")
         self.assertEqual(result, desired)
 
     def test_parsing_identifier_truncation(self):
         data = "asdf asdf"
         with self.assertRaises(ParseException):
-            C.Expression.parseString(data, parseAll=True)
+            self.grammar.Expression.parseString(data, parseAll=True)
 
 
-class TestParserBinOp(unittest.TestCase):
+class TestParserBinOp(ParserTestCase):
     def test_parsing_binop_minus_constants(self):
         data = "42 - 1"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = BinaryOp(left=Constant(value=42), op="-", right=Constant(value=1))
         self.assertEqual(result, desired)
 
     def test_parsing_binop_plus_identifier(self):
         data = "a + b"
-        (result,) = C.Expression.parseString(data, parseAll=True).asList()
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True).asList()
         desired = BinaryOp(
             left=Identifier(name="a"), op="+", right=Identifier(name="b")
         )
@@ -72,7 +76,7 @@ class TestParserBinOp(unittest.TestCase):
 
     def test_parsing_binop_precedence(self):
         data = "3 + d / 5"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = BinaryOp(
             left=Constant(value=3),
             op="+",
@@ -81,39 +85,39 @@ class TestParserBinOp(unittest.TestCase):
         self.assertEqual(result, desired)
 
 
-class TestParserUnaryOp(unittest.TestCase):
+class TestParserUnaryOp(ParserTestCase):
     def test_parsing_unaryop_minus_constants(self):
         data = "-1"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = UnaryOp(op="-", expr=Constant(value=1))
         self.assertEqual(result, desired)
 
 
-class TestParserExpression(unittest.TestCase):
+class TestParserExpression(ParserTestCase):
     def test_malloc_call(self):
         data = "malloc(1 + a)"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = MallocCall(
             expr=BinaryOp(left=Constant(value=1), op="+", right=Identifier(name="a"))
         )
         self.assertEqual(result, desired)
 
 
-class TestParserAssignment(unittest.TestCase):
+class TestParserAssignment(ParserTestCase):
     def test_parsing_correct_constant_assignment(self):
         data = "x = 3"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(left=Identifier(name="x"), right=Constant(value=3))
         self.assertEqual(result, desired)
 
     def test_parsing_incorrect_constant_assignment(self):
         data = "3 = 3"
         with self.assertRaises(ParseException):
-            C.Expression.parseString(data, parseAll=True)
+            self.grammar.Expression.parseString(data, parseAll=True)
 
     def test_parsing_correct_binop_assignment(self):
         data = "x = 3 + y"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=Identifier(name="x"),
             right=BinaryOp(left=Constant(value=3), op="+", right=Identifier(name="y")),
@@ -123,13 +127,13 @@ class TestParserAssignment(unittest.TestCase):
     def test_parsing_incorrect_binop_assignment(self):
         data = "3 + 3 = x"
         with self.assertRaises(ParseException):
-            C.Expression.parseString(data, parseAll=True)
+            self.grammar.Expression.parseString(data, parseAll=True)
 
 
-class TestParserFuncCall(unittest.TestCase):
+class TestParserFuncCall(ParserTestCase):
     def test_parsing_func_call(self):
         data = "fib(n - 1) + fib(n - 2)"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = BinaryOp(
             left=FuncCall(
                 identifier=Identifier(name="fib"),
@@ -152,10 +156,10 @@ class TestParserFuncCall(unittest.TestCase):
         self.assertEqual(result, desired)
 
 
-class TestLeftHandSide(unittest.TestCase):
+class TestLeftHandSide(ParserTestCase):
     def test_simple_array_assignment(self):
         data = "a[2] = 42"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=ArrayAccess(accessee=Identifier(name="a"), expr=Constant(value=2)),
             right=Constant(value=42),
@@ -164,7 +168,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_array_access(self):
         data = "b = a[1]"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=Identifier(name="b"),
             right=ArrayAccess(accessee=Identifier(name="a"), expr=Constant(value=1)),
@@ -173,7 +177,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_struct_assignment(self):
         data = "foo.bar = 42"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=StructAccess(
                 accessee=Identifier(name="foo"), field=Identifier(name="bar")
@@ -184,7 +188,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_struct_access(self):
         data = "b = foo.bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=Identifier(name="b"),
             right=StructAccess(
@@ -195,7 +199,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_struct_pointer_assignment(self):
         data = "foo->bar = 42"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=StructPointerAccess(
                 pointer=Identifier(name="foo"), field=Identifier(name="bar")
@@ -206,7 +210,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_struct_pointer_access(self):
         data = "b = foo->bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = Assignment(
             left=Identifier(name="b"),
             right=StructPointerAccess(
@@ -217,7 +221,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_pointer_deref(self):
         data = "*foo->bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = PointerDereference(
             pointer=StructPointerAccess(
                 pointer=Identifier(name="foo"), field=Identifier(name="bar")
@@ -227,7 +231,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_backeted_pointer_deref(self):
         data = "(*foo)->bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = StructPointerAccess(
             pointer=PointerDereference(pointer=Identifier(name="foo")),
             field=Identifier(name="bar"),
@@ -236,7 +240,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_simple_address_of(self):
         data = "&foo->bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = AddressOf(
             value=StructPointerAccess(
                 pointer=Identifier(name="foo"), field=Identifier(name="bar")
@@ -246,7 +250,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_bracketed_address_of(self):
         data = "(&foo)->bar"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = StructPointerAccess(
             pointer=AddressOf(value=Identifier(name="foo")),
             field=Identifier(name="bar"),
@@ -255,7 +259,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_complex_left_hand_side(self):
         data = "(&foo->bar[42].baz)[1][2]"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = ArrayAccess(
             accessee=ArrayAccess(
                 accessee=AddressOf(
@@ -278,7 +282,7 @@ class TestLeftHandSide(unittest.TestCase):
 
     def test_complex_left_hand_side_from_slides(self):
         data = "pt->b->a[i+1]"
-        (result,) = C.Expression.parseString(data, parseAll=True)
+        (result,) = self.grammar.Expression.parseString(data, parseAll=True)
         desired = ArrayAccess(
             accessee=StructPointerAccess(
                 pointer=StructPointerAccess(
@@ -291,10 +295,10 @@ class TestLeftHandSide(unittest.TestCase):
         self.assertEqual(result, desired)
 
 
-class TestParserStatement(unittest.TestCase):
+class TestParserStatement(ParserTestCase):
     def test_parse_plain_statement(self):
         data = "x = 42;"
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = PlainStatement(
             expr=Assignment(left=Identifier(name="x"), right=Constant(value=42))
         )
@@ -302,7 +306,7 @@ class TestParserStatement(unittest.TestCase):
 
     def test_parse_statements(self):
         data = "x = 42; y = 2;"
-        (result,) = C.StatementSequence.parseString(data, parseAll=True)
+        (result,) = self.grammar.StatementSequence.parseString(data, parseAll=True)
         desired = StatementSequence(
             PlainStatement(
                 expr=Assignment(left=Identifier(name="x"), right=Constant(value=42))
@@ -316,11 +320,11 @@ class TestParserStatement(unittest.TestCase):
     def test_parse_incorrect_statements(self):
         data = "x = 42; y = 2"
         with self.assertRaises(ParseException):
-            C.StatementSequence.parseString(data, parseAll=True)
+            self.grammar.StatementSequence.parseString(data, parseAll=True)
 
     def test_parse_if_else_if_statement(self):
         data = "if (x < 0) x = 0; else if (1 < x) x = 1;"
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = IfElse(
             expr=BinaryOp(left=Identifier(name="x"), op="<", right=Constant(value=0)),
             then_branch=PlainStatement(
@@ -340,7 +344,7 @@ class TestParserStatement(unittest.TestCase):
 
     def test_parse_while_statement(self):
         data = "while (a > 0) { c = c + 1; a = a - b; }"
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = While(
             expr=BinaryOp(left=Identifier(name="a"), op=">", right=Constant(value=0)),
             body=StatementSequence(
@@ -368,7 +372,7 @@ class TestParserStatement(unittest.TestCase):
 
     def test_parse_for_statement(self):
         data = "for (i = 0; i < 10; i = i + 1) x = x * i;"
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = For(
             expr1=Assignment(left=Identifier(name="i"), right=Constant(value=0)),
             expr2=BinaryOp(left=Identifier(name="i"), op="<", right=Constant(value=10)),
@@ -402,7 +406,7 @@ class TestParserStatement(unittest.TestCase):
                 x = 1;
         }
         """
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = Switch(
             expr=Identifier(name="x"),
             cases=Cases(
@@ -433,7 +437,7 @@ class TestParserStatement(unittest.TestCase):
 
     def test_free_call(self):
         data = "free(1 + a);"
-        (result,) = C.Statement.parseString(data, parseAll=True)
+        (result,) = self.grammar.Statement.parseString(data, parseAll=True)
         desired = FreeCall(
             expr=BinaryOp(left=Constant(value=1), op="+", right=Identifier(name="a"))
         )
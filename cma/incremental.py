@@ -0,0 +1,200 @@
+"""
+Incremental compilation of a program which is edited over time.
+
+The code of every top-level statement is generated and linked on its own,
+with addresses relative to the start of the statement, which works since
+jumps never leave a statement. After an edit, the statements in front of
+and behind the changed text are kept together with their code, only the
+text in between is parsed again. Statements in there which are equal to
+replaced ones keep their code as well. The program is then put together by
+moving the code of each statement to its address, which only touches the
+statements behind the edit if the length of the code in front changed.
+
+Parsing uses the hand-written frontend, whatever the options say, since it
+can report where each statement starts and ends.
+
+Optimizations see one statement at a time as well. With them enabled, the
+code can differ from the one compile_statements() generates for the whole
+program, e.g. peephole rules cannot reuse a value stored by the statement
+in front, and loops which store through pointers keep more of their
+invariants. It computes the same results.
+"""
+
+from bisect import bisect_right
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from pyparsing import ParseException
+
+from cma.backend import Context, EnvEntry, annotate, code, link
+from cma.compiler import DEFAULT_OPTIONS, peephole_rules
+from cma.dead_code import remove_dead_code
+from cma.instructions import JUMPS, Instruction
+from cma.invariants import hoist, reserve
+from cma.options import Options
+from cma.peephole import peephole
+from cma.pratt_frontend import parse_statements
+from cma.simplify import simplify
+from cma.superinstructions import select
+
+
+class Fragment(NamedTuple):
+    node: Any
+    # linked code, addresses are relative to its first instruction
+    code: List[Instruction]
+    # positions of the jumps in code
+    jumps: Tuple[int, ...]
+
+
+def place(program: List[Instruction], fragment: Fragment):
+    offset = len(program)
+    program.extend(fragment.code)
+    if offset:
+        for position in fragment.jumps:
+            instruction = program[offset + position]
+            program[offset + position] = Instruction(
+                instruction.opcode, instruction.operand + offset
+            )
+
+
+def common_prefix(a: str, b: str, block: int = 4096):
+    # compares whole blocks first, which is a lot faster than char by char
+    n = 0
+    limit = min(len(a), len(b))
+    while n + block <= limit and a[n : n + block] == b[n : n + block]:
+        n += block
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return n
+
+
+def starts_with_else(source: str, start: int):
+    return (
+        source.startswith("else", start) and not source[start + 4 : start + 5].isalpha()
+    )
+
+
+class IncrementalCompiler:
+    def __init__(
+        self, environment: Dict[str, EnvEntry], options: Options = DEFAULT_OPTIONS
+    ):
+        self.environment = environment
+        self.options = options
+        self.source = ""
+        # per top-level statement
+        self.fragments: List[Fragment] = []
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.offsets: List[int] = []
+        self.code: List[Instruction] = []
+        # number of statements parsed and generated by the last compilation
+        self.parsed = 0
+        self.generated = 0
+
+    def generate(self, node: Any) -> Fragment:
+        self.generated += 1
+        statement = simplify(node) if self.options.simplify else node
+        environment = self.environment
+        temporaries = {}
+        if self.options.hoist_invariants:
+            # the other statements are not known here
+            statement, temporaries = hoist(statement, environment, whole_program=False)
+            environment = {**environment, **temporaries}
+        context = Context(
+            short_circuit=self.options.short_circuit,
+            fold_addresses=self.options.fold_addresses,
+            rotate_loops=self.options.loops_rotated,
+        )
+        annotate(statement, environment, context.types)
+        symbolic_code = code(statement, environment, context)
+        if self.options.peephole:
+            symbolic_code = peephole(symbolic_code, peephole_rules(self.options))
+        if self.options.remove_dead_code:
+            symbolic_code = remove_dead_code(symbolic_code)
+        symbolic_code = reserve(symbolic_code, len(temporaries))
+        if self.options.superinstructions:
+            symbolic_code = select(symbolic_code)
+        linked = link(symbolic_code)
+        jumps = tuple(
+            position
+            for position, instruction in enumerate(linked)
+            if instruction.opcode in JUMPS
+        )
+        return Fragment(node, linked, jumps)
+
+    def compile(self, source: str) -> List[Instruction]:
+        """
+        Compiles source, reusing whatever is left of the previous source.
+        The returned code must not be modified.
+        """
+        old = self.source
+        prefix = common_prefix(old, source)
+        suffix = common_prefix(old[prefix:][::-1], source[prefix:][::-1])
+        return self.edit(
+            prefix, len(old) - suffix, source[prefix : len(source) - suffix]
+        )
+
+    def edit(self, start: int, end: int, text: str) -> List[Instruction]:
+        """
+        Replaces source[start:end] by text and compiles the result. The
+        returned code must not be modified.
+        """
+        old = self.source
+        source = old[:start] + text + old[end:]
+        delta = len(text) - (end - start)
+        n = len(self.fragments)
+        self.parsed = self.generated = 0
+
+        # a statement is kept if the one behind it ends before the edit,
+        # because an if statement looks at the next token for an else
+        kept = max(bisect_right(self.ends, start) - 1, 0)
+        # statements which start after an unchanged character behind the edit
+        behind = bisect_right(self.starts, end)
+        while behind < n and starts_with_else(old, self.starts[behind]):
+            # such as "else * p;", which could belong to an if in the region
+            behind += 1
+        region_start = self.ends[kept - 1] if kept else 0
+        region_end = (self.starts[behind] if behind < n else len(old)) + delta
+        try:
+            parsed = parse_statements(source[region_start:region_end])
+        except ParseException:
+            # e.g. a bracket which is only closed behind the region
+            kept, behind = 0, n
+            region_start, region_end = 0, len(source)
+            parsed = parse_statements(source)
+        self.parsed = len(parsed)
+
+        replaced = {fragment.node: fragment for fragment in self.fragments[kept:behind]}
+        middle = []
+        for node, _, _ in parsed:
+            fragment = replaced.get(node)
+            middle.append(fragment if fragment is not None else self.generate(node))
+
+        program = self.code[: self.offsets[kept]] if kept < n else list(self.code)
+        offsets = self.offsets[:kept]
+        for fragment in middle:
+            offsets.append(len(program))
+            place(program, fragment)
+        if behind < n:
+            shift = len(program) - self.offsets[behind]
+            offsets.extend(offset + shift for offset in self.offsets[behind:])
+            if shift == 0:
+                program.extend(self.code[self.offsets[behind] :])
+            else:
+                for fragment in self.fragments[behind:]:
+                    place(program, fragment)
+
+        self.source = source
+        self.fragments = self.fragments[:kept] + middle + self.fragments[behind:]
+        self.starts = (
+            self.starts[:kept]
+            + [region_start + start for _, start, _ in parsed]
+            + [start + delta for start in self.starts[behind:]]
+        )
+        self.ends = (
+            self.ends[:kept]
+            + [region_start + end for _, _, end in parsed]
+            + [end + delta for end in self.ends[behind:]]
+        )
+        self.offsets = offsets
+        self.code = program
+        return program
@@ -0,0 +1,108 @@
+import unittest
+
+from pyparsing import ParseException
+
+from cma.backend_test import basic_addr
+from cma.compiler import compile_statements
+from cma.incremental import IncrementalCompiler
+from cma.options import Options
+from cma.vm import VM, globals_size
+
+ENVIRONMENT = {name: basic_addr(address) for address, name in enumerate("ijxyz")}
+
+
+class TestIncrementalCompiler(unittest.TestCase):
+    def assert_compiles(self, compiler, source):
+        result = compiler.compile(source)
+        self.assertEqual(
+            result, compile_statements(source, ENVIRONMENT, compiler.options)
+        )
+        return result
+
+    def test_edits(self):
+        compiler = IncrementalCompiler(ENVIRONMENT)
+        sources = [
+            "x = 1; y = 2; z = 3;",
+            "x = 1; y = 2 + x; z = 3;",
+            "x = 1; while (x < 3) x = x + 1; y = 2 + x; z = 3;",
+            "x = 1; y = 2 + x; z = 3;",
+            "x = 1; if (y) x = 2; z = 3;",
+            "x = 1; if (y) x = 2; else x = 4; z = 3;",
+            "x = 1; if (y) x = 2; z = 3;",
+            "x = 1; if (y) { x = 2; } z = 3;",
+            "",
+            "for (i = 0; i < 3; i = i + 1) switch (i) { case 0: x = 1; break; default: y = i; }",
+        ]
+        for source in sources:
+            with self.subTest(source=source):
+                self.assert_compiles(compiler, source)
+
+    def test_else_behind_edit(self):
+        compiler = IncrementalCompiler(ENVIRONMENT)
+        self.assert_compiles(compiler, "if (x) x = 1; y = 2;")
+        result = compiler.edit(len("if (x) x = 1; "), len("if (x) x = 1; y = 2;"), "")
+        self.assertEqual(result, compile_statements("if (x) x = 1;", ENVIRONMENT))
+        source = "if (x) x = 1; else y = 2;"
+        self.assert_compiles(compiler, source)
+        self.assertEqual(compiler.starts, [0])
+
+    def test_unbalanced_edit(self):
+        compiler = IncrementalCompiler(ENVIRONMENT)
+        self.assert_compiles(compiler, "x = 1; y = 2; z = 3;")
+        # the region alone does not parse, the whole source does
+        self.assert_compiles(compiler, "x = 1; if (y) { y = 2; z = 3; }")
+        self.assertEqual(compiler.parsed, 2)
+        with self.assertRaises(ParseException):
+            compiler.compile("x = 1; if (y) { y = 2; z = 3;")
+        # a failed compilation leaves the previous state
+        self.assert_compiles(compiler, "x = 1; if (y) { y = 2; } z = 3;")
+
+    def test_only_the_edited_statement_is_compiled(self):
+        statements = [
+            f"if (x < {n}) {{ y = y + {n}; }} else z = {n};" for n in range(50)
+        ]
+        compiler = IncrementalCompiler(ENVIRONMENT)
+        self.assert_compiles(compiler, " ".join(statements))
+        self.assertEqual(compiler.generated, 50)
+
+        statements[25] = "while (y > 25) y = y - 1;"
+        self.assert_compiles(compiler, " ".join(statements))
+        self.assertLessEqual(compiler.parsed, 3)
+        self.assertEqual(compiler.generated, 1)
+
+        # the same length of code, so nothing behind it has to be moved
+        statements[25] = "while (y > 26) y = y - 1;"
+        self.assert_compiles(compiler, " ".join(statements))
+        self.assertEqual(compiler.generated, 1)
+
+        del statements[10]
+        self.assert_compiles(compiler, " ".join(statements))
+        self.assertEqual(compiler.generated, 0)
+
+    def test_options(self):
+        options = Options(frontend="pratt", simplify=True)
+        compiler = IncrementalCompiler(ENVIRONMENT, options)
+        self.assert_compiles(compiler, "x = 1 + 2; while (0) y = 1; z = x * 1;")
+        self.assert_compiles(compiler, "x = 1 + 2; while (y) y = 1; z = x * 1;")
+
+    def test_optimizations(self):
+        # statements are optimized on their own, so only the results agree
+        options = Options(
+            simplify=True,
+            peephole=True,
+            short_circuit=True,
+            fold_addresses=True,
+            hoist_invariants=True,
+            superinstructions=True,
+            remove_dead_code=True,
+        )
+        compiler = IncrementalCompiler(ENVIRONMENT, options)
+        size = globals_size(ENVIRONMENT)
+        for source in [
+            "x = 5; y = x; z = y + x * 2;",
+            "x = 5; y = x; while (i < x && y) { z = z + y * 2; i = i + 1; }",
+            "x = 5; if (1) y = x; else y = 2; switch (y) { case 5: z = 1; break; default: z = 2; }",
+        ]:
+            desired = VM(compile_statements(source, ENVIRONMENT, options), size)
+            result = VM(compiler.compile(source), size)
+            self.assertEqual(result.run().state(), desired.run().state(), source)
@@ -0,0 +1,155 @@
+from array import array
+from enum import IntEnum
+from functools import lru_cache
+from typing import Any, Iterable, Tuple, Union
+
+
+class Opcode(IntEnum):
+    LOADC = 0
+    LOAD = 1
+    STORE = 2
+    POP = 3
+    DUP = 4
+    JUMP = 5
+    JUMPZ = 6
+    JUMPI = 7
+    NEW = 8
+    ADD = 9
+    SUB = 10
+    MUL = 11
+    DIV = 12
+    MOD = 13
+    LE = 14
+    LEQ = 15
+    GR = 16
+    GEQ = 17
+    EQ = 18
+    NEQ = 19
+    XOR = 20
+    AND = 21
+    OR = 22
+    NEG = 23
+    NOT = 24
+    HALT = 25
+    # pseudo instruction marking the position of its operand, a symbolic address
+    LABEL = 26
+    # combined instructions: loadc a; load and loadc a; store
+    LOADA = 27
+    STOREA = 28
+
+    @property
+    def mnemonic(self):
+        return MNEMONIC_OF[self]
+
+
+MNEMONIC_OF = {opcode: opcode.name.lower() for opcode in Opcode}
+
+MNEMONICS = {MNEMONIC_OF[opcode]: opcode for opcode in Opcode if opcode != Opcode.LABEL}
+
+# opcodes which take an operand
+WITH_OPERAND = frozenset(
+    (Opcode.LOADC, Opcode.JUMP, Opcode.JUMPZ, Opcode.JUMPI, Opcode.LOADA, Opcode.STOREA)
+)
+
+# opcodes whose operand is an address in the code
+JUMPS = frozenset((Opcode.JUMP, Opcode.JUMPZ, Opcode.JUMPI))
+
+
+class Instruction:
+    """
+    A single CMa instruction. The operand is an int, or a symbolic address
+    for jumps and labels which have not been linked yet.
+    """
+
+    __slots__ = ("opcode", "operand")
+
+    def __init__(self, opcode: Opcode, operand: Any = None):
+        self.opcode = opcode
+        self.operand = operand
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Instruction)
+            and self.opcode == other.opcode
+            and self.operand == other.operand
+        )
+
+    def __hash__(self):
+        return hash((self.opcode, self.operand))
+
+    def __repr__(self):
+        if self.operand is None:
+            return f"Instruction({self.opcode.name})"
+        return f"Instruction({self.opcode.name}, {repr(self.operand)})"
+
+    def __str__(self):
+        if self.operand is None:
+            return MNEMONIC_OF[self.opcode]
+        return f"{MNEMONIC_OF[self.opcode]} {self.operand}"
+
+
+@lru_cache(maxsize=4096)
+def loadc(value: int) -> Instruction:
+    # constants and addresses repeat a lot, so their instructions are shared
+    return Instruction(Opcode.LOADC, value)
+
+
+def parse(line: str) -> Instruction:
+    mnemonic, _, operand = line.partition(" ")
+    opcode = MNEMONICS.get(mnemonic)
+    if opcode is None:
+        raise AssertionError(f"Unknown instruction {repr(line)}")
+    if (opcode in WITH_OPERAND) != bool(operand):
+        raise AssertionError(f"Malformed instruction {repr(line)}")
+    return Instruction(opcode, int(operand) if operand else None)
+
+
+def c_div(a: int, b: int):
+    # C truncates towards zero, python floors
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def c_mod(a: int, b: int):
+    return a - b * c_div(a, b)
+
+
+BINARY_OPERATIONS = {
+    Opcode.ADD: lambda a, b: a + b,
+    Opcode.SUB: lambda a, b: a - b,
+    Opcode.MUL: lambda a, b: a * b,
+    Opcode.DIV: c_div,
+    Opcode.MOD: c_mod,
+    Opcode.LE: lambda a, b: int(a < b),
+    Opcode.LEQ: lambda a, b: int(a <= b),
+    Opcode.GR: lambda a, b: int(a > b),
+    Opcode.GEQ: lambda a, b: int(a >= b),
+    Opcode.EQ: lambda a, b: int(a == b),
+    Opcode.NEQ: lambda a, b: int(a != b),
+    Opcode.XOR: lambda a, b: a ^ b,
+    Opcode.AND: lambda a, b: int(a != 0 and b != 0),
+    Opcode.OR: lambda a, b: int(a != 0 or b != 0),
+}
+
+UNARY_OPERATIONS = {
+    Opcode.NEG: lambda a: -a,
+    Opcode.NOT: lambda a: int(a == 0),
+}
+
+
+def decode(code: Iterable[Union[Instruction, str]]) -> Tuple[array, array]:
+    """
+    Decodes linked instructions, or their textual form such as "loadc 42",
+    into an array of opcodes and an array of operands. Instructions without
+    operand get 0.
+    """
+    opcodes = array("B")
+    operands = array("q")
+    for instruction in code:
+        if isinstance(instruction, str):
+            instruction = parse(instruction)
+        elif instruction.opcode == Opcode.LABEL:
+            raise AssertionError("Cannot decode unlinked code")
+        opcodes.append(instruction.opcode)
+        operands.append(instruction.operand or 0)
+    return opcodes, operands
@@ -0,0 +1,286 @@
+"""
+Opt-in measurements of the compiler pipeline.
+
+Pass an Instrumentation to the functions of cma.compiler to record, per
+phase, the wall time and the number of memory blocks allocated, and for
+every handler of the backend dispatch tables the calls, the time spent and
+the instructions emitted (labels included) per AST node type, as well as
+the hit rate of the packrat cache of pyparsing. Without an Instrumentation
+the pipeline runs unchanged.
+
+Handler measurements are exclusive, a BinaryOp does not include the time or
+instructions of its operands. They include some overhead of the measurement
+itself, so they are best compared with each other. Allocations are the net
+change of sys.getallocatedblocks(), i.e. blocks which are still alive at the
+end of a phase. Counting them walks the heap, which is too slow to do for
+every handler call, so they are only recorded per phase: allocations per AST
+node type are not measured, and handler records have no allocation field.
+
+While handlers are measured, the dispatch tables of cma.backend are
+patched, so code generation must not run on other threads at the same time.
+
+With memory=True, every phase also records its peak memory above the
+memory in use when it started, and the lines which allocated most of the
+memory that is still alive at its end, both measured with tracemalloc. This
+makes compilation several times slower.
+
+The results are exported as records, plain dicts which can be stored as JSON
+or sent between processes and combined with aggregate().
+"""
+
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from pyparsing import ParserElement
+
+from cma.backend import CODE, CODE_L, CODE_R, DATATYPE
+from cma.instructions import Instruction
+
+# name of a handler in the records -> table
+TABLES = {"code": CODE, "code_r": CODE_R, "code_l": CODE_L, "datatype": DATATYPE}
+# allocations of the measurement itself
+OWN_ALLOCATIONS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+]
+
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    seconds: float = 0.0
+    allocations: int = 0
+
+
+@dataclass
+class HandlerStats:
+    # no allocations, they are only counted per phase
+    calls: int = 0
+    seconds: float = 0.0
+    instructions: int = 0
+
+
+@dataclass
+class MemoryStats:
+    # bytes, the maximum over all calls of the phase
+    peak: int = 0
+    # "file:line" -> [bytes, blocks] alive at the end of the phase
+    sites: Dict[str, List[int]] = field(default_factory=dict)
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        # (site, bytes, blocks) of the n sites which allocated most
+        sites = sorted(self.sites.items(), key=lambda item: -item[1][0])
+        return [(site, size, count) for site, (size, count) in sites[:n]]
+
+
+class Instrumentation:
+    def __init__(self, memory: bool = False, top: int = 10):
+        self.memory = memory
+        # allocation sites kept per phase
+        self.top = top
+        self.phases: Dict[str, PhaseStats] = {}
+        self.memory_phases: Dict[str, MemoryStats] = {}
+        # (table name, node type name) -> stats
+        self.handlers: Dict[Tuple[str, str], HandlerStats] = {}
+        self.packrat_hits = 0
+        self.packrat_misses = 0
+        # [seconds] of the handlers called by the handlers which are running
+        self.frames: List[List[Any]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        stats = self.phases.setdefault(name, PhaseStats())
+        tracing = self.start_tracing() if self.memory else None
+        blocks = sys.getallocatedblocks()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += perf_counter() - start
+            stats.allocations += sys.getallocatedblocks() - blocks
+            stats.calls += 1
+            if tracing is not None:
+                self.stop_tracing(name, *tracing)
+
+    def start_tracing(self):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return started, before, current
+
+    def stop_tracing(
+        self, name: str, started: bool, before: tracemalloc.Snapshot, current: int
+    ):
+        peak = tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+        if started:
+            tracemalloc.stop()
+        stats = self.memory_phases.setdefault(name, MemoryStats())
+        stats.peak = max(stats.peak, peak)
+        differences = after.filter_traces(OWN_ALLOCATIONS).compare_to(
+            before.filter_traces(OWN_ALLOCATIONS), "lineno"
+        )
+        for difference in differences[: self.top]:
+            if difference.size_diff <= 0:
+                break
+            frame = difference.traceback[0]
+            site = stats.sites.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            site[0] += difference.size_diff
+            site[1] += difference.count_diff
+
+    @contextmanager
+    def packrat(self):
+        # pyparsing counts the hits and misses of its packrat cache globally
+        # and resets them at the start of every parse
+        stats = ParserElement.packrat_cache_stats
+        stats[:] = [0] * len(stats)
+        try:
+            yield
+        finally:
+            self.packrat_hits += stats[0]
+            self.packrat_misses += stats[1]
+
+    def finish(self, stats: HandlerStats, seconds: float):
+        # subtracts the handlers called meanwhile and adds to the caller's
+        children = self.frames.pop()
+        stats.seconds += seconds - children[0]
+        if self.frames:
+            self.frames[-1][0] += seconds
+
+    def trace(self, stats: HandlerStats, generator: Iterator) -> Iterator:
+        # the code of children is requested from cma.backend.emit rather
+        # than generated by the handler, so only datatypes are subtracted
+        stats.calls += 1
+        while True:
+            self.frames.append([0.0])
+            start = perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                self.finish(stats, perf_counter() - start)
+            if type(item) is Instruction:
+                stats.instructions += 1
+            yield item
+
+    def stats(self, table: str, node: Any) -> HandlerStats:
+        key = (table, type(node).__name__)
+        stats = self.handlers.get(key)
+        if stats is None:
+            stats = self.handlers[key] = HandlerStats()
+        return stats
+
+    def wrap(self, table: str, handler: Callable) -> Callable:
+        if table != "datatype":
+
+            def wrapped(node, environment, context):
+                generator = handler(node, environment, context)
+                return self.trace(self.stats(table, node), generator)
+
+            return wrapped
+
+        def wrapped(node, environment, types):
+            stats = self.stats(table, node)
+            stats.calls += 1
+            self.frames.append([0.0])
+            start = perf_counter()
+            try:
+                return handler(node, environment, types)
+            finally:
+                self.finish(stats, perf_counter() - start)
+
+        return wrapped
+
+    @contextmanager
+    def measure_handlers(self):
+        """
+        Measures the handlers of the dispatch tables while active. Handlers
+        are counted under the type of the node they are called for.
+        """
+        saved = {name: dict(table) for name, table in TABLES.items()}
+        for name, table in TABLES.items():
+            for cls, handler in saved[name].items():
+                table[cls] = self.wrap(name, handler)
+        try:
+            yield
+        finally:
+            for name, table in TABLES.items():
+                # also drops the wrapped handlers cached for subclasses
+                table.clear()
+                table.update(saved[name])
+
+    def records(self) -> List[Dict[str, Any]]:
+        result = [
+            {"kind": "phase", "phase": name, **asdict(stats)}
+            for name, stats in self.phases.items()
+        ]
+        result += [
+            {"kind": "handler", "table": table, "node": node, **asdict(stats)}
+            for (table, node), stats in self.handlers.items()
+            if stats.calls
+        ]
+        result += [
+            {
+                "kind": "memory",
+                "phase": name,
+                "peak": stats.peak,
+                "sites": stats.top(self.top),
+            }
+            for name, stats in self.memory_phases.items()
+        ]
+        if self.packrat_hits or self.packrat_misses:
+            result.append(
+                {
+                    "kind": "packrat",
+                    "hits": self.packrat_hits,
+                    "misses": self.packrat_misses,
+                }
+            )
+        return result
+
+    def add(self, records: Iterable[Dict[str, Any]]):
+        for record in records:
+            record = dict(record)
+            kind = record.pop("kind")
+            if kind == "phase":
+                stats = self.phases.setdefault(record.pop("phase"), PhaseStats())
+            elif kind == "handler":
+                key = (record.pop("table"), record.pop("node"))
+                stats = self.handlers.setdefault(key, HandlerStats())
+            elif kind == "memory":
+                stats = self.memory_phases.setdefault(record["phase"], MemoryStats())
+                stats.peak = max(stats.peak, record["peak"])
+                for site, size, count in record["sites"]:
+                    total = stats.sites.setdefault(site, [0, 0])
+                    total[0] += size
+                    total[1] += count
+                continue
+            else:
+                self.packrat_hits += record["hits"]
+                self.packrat_misses += record["misses"]
+                continue
+            for name, value in record.items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+    @property
+    def packrat_hit_rate(self) -> float:
+        total = self.packrat_hits + self.packrat_misses
+        return self.packrat_hits / total if total else 0.0
+
+
+def aggregate(batches: Iterable[Iterable[Dict[str, Any]]]) -> Instrumentation:
+    """
+    Sums the records of several compilations, e.g. of a batch.
+    """
+    instrumentation = Instrumentation()
+    for records in batches:
+        instrumentation.add(records)
+    return instrumentation
@@ -0,0 +1,118 @@
+import tracemalloc
+import unittest
+
+from cma.backend import CODE, CODE_R, DATATYPE
+from cma.backend_test import basic_addr
+from cma.batch import compile_many
+from cma.compiler import compile_statements
+from cma.instrumentation import Instrumentation, aggregate
+from cma.options import Options
+
+ENVIRONMENT = {"x": basic_addr(1), "y": basic_addr(2)}
+
+
+def handlers(records):
+    return {
+        (record["table"], record["node"]): (record["calls"], record["instructions"])
+        for record in records
+        if record["kind"] == "handler"
+    }
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_phases(self):
+        source = "while (x > y) x = x - 1;"
+        options = Options(simplify=True, peephole=True)
+        instrumentation = Instrumentation()
+        result = compile_statements(source, ENVIRONMENT, options, instrumentation)
+        self.assertEqual(result, compile_statements(source, ENVIRONMENT, options))
+        phases = [r["phase"] for r in instrumentation.records() if r["kind"] == "phase"]
+        self.assertEqual(
+            phases, ["parse", "simplify", "annotate", "codegen", "peephole", "link"]
+        )
+        self.assertGreater(instrumentation.phases["parse"].seconds, 0)
+        self.assertIsInstance(instrumentation.phases["parse"].allocations, int)
+
+    def test_handlers_are_exclusive(self):
+        instrumentation = Instrumentation()
+        compile_statements("x = y + 1; x = 2;", ENVIRONMENT, Options(), instrumentation)
+        self.assertEqual(
+            handlers(instrumentation.records()),
+            {
+                ("code", "StatementSequence"): (1, 0),
+                ("code", "PlainStatement"): (2, 2),
+                ("code_r", "Assignment"): (2, 2),
+                ("code_l", "Identifier"): (3, 3),
+                ("code_r", "BinaryOp"): (1, 1),
+                # the load, the address comes from code_l
+                ("code_r", "Identifier"): (1, 1),
+                ("code_r", "Constant"): (2, 2),
+                ("datatype", "Assignment"): (2, 0),
+                ("datatype", "Identifier"): (3, 0),
+                ("datatype", "BinaryOp"): (1, 0),
+                ("datatype", "Constant"): (2, 0),
+            },
+        )
+
+    def test_tables_are_restored(self):
+        tables = [dict(CODE), dict(CODE_R), dict(DATATYPE)]
+        instrumentation = Instrumentation()
+        with self.assertRaises(KeyError):
+            compile_statements("x = z;", ENVIRONMENT, Options(), instrumentation)
+        self.assertEqual([dict(CODE), dict(CODE_R), dict(DATATYPE)], tables)
+
+    def test_packrat(self):
+        instrumentation = Instrumentation()
+        compile_statements("x = (x + 1) * y;", ENVIRONMENT, Options(), instrumentation)
+        self.assertGreater(instrumentation.packrat_hits, 0)
+        self.assertLess(instrumentation.packrat_hit_rate, 1)
+        instrumentation = Instrumentation()
+        compile_statements("x = 1;", ENVIRONMENT, Options("pratt"), instrumentation)
+        self.assertEqual(instrumentation.packrat_hit_rate, 0)
+        self.assertNotIn("packrat", [r["kind"] for r in instrumentation.records()])
+
+    def test_aggregate_batch(self):
+        sources = ["x = 1;", "y = x;", "x = ;"]
+        results = list(compile_many(sources, ENVIRONMENT, 1, instrument=True))
+        self.assertEqual([result.ok for result in results], [True, True, False])
+        total = aggregate(result.records for result in results)
+        self.assertEqual(total.phases["parse"].calls, 3)
+        self.assertEqual(total.phases["link"].calls, 2)
+        self.assertEqual(total.handlers["code", "PlainStatement"].calls, 2)
+        self.assertEqual(
+            total.packrat_misses,
+            sum(
+                record["misses"]
+                for result in results
+                for record in result.records
+                if record["kind"] == "packrat"
+            ),
+        )
+        self.assertGreater(total.packrat_misses, 0)
+        (result,) = compile_many(sources[:1], ENVIRONMENT, 1)
+        self.assertIsNone(result.records)
+
+    def test_memory(self):
+        instrumentation = Instrumentation(memory=True, top=2)
+        compile_statements("x = y + 1; x = 2;", ENVIRONMENT, Options(), instrumentation)
+        self.assertFalse(tracemalloc.is_tracing())
+        records = [r for r in instrumentation.records() if r["kind"] == "memory"]
+        self.assertEqual(
+            [r["phase"] for r in records], ["parse", "annotate", "codegen", "link"]
+        )
+        parse = records[0]
+        self.assertGreater(parse["peak"], 0)
+        self.assertEqual(len(parse["sites"]), 2)
+        site, size, count = parse["sites"][0]
+        self.assertNotIn("instrumentation.py", site)
+        self.assertGreaterEqual(size, parse["sites"][1][1])
+
+        total = aggregate([records, records])
+        self.assertEqual(total.memory_phases["parse"].peak, parse["peak"])
+        self.assertEqual(
+            total.memory_phases["parse"].sites[site], [2 * size, 2 * count]
+        )
+        # without memory=True nothing is traced
+        instrumentation = Instrumentation()
+        compile_statements("x = 1;", ENVIRONMENT, Options(), instrumentation)
+        self.assertEqual(instrumentation.memory_phases, {})
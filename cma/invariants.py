@@ -0,0 +1,272 @@
+"""
+Loop-invariant code motion on the AST.
+
+Expressions in the condition and body of a while or for loop which have the
+same value in every iteration are evaluated once in front of the loop into
+a temporary, which the loop reads instead. An expression is hoisted if it
+
+- does an operation, reading a variable alone is not worth a temporary,
+- cannot fail, i.e. only divides by nonzero constants and does not go
+  through pointers, since it is evaluated even if the loop does not run,
+- only reads variables, struct fields and array elements at constant
+  addresses which the loop does not assign to. Assigning to a field or
+  element counts as assigning to the whole variable.
+
+A store through a pointer may change any variable which it can point to.
+Such loops only keep the values of int and pointer variables whose
+address is never taken, struct fields and array elements are never
+invariant in them. Without knowing the whole program, every variable may
+be pointed to.
+
+The temporaries are stack slots right above the globals. They are added
+to the environment of the code generation under names which cannot clash
+with C identifiers, and the code which uses them reserves them first, see
+reserve().
+"""
+
+from dataclasses import replace
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from cma.backend import (
+    BASIC,
+    POP,
+    SCALARS,
+    Array,
+    EnvEntry,
+    datatype,
+    traversal,
+)
+from cma.frontend import (
+    AddressOf,
+    ArrayAccess,
+    Assignment,
+    BinaryOp,
+    Constant,
+    For,
+    Identifier,
+    IfElse,
+    PlainStatement,
+    StatementSequence,
+    StructAccess,
+    Switch,
+    UnaryOp,
+    While,
+)
+from cma.instructions import Instruction, loadc
+from cma.vm import globals_size
+
+
+def nodes(node: Any) -> Iterator[Any]:
+    # every statement and expression in node
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            stack.extend(node)
+            continue
+        kind = traversal(type(node))
+        if kind is None:
+            continue
+        yield node
+        stack.extend(getattr(node, name) for name in kind[1])
+
+
+class Loop:
+    """
+    What the statements of a loop assign to.
+    """
+
+    def __init__(self, hoister: "Hoister", loop: Any):
+        self.assigned: Set[str] = set()
+        self.pointer_store = False
+        for node in nodes(loop):
+            if isinstance(node, Assignment):
+                root = hoister.root(node.left)
+                if root is None:
+                    self.pointer_store = True
+                else:
+                    self.assigned.add(root)
+        # expression -> temporary
+        self.hoisted: Dict[Any, Identifier] = {}
+
+
+class Hoister:
+    def __init__(
+        self, environment: Dict[str, EnvEntry], exposed: Optional[Set[str]] = None
+    ):
+        # the temporaries are added to it
+        self.environment = dict(environment)
+        self.base = globals_size(environment)
+        self.temporaries: Dict[str, EnvEntry] = {}
+        # variables whose address may be taken, None for all of them
+        self.exposed = exposed
+
+    def temporary(self) -> Identifier:
+        name = f"${len(self.temporaries)}"
+        entry = EnvEntry(self.base + len(self.temporaries), BASIC)
+        self.temporaries[name] = self.environment[name] = entry
+        return Identifier(name)
+
+    def is_array(self, node: Any):
+        return isinstance(datatype(node, self.environment), Array)
+
+    def root(self, node: Any) -> Optional[str]:
+        """
+        The variable which contains the location node, None if it is
+        reached through a pointer.
+        """
+        while True:
+            if isinstance(node, Identifier):
+                return node.name
+            elif isinstance(node, StructAccess):
+                node = node.accessee
+            elif isinstance(node, ArrayAccess) and self.is_array(node.accessee):
+                node = node.accessee
+            else:
+                return None
+
+    def location(self, node: Any) -> Optional[str]:
+        # the variable of a location at a constant address
+        while True:
+            if isinstance(node, Identifier):
+                return node.name
+            elif isinstance(node, StructAccess):
+                node = node.accessee
+            elif (
+                isinstance(node, ArrayAccess)
+                and isinstance(node.expr, Constant)
+                and self.is_array(node.accessee)
+            ):
+                node = node.accessee
+            else:
+                return None
+
+    def keeps(self, loop: Loop, name: str):
+        # whether the loop leaves the variable alone
+        if name in loop.assigned:
+            return False
+        if not loop.pointer_store:
+            return True
+        return (
+            self.exposed is not None
+            and name not in self.exposed
+            and isinstance(self.environment[name].datatype, SCALARS)
+        )
+
+    def invariant(self, node: Any, loop: Loop):
+        if isinstance(node, Constant):
+            return True
+        elif isinstance(node, BinaryOp):
+            if node.op in ("/", "%") and not (
+                isinstance(node.right, Constant) and node.right.value != 0
+            ):
+                return False
+            return self.invariant(node.left, loop) and self.invariant(node.right, loop)
+        elif isinstance(node, UnaryOp):
+            return self.invariant(node.expr, loop)
+        name = self.location(node)
+        return name is not None and self.keeps(loop, name)
+
+    def rewrite(self, node: Any, loop: Loop):
+        """
+        Replaces the invariant operations in node by temporaries.
+        """
+        if isinstance(node, (BinaryOp, UnaryOp)) and self.invariant(node, loop):
+            temporary = loop.hoisted.get(node)
+            if temporary is None:
+                temporary = loop.hoisted[node] = self.temporary()
+            return temporary
+        if isinstance(node, tuple):
+            items = tuple(self.rewrite(item, loop) for item in node)
+            if all(new is old for new, old in zip(items, node)):
+                return node
+            return type(node)(*items)
+        kind = traversal(type(node))
+        if kind is None:
+            return node
+        children = {name: getattr(node, name) for name in kind[1]}
+        rewritten = {
+            name: self.rewrite(child, loop) for name, child in children.items()
+        }
+        if all(rewritten[name] is child for name, child in children.items()):
+            return node
+        return replace(node, **rewritten)
+
+    def loop(self, node: Any):
+        # inner loops first, their temporaries are then assigned in this loop
+        node = replace(node, body=self.statement(node.body))
+        loop = Loop(self, node)
+        if isinstance(node, While):
+            node = While(self.rewrite(node.expr, loop), self.rewrite(node.body, loop))
+        else:
+            # expr1 is only evaluated once
+            node = For(
+                node.expr1,
+                self.rewrite(node.expr2, loop),
+                self.rewrite(node.expr3, loop),
+                self.rewrite(node.body, loop),
+            )
+        if not loop.hoisted:
+            return node
+        assignments = (
+            PlainStatement(Assignment(temporary, expression))
+            for expression, temporary in loop.hoisted.items()
+        )
+        return StatementSequence(*assignments, node)
+
+    def statement(self, node: Any):
+        if isinstance(node, StatementSequence):
+            return StatementSequence(*(self.statement(item) for item in node))
+        elif isinstance(node, IfElse):
+            else_branch = node.else_branch
+            return replace(
+                node,
+                then_branch=self.statement(node.then_branch),
+                else_branch=(
+                    None if else_branch is None else self.statement(else_branch)
+                ),
+            )
+        elif isinstance(node, (While, For)):
+            return self.loop(node)
+        elif isinstance(node, Switch):
+            cases = type(node.cases)(
+                *(replace(case, body=self.statement(case.body)) for case in node.cases)
+            )
+            return replace(
+                node, cases=cases, default_case=self.statement(node.default_case)
+            )
+        return node
+
+
+def exposed_variables(node: Any, environment: Dict[str, EnvEntry]) -> Set[str]:
+    """
+    The variables in node whose address is taken with &.
+    """
+    hoister = Hoister(environment)
+    roots = (hoister.root(n.value) for n in nodes(node) if isinstance(n, AddressOf))
+    return {root for root in roots if root is not None}
+
+
+def hoist(
+    node: Any, environment: Dict[str, EnvEntry], whole_program: bool = True
+) -> Tuple[Any, Dict[str, EnvEntry]]:
+    """
+    Hoists the loop invariants out of the loops in a statement (sequence).
+    Returns the new statement and the temporaries, which its code must
+    reserve and be generated with in the environment. Unless node is
+    the whole program, loops which store through pointers are assumed to
+    change every struct and array and every variable.
+    """
+    exposed = exposed_variables(node, environment) if whole_program else None
+    hoister = Hoister(environment, exposed)
+    return hoister.statement(node), hoister.temporaries
+
+
+def reserve(symbolic_code: Iterable[Instruction], size: int) -> Iterable[Instruction]:
+    """
+    Reserves size stack slots right above the globals for temporaries while
+    symbolic_code runs, which must start with an empty stack.
+    """
+    if not size:
+        return symbolic_code
+    return [*[loadc(0)] * size, *symbolic_code, *[POP] * size]
@@ -0,0 +1,143 @@
+import unittest
+
+from cma.backend import Array, Basic, EnvEntry, Pointer, Struct
+from cma.backend_test import basic_addr
+from cma.compiler import compile_statements, parse
+from cma.frontend import Assignment, Identifier, StatementSequence
+from cma.incremental import IncrementalCompiler
+from cma.invariants import hoist, nodes
+from cma.jit import JIT
+from cma.options import Options
+from cma.stack_depth import stack_depth
+from cma.vm import VM, globals_size
+
+ENVIRONMENT = {
+    **{name: basic_addr(i) for i, name in enumerate(["i", "j", "n", "x", "y", "z"])},
+    "a": EnvEntry(6, Array(Basic(), 10)),
+    "s": EnvEntry(16, Struct(("v", Basic()), ("w", Array(Basic(), 3)))),
+    "q": EnvEntry(20, Pointer(Basic())),
+}
+HOIST = Options(hoist_invariants=True)
+
+
+def hoisted(source, environment=ENVIRONMENT):
+    """
+    The expressions assigned to temporaries, in the order of the temporaries.
+    """
+    node, temporaries = hoist(parse(source), environment)
+    assignments = {
+        n.left.name: n.right
+        for n in nodes(node)
+        if isinstance(n, Assignment) and n.left in map(Identifier, temporaries)
+    }
+    return [assignments[name] for name in temporaries]
+
+
+class TestHoist(unittest.TestCase):
+    def assertHoisted(self, source, expressions):
+        desired = [parse(f"{expression};")[0].expr for expression in expressions]
+        self.assertEqual(hoisted(source), desired)
+
+    def test_invariants(self):
+        self.assertHoisted(
+            "for (i = 0; i < n * 2; i = i + 1) { x = x + (y - 1) * z; a[i] = -y; }",
+            ["n * 2", "(y - 1) * z", "-y"],
+        )
+        self.assertHoisted("while (x < y + 1) x = x + 1;", ["y + 1"])
+
+    def test_same_expression_once(self):
+        self.assertHoisted("while (x < y * y) x = x + y * y;", ["y * y"])
+
+    def test_assigned(self):
+        self.assertHoisted("while (x < 10) { x = x + 1; y = x * 2; }", [])
+        self.assertHoisted("for (i = 0; i < 10; i = i + 1) y = i * 2;", [])
+        # expr1 runs in front of the loop, but after the temporaries
+        self.assertHoisted("for (y = 0; x < 10; x = x + 1) z = y * 2;", [])
+
+    def test_locations(self):
+        self.assertHoisted(
+            "while (x < 9) x = x + s.v * s.w[1] + a[2] * 2;",
+            ["s.v * s.w[1]", "a[2] * 2"],
+        )
+        # a store to any element counts as a store to the whole array
+        self.assertHoisted("while (x < 9) { x = x + a[2] * 2; a[x] = 1; }", [])
+        self.assertHoisted("while (x < 9) { x = x + s.w[2] * 2; s.v = 1; }", [])
+        # the index might be out of bounds
+        self.assertHoisted("while (x < 9) x = x + a[y] * 2;", [])
+
+    def test_cannot_fail(self):
+        self.assertHoisted("while (x < 9) x = x + y / z + y % 2;", ["y % 2"])
+        self.assertHoisted("while (x < 9) x = x + *q * 2;", [])
+
+    def test_pointer_stores(self):
+        self.assertHoisted("while (x < 9) { *q = x; x = x + y * 2; }", ["y * 2"])
+        self.assertHoisted(
+            "q = &y; while (x < 9) { *q = x; x = x + y * 2 + z * 2; }", ["z * 2"]
+        )
+        self.assertHoisted("q = &s.v; while (x < 9) { *q = x; x = s.v * 2; }", [])
+        self.assertHoisted("while (x < 9) { *q = x; x = a[1] * 2; }", [])
+
+    def test_incremental_knows_no_addresses(self):
+        source = "while (x < 9) { *q = x; x = x + y * 2; }"
+        node, temporaries = hoist(parse(source)[0], ENVIRONMENT, whole_program=False)
+        self.assertEqual(temporaries, {})
+
+    def test_nested(self):
+        source = """
+        while (i < 3) {
+            j = 0;
+            while (j < i * 2) { x = x + n * 2; j = j + 1; }
+            i = i + 1;
+        }
+        """
+        node, temporaries = hoist(parse(source), ENVIRONMENT)
+        # n * 2 goes in front of the outer loop, i * 2 only of the inner one
+        outer = node[0]
+        self.assertIsInstance(outer, StatementSequence)
+        n_times_2 = parse("n * 2;")[0].expr
+        self.assertEqual(outer[0].expr, Assignment(Identifier("$2"), n_times_2))
+        inner = [n.expr for n in nodes(outer[1]) if hasattr(n, "expr")]
+        self.assertIn(Assignment(Identifier("$1"), Identifier("$2")), inner)
+        self.assertEqual(list(temporaries), ["$0", "$1", "$2"])
+        self.assertEqual(temporaries["$0"].address, globals_size(ENVIRONMENT))
+
+
+class TestExecution(unittest.TestCase):
+    PROGRAMS = [
+        "n = 7; y = 3; for (i = 0; i < n * 2 - 5; i = i + 1) { a[i % 10] = a[i] + y * y; x = x + (y + n) * 2; }",  # fmt: skip
+        "n = 4; while (i < n) { j = 0; while (j < n - i) { z = z + s.w[1] * n + j; j = j + 1; } i = i + 1; }",  # fmt: skip
+        "q = &y; y = 1; x = 0; while (x < 20) { *q = *q + 1; x = x + y * 2; }",
+        "y = 2; while (x < 5) { switch (x) { case 1: z = z + y * 3; break; default: z = z - y * 3; } x = x + 1; }",  # fmt: skip
+    ]
+
+    def run_program(self, code, executor=VM):
+        self.assertEqual(stack_depth(code).problems, [])
+        return executor(code, globals_size(ENVIRONMENT)).run({8: 5, 17: 1, 18: 6})
+
+    def test_same_result(self):
+        for source in self.PROGRAMS:
+            desired = self.run_program(compile_statements(source, ENVIRONMENT))
+            for options in [HOIST, Options(hoist_invariants=True, peephole=True)]:
+                code = compile_statements(source, ENVIRONMENT, options)
+                for executor in [VM, JIT]:
+                    execution = self.run_program(code, executor)
+                    self.assertEqual(execution.state(), desired.state(), source)
+            code = IncrementalCompiler(ENVIRONMENT, HOIST).compile(source)
+            self.assertEqual(self.run_program(code).state(), desired.state(), source)
+
+    def test_fewer_instructions(self):
+        source = self.PROGRAMS[1]
+        plain = self.run_program(compile_statements(source, ENVIRONMENT))
+        code = compile_statements(source, ENVIRONMENT, HOIST)
+        self.assertLess(self.run_program(code).instructions, plain.instructions)
+
+    def test_default_unchanged(self):
+        source = self.PROGRAMS[0]
+        self.assertEqual(
+            compile_statements(source, ENVIRONMENT),
+            compile_statements(source, ENVIRONMENT, Options(hoist_invariants=False)),
+        )
+        self.assertEqual(
+            compile_statements("x = y * 2;", ENVIRONMENT, HOIST),
+            compile_statements("x = y * 2;", ENVIRONMENT),
+        )
@@ -0,0 +1,320 @@
+"""
+Executes CMa code by compiling it to python functions.
+
+Every address which control reaches gets a block: the straight-line code from
+that address up to and including the next jump. A block is translated into
+the source of one python function and built with ``compile()`` the first time
+it is entered. Within a block the operand stack lives in python locals and
+expressions, only the values which are left on the stack when the block exits
+are written to memory.
+
+The values on the stack are also written to memory before every store, since
+the program may store to its own operand stack, e.g. to the temporaries of
+cma.invariants. The translation assumes that the program does not load values
+from its operand stack which were pushed after the last store, which holds for
+code from the backend.
+"""
+
+from itertools import count
+from time import perf_counter
+from typing import Dict, Iterable, NamedTuple, Optional, Union
+
+from cma.backend import EnvEntry
+from cma.instructions import Instruction, Opcode, c_div, c_mod
+from cma.vm import VM, Execution, VMError, globals_size
+
+ARITHMETIC_OPS = {
+    Opcode.ADD: "+",
+    Opcode.SUB: "-",
+    Opcode.MUL: "*",
+    Opcode.XOR: "^",
+}
+
+COMPARISON_OPS = {
+    Opcode.LE: "<",
+    Opcode.LEQ: "<=",
+    Opcode.GR: ">",
+    Opcode.GEQ: ">=",
+    Opcode.EQ: "==",
+    Opcode.NEQ: "!=",
+}
+
+DIVISION_OPS = {Opcode.DIV: "c_div", Opcode.MOD: "c_mod"}
+
+
+class Value(NamedTuple):
+    # python expression of the value
+    expr: str
+    # python expression of the value's truthiness, if it is a condition
+    cond: Optional[str] = None
+    # whether evaluating expr reads memory
+    reads: bool = False
+    # how deeply expr nests the expressions of other values
+    depth: int = 0
+
+
+# values nested deeper are stored in a temporary, since python only accepts
+# expressions with up to 200 nested parentheses
+MAX_DEPTH = 32
+
+
+def nested(*operands: Value):
+    return max(operand.depth for operand in operands) + 1
+
+
+def offset(base: str, delta: int):
+    if delta > 0:
+        return f"{base} + {delta}"
+    elif delta < 0:
+        return f"{base} - {-delta}"
+    return base
+
+
+class BlockTranslator:
+    def __init__(self, opcodes, operands, start: int):
+        self.opcodes = opcodes
+        self.operands = operands
+        self.start = start
+        self.lines = []
+        self.stack = []
+        # number of values popped from the stack in memory
+        self.below = 0
+        # how far sp was moved by flush_stack()
+        self.shift = 0
+        # values the stack must hold when the block is entered
+        self.needed = 0
+        self.temps = count()
+
+    def emit(self, line: str):
+        self.lines.append(line)
+
+    def temp(self, expr: str):
+        name = f"t{next(self.temps)}"
+        self.emit(f"{name} = {expr}")
+        return name
+
+    def push(self, value: Value):
+        if value.depth > MAX_DEPTH:
+            value = self.simple(value)
+        self.stack.append(value)
+
+    def pop(self):
+        if self.stack:
+            return self.stack.pop()
+        self.below += 1
+        self.needed = max(self.needed, self.below - self.shift)
+        return Value(self.temp(f"s[{offset('sp', 1 - self.below)}]"))
+
+    def simple(self, value: Value):
+        # evaluates value once, so that it can be used several times
+        if value.expr.isidentifier() or value.expr.lstrip("(-").rstrip(")").isdigit():
+            return value
+        if value.cond is not None:
+            if value.cond.isidentifier():
+                return value
+            cond = self.temp(value.cond)
+            return Value(f"(1 if {cond} else 0)", cond)
+        return Value(self.temp(value.expr))
+
+    def flush_reads(self):
+        # stores must not overtake loads which happened before them
+        for i, value in enumerate(self.stack):
+            if value.reads:
+                self.stack[i] = self.simple(value)
+
+    def height(self):
+        return len(self.stack) - self.below
+
+    def write_back(self):
+        for i, value in enumerate(self.stack):
+            self.emit(f"s[{offset('sp', 1 - self.below + i)}] = {value.expr}")
+        return offset("sp", self.height())
+
+    def flush_stack(self):
+        # a store may go to the stack itself, which must hold the values
+        # pushed so far then, and it must not overtake earlier loads
+        if self.stack:
+            self.emit(f"sp = {self.write_back()}")
+            self.shift += self.height()
+            self.stack = []
+            self.below = 0
+
+    def translate(self):
+        opcodes = self.opcodes
+        operands = self.operands
+        pc = self.start
+        n = len(opcodes)
+        while pc < n:
+            opcode = opcodes[pc]
+            operand = operands[pc]
+            pc += 1
+            if opcode == Opcode.LOADC:
+                self.push(Value(str(operand) if operand >= 0 else f"({operand})"))
+            elif opcode == Opcode.LOAD:
+                address = self.pop()
+                self.push(
+                    Value(f"s[{address.expr}]", reads=True, depth=nested(address))
+                )
+            elif opcode == Opcode.STORE:
+                address = self.pop()
+                value = self.pop()
+                self.flush_stack()
+                value = self.simple(value)
+                self.emit(f"s[{address.expr}] = {value.expr}")
+                self.push(value)
+            elif opcode == Opcode.LOADA:
+                self.push(Value(f"s[{operand}]", reads=True))
+            elif opcode == Opcode.STOREA:
+                value = self.pop()
+                self.flush_stack()
+                value = self.simple(value)
+                self.emit(f"s[{operand}] = {value.expr}")
+                self.push(value)
+            elif opcode == Opcode.POP:
+                self.pop()
+            elif opcode == Opcode.DUP:
+                value = self.simple(self.pop())
+                self.push(value)
+                self.push(value)
+            elif opcode in ARITHMETIC_OPS:
+                b = self.pop()
+                a = self.pop()
+                expr = f"({a.expr} {ARITHMETIC_OPS[opcode]} {b.expr})"
+                self.push(Value(expr, reads=a.reads or b.reads, depth=nested(a, b)))
+            elif opcode in DIVISION_OPS:
+                b = self.pop()
+                a = self.pop()
+                # evaluated right away, so that division by zero is not skipped
+                self.push(
+                    Value(self.temp(f"{DIVISION_OPS[opcode]}({a.expr}, {b.expr})"))
+                )
+            elif opcode in COMPARISON_OPS:
+                b = self.pop()
+                a = self.pop()
+                cond = f"{a.expr} {COMPARISON_OPS[opcode]} {b.expr}"
+                self.push(self.condition(cond, a, b))
+            elif opcode == Opcode.AND or opcode == Opcode.OR:
+                b = self.pop()
+                a = self.pop()
+                op = "and" if opcode == Opcode.AND else "or"
+                cond = f"({self.truthy(a)} {op} {self.truthy(b)})"
+                self.push(self.condition(cond, a, b))
+            elif opcode == Opcode.NOT:
+                a = self.pop()
+                self.push(self.condition(f"(not {self.truthy(a)})", a))
+            elif opcode == Opcode.NEG:
+                a = self.pop()
+                self.push(Value(f"(-{a.expr})", reads=a.reads, depth=nested(a)))
+            elif opcode == Opcode.NEW:
+                self.flush_reads()
+                sp = offset("sp", self.height())
+                size = self.simple(self.pop()).expr
+                result = f"t{next(self.temps)}"
+                self.emit(f"if np - {size} <= {sp}:")
+                self.emit(f"    {result} = 0")
+                self.emit("else:")
+                self.emit(f"    np -= {size}")
+                self.emit(f"    {result} = np")
+                self.push(Value(result))
+            elif opcode == Opcode.JUMP:
+                sp = self.write_back()
+                self.emit(f"return {operand}, {sp}, np")
+                break
+            elif opcode == Opcode.JUMPZ:
+                cond = self.truthy(self.pop())
+                sp = self.write_back()
+                self.emit(f"if not {cond}:")
+                self.emit(f"    return {operand}, {sp}, np")
+                self.emit(f"return {pc}, {sp}, np")
+                break
+            elif opcode == Opcode.JUMPI:
+                index = self.pop()
+                sp = self.write_back()
+                self.emit(f"return {operand} + {index.expr}, {sp}, np")
+                break
+            elif opcode == Opcode.HALT:
+                sp = self.write_back()
+                self.emit(f"return {n}, {sp}, np")
+                break
+            else:
+                raise AssertionError(f"Cannot translate {repr(opcode)}")
+        else:
+            # ran off the end of the program
+            sp = self.write_back()
+            self.emit(f"return {n}, {sp}, np")
+        return pc - self.start
+
+    def condition(self, cond: str, *operands: Value):
+        reads = any(operand.reads for operand in operands)
+        return Value(f"(1 if {cond} else 0)", cond, reads, nested(*operands))
+
+    @staticmethod
+    def truthy(value: Value):
+        if value.cond is not None:
+            return f"({value.cond})"
+        return f"({value.expr} != 0)"
+
+    def source(self, name: str):
+        body = "\n".join(f"    {line}" for line in self.lines)
+        return f"def {name}(s, sp, np):\n{body}\n"
+
+
+class JIT(VM):
+    def __init__(self, code: Iterable[Union[Instruction, str]], *args, **kwargs):
+        super().__init__(code, *args, **kwargs)
+        # address -> (function, number of instructions, values it pops from
+        # the stack it is entered with)
+        self.blocks = {}
+
+    def compile_block(self, start: int):
+        translator = BlockTranslator(self.opcodes, self.operands, start)
+        length = translator.translate()
+        name = f"block_{start}"
+        namespace = {"c_div": c_div, "c_mod": c_mod}
+        exec(compile(translator.source(name), f"<cma {name}>", "exec"), namespace)
+        return namespace[name], length, translator.needed
+
+    def run(
+        self, memory: Optional[Dict[int, int]] = None, max_steps: Optional[int] = None
+    ) -> Execution:
+        blocks = self.blocks
+        s = self.initial_memory(memory)
+        n = len(self.opcodes)
+        pc = 0
+        sp = bottom = self.globals_size - 1
+        np = self.memory_size
+        steps = 0
+
+        start = perf_counter()
+        try:
+            while pc < n:
+                block = blocks.get(pc)
+                if block is None:
+                    if pc < 0:
+                        raise VMError(f"Indexed jump to {pc}")
+                    block = blocks[pc] = self.compile_block(pc)
+                function, length, needed = block
+                if sp - bottom < needed:
+                    raise VMError(f"Stack underflow in block {pc}")
+                pc, sp, np = function(s, sp, np)
+                steps += length
+                if max_steps is not None and steps > max_steps:
+                    raise VMError(f"Exceeded {max_steps} steps")
+        except ZeroDivisionError:
+            raise VMError(f"Division by zero in block {pc}") from None
+        except IndexError:
+            raise VMError(f"Memory access out of bounds in block {pc}") from None
+        if pc > n:
+            raise VMError(f"Jump to {pc} outside of the code")
+        wall_time = perf_counter() - start
+
+        return Execution(s, sp, np, steps, wall_time)
+
+
+def run(
+    code: Iterable[Union[Instruction, str]],
+    environment: Dict[str, EnvEntry],
+    memory: Optional[Dict[int, int]] = None,
+    **kwargs,
+) -> Execution:
+    return JIT(code, globals_size(environment)).run(memory, **kwargs)
@@ -0,0 +1,140 @@
+import unittest
+
+from cma.backend import Array, Basic, EnvEntry, Pointer
+from cma.backend_test import basic_addr, generate_statement_code
+from cma.jit import JIT
+from cma.vm import VM, VMError, globals_size
+
+
+class TestSameResultAsVM(unittest.TestCase):
+    def assert_same_result(self, c_code, environment, memory=None):
+        code = generate_statement_code(c_code, environment)
+        size = globals_size(environment)
+        desired = VM(code, size, memory_size=1000).run(memory)
+        result = JIT(code, size, memory_size=1000).run(memory)
+        self.assertEqual(result.state(), desired.state())
+        self.assertEqual(result.instructions, desired.instructions)
+        return result
+
+    def test_power(self):
+        c_code = """
+        z = 1;
+        while (n > 0) {
+            j = 1;
+            y = x;
+            while (2 * j <= n) { y = y * y; j = j * 2; }
+            z = y * z;
+            n = n - j;
+        }
+        """
+        environment = {
+            "n": basic_addr(1),
+            "j": basic_addr(2),
+            "x": basic_addr(3),
+            "y": basic_addr(4),
+            "z": basic_addr(5),
+        }
+        result = self.assert_same_result(c_code, environment, {1: 13, 3: 3})
+        self.assertEqual(result.memory[5], 3**13)
+
+    def test_operators(self):
+        c_code = """
+        a = -x / 3 + x % 4 - !y;
+        b = (x < y) + (x <= y) * 2 + (x > y) * 4 + (x >= y) * 8;
+        c = (x == y) + (x != y) * 2 + (x && y) * 4 + (x || y) * 8 + (x ^ y) * 16;
+        """
+        environment = {
+            name: basic_addr(address)
+            for address, name in enumerate(["x", "y", "a", "b", "c"], 1)
+        }
+        for x, y in [(7, 0), (-7, 3), (0, 0), (5, 5)]:
+            with self.subTest(x=x, y=y):
+                self.assert_same_result(c_code, environment, {1: x, 2: y})
+
+    def test_chained_assignment(self):
+        c_code = "x = y = x + 1; a[x = 1] = y * x;"
+        environment = {
+            "x": basic_addr(1),
+            "y": basic_addr(2),
+            "a": EnvEntry(3, Array(Basic(), 2)),
+        }
+        self.assert_same_result(c_code, environment, {1: 4})
+
+    def test_switch(self):
+        c_code = """
+        for (i = 0; i < 4; i = i + 1)
+            switch (i) {
+                case 0: x = x + 1; break;
+                case 1: x = x * 10; break;
+                default: x = x - 1;
+            }
+        """
+        environment = {"i": basic_addr(1), "x": basic_addr(2)}
+        self.assert_same_result(c_code, environment)
+
+    def test_pointers(self):
+        c_code = """
+        for (i = 0; i < 3; i = i + 1) {
+            p = malloc(2);
+            *p = i;
+            a[i] = p;
+        }
+        s = *a[0] + *a[1] + *a[2];
+        """
+        environment = {
+            "i": basic_addr(1),
+            "s": basic_addr(2),
+            "p": EnvEntry(3, Pointer(Basic())),
+            "a": EnvEntry(4, Array(Pointer(Basic()), 3)),
+        }
+        result = self.assert_same_result(c_code, environment)
+        self.assertEqual(result.memory[2], 3)
+
+    def test_deep_expressions(self):
+        environment = {"x": basic_addr(0), "y": basic_addr(1)}
+        terms = " + ".join(["y"] * 300)
+        result = self.assert_same_result(f"x = {terms};", environment, {1: 2})
+        self.assertEqual(result.memory[0], 600)
+        conditions = " && ".join(["y < 3"] * 100)
+        self.assert_same_result(f"x = {conditions};", environment, {1: 2})
+        self.assert_same_result(f"x = {'-' * 150}y;", environment, {1: 2})
+
+
+class TestJIT(unittest.TestCase):
+    def test_blocks_are_reused(self):
+        code = ["loadc 1", "loadc 1", "add", "dup", "loadc 10", "le", "jumpz 8"]
+        code += ["jump 1", "loadc 0", "store"]
+        jit = JIT(code, 1)
+        jit.run()
+        first = dict(jit.blocks)
+        jit.run()
+        self.assertEqual(jit.blocks, first)
+
+    def test_division_by_zero(self):
+        with self.assertRaises(VMError):
+            JIT(["loadc 1", "loadc 0", "div", "pop"]).run()
+
+    def test_max_steps(self):
+        with self.assertRaises(VMError):
+            JIT(["jump 0"]).run(max_steps=100)
+
+    def test_store_to_stack(self):
+        # slot 1 is on the stack, like the temporaries of cma.invariants
+        code = ["loadc 0", "loadc 7", "loadc 1", "store", "pop", "loadc 1", "load"]
+        code += ["loadc 2", "mul", "loadc 0", "store", "pop", "pop"]
+        desired = VM(code, 1).run().state()
+        self.assertEqual(desired[0], [14])
+        self.assertEqual(JIT(code, 1).run().state(), desired)
+
+    def test_jump_outside_of_the_code(self):
+        with self.assertRaises(VMError):
+            JIT(["loadc 2", "jumpi 1"]).run()
+
+    def test_stack_underflow(self):
+        with self.assertRaises(VMError):
+            JIT(["pop", "loadc 1"], 1).run()
+        with self.assertRaises(VMError):
+            JIT(["loadc 1", "add"], 1).run()
+        # the values below the stored one were written back before
+        with self.assertRaises(VMError):
+            JIT(["loadc 1", "loadc 2", "loadc 0", "store", "add", "add"], 1).run()
@@ -0,0 +1,40 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Options:
+    """
+    Settings of the compiler pipeline. The defaults produce the code of the
+    lecture, optimizations have to be enabled.
+    """
+
+    # key of cma.pratt_frontend.FRONTENDS
+    frontend: str = "pyparsing"
+    # AST simplification, see cma.simplify
+    simplify: bool = False
+    # peephole optimization of the generated code, see cma.peephole
+    peephole: bool = False
+    # && and || in the conditions of if, while and for only evaluate their
+    # right operand if needed, as in C, rather than both as in the lecture
+    short_circuit: bool = False
+    # constant parts of the addresses of array and struct accesses are
+    # computed at compile time, e.g. s.a[3].b becomes a single loadc
+    fold_addresses: bool = False
+    # invariant expressions are computed once in front of loops, see
+    # cma.invariants
+    hoist_invariants: bool = False
+    # loadc a; load and loadc a; store become loada a and storea a, see
+    # cma.superinstructions
+    superinstructions: bool = False
+    # code which cannot run is removed, together with the code after
+    # conditions on constants if peephole is enabled, see cma.dead_code
+    remove_dead_code: bool = False
+    # while and for loops test their condition at the bottom after a test in
+    # front of them, see cma.backend.code_while. None rotates them if
+    # peephole is enabled, False keeps the loops of the lecture
+    rotate_loops: Optional[bool] = None
+
+    @property
+    def loops_rotated(self) -> bool:
+        return self.peephole if self.rotate_loops is None else self.rotate_loops
@@ -0,0 +1,230 @@
+"""
+Peephole optimizer for symbolic code, i.e. the output of code() before
+linking.
+
+Rules rewrite short windows of consecutive instructions. A rule has a pattern
+of opcodes (or sets of opcodes) and a rewrite function which receives the
+matched instructions and returns their replacement, or None if the rule does
+not apply after all. Since a rewrite can enable further rewrites, rules are
+matched against the end of the output after every instruction which is
+appended to it, including the ones of a replacement.
+
+Before the rules run, jumps to unconditional jumps are threaded to their
+final target. Jump tables keep all of their entries, windows never include
+one.
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple
+from typing import Optional, Sequence, Set, Tuple, Union
+
+from cma.instructions import (
+    BINARY_OPERATIONS,
+    UNARY_OPERATIONS,
+    Instruction,
+    Opcode,
+    loadc,
+)
+
+Pattern = Tuple[Union[Opcode, FrozenSet[Opcode]], ...]
+
+
+class Rule(NamedTuple):
+    name: str
+    pattern: Pattern
+    rewrite: Callable[..., Optional[List[Instruction]]]
+
+
+@dataclass
+class PeepholeStats:
+    before: int = 0
+    after: int = 0
+    # rule name -> number of rewrites
+    applied: Counter = field(default_factory=Counter)
+
+    @property
+    def removed(self):
+        return self.before - self.after
+
+
+POP = Instruction(Opcode.POP)
+
+# binary operations which cannot fail at runtime
+SAFE_BINARY_OPS = frozenset(BINARY_OPERATIONS) - {Opcode.DIV, Opcode.MOD}
+UNARY_OPS = frozenset(UNARY_OPERATIONS)
+
+
+def fold_binary(a: Instruction, b: Instruction, op: Instruction):
+    if op.opcode not in SAFE_BINARY_OPS and b.operand == 0:
+        # leave division by zero to the runtime
+        return None
+    return [loadc(BINARY_OPERATIONS[op.opcode](a.operand, b.operand))]
+
+
+def fold_unary(a: Instruction, op: Instruction):
+    return [loadc(UNARY_OPERATIONS[op.opcode](a.operand))]
+
+
+def neutral_operand(value: int):
+    def rewrite(a: Instruction, _op: Instruction):
+        return [] if a.operand == value else None
+
+    return rewrite
+
+
+def reuse_stored(address: Instruction, store, pop, reload: Instruction, load):
+    # store leaves the value on the stack, no need to load it again
+    return [address, store] if address.operand == reload.operand else None
+
+
+def constant_condition(a: Instruction, jumpz: Instruction):
+    return [] if a.operand != 0 else [Instruction(Opcode.JUMP, jumpz.operand)]
+
+
+def jump_to_next(jump: Instruction, label: Instruction):
+    return [label] if jump.operand is label.operand else None
+
+
+RULES = (
+    Rule("fold_binary", (Opcode.LOADC, Opcode.LOADC, frozenset(BINARY_OPERATIONS)), fold_binary),  # fmt: skip
+    Rule("fold_unary", (Opcode.LOADC, UNARY_OPS), fold_unary),
+    Rule("add_zero", (Opcode.LOADC, frozenset((Opcode.ADD, Opcode.SUB))), neutral_operand(0)),  # fmt: skip
+    Rule("mul_one", (Opcode.LOADC, frozenset((Opcode.MUL, Opcode.DIV))), neutral_operand(1)),  # fmt: skip
+    Rule("double_neg", (Opcode.NEG, Opcode.NEG), lambda *_: []),
+    Rule("pop_constant", (Opcode.LOADC, Opcode.POP), lambda *_: []),
+    Rule("pop_dup", (Opcode.DUP, Opcode.POP), lambda *_: []),
+    Rule("pop_load", (Opcode.LOAD, Opcode.POP), lambda *_: [POP]),
+    Rule("pop_unary", (UNARY_OPS, Opcode.POP), lambda *_: [POP]),
+    Rule("reuse_stored", (Opcode.LOADC, Opcode.STORE, Opcode.POP, Opcode.LOADC, Opcode.LOAD), reuse_stored),  # fmt: skip
+    Rule("jump_to_next", (Opcode.JUMP, Opcode.LABEL), jump_to_next),
+)
+
+# decide conditions on constants, e.g. of a switch on a constant, and leave
+# the code which cannot be reached anymore to cma.dead_code
+BRANCH_RULES = (
+    Rule("dup_constant", (Opcode.LOADC, Opcode.DUP), lambda a, _dup: [a, a]),
+    Rule("constant_condition", (Opcode.LOADC, Opcode.JUMPZ), constant_condition),
+)
+
+
+def thread_jumps(
+    symbolic_code: Sequence[Instruction], stats: Optional[PeepholeStats] = None
+):
+    """
+    Redirects jumps whose target is an unconditional jump to the target of
+    that jump. Indexed jumps are left alone, they address a jump table.
+    """
+    forward = {}
+    labels = []
+    for instruction in symbolic_code:
+        if instruction.opcode == Opcode.LABEL:
+            labels.append(instruction.operand)
+            continue
+        if instruction.opcode == Opcode.JUMP:
+            for label in labels:
+                forward[label] = instruction.operand
+        labels.clear()
+
+    def target(label):
+        seen = {label}
+        while label in forward and forward[label] not in seen:
+            label = forward[label]
+            seen.add(label)
+        return label
+
+    for instruction in symbolic_code:
+        if instruction.opcode in (Opcode.JUMP, Opcode.JUMPZ):
+            label = target(instruction.operand)
+            if label is not instruction.operand:
+                instruction = Instruction(instruction.opcode, label)
+                if stats is not None:
+                    stats.applied["thread_jumps"] += 1
+        yield instruction
+
+
+def table_entries(symbolic_code: Sequence[Instruction]) -> Set[int]:
+    """
+    The positions of the jumps in the jump tables, i.e. behind a label which
+    an indexed jump goes to. They may be threaded, but not removed, since
+    the entries behind them would move.
+    """
+    tables = {
+        instruction.operand
+        for instruction in symbolic_code
+        if instruction.opcode == Opcode.JUMPI
+    }
+    result = set()
+    in_table = False
+    for position, instruction in enumerate(symbolic_code):
+        if instruction.opcode == Opcode.LABEL:
+            in_table = in_table or instruction.operand in tables
+        elif instruction.opcode == Opcode.JUMP and in_table:
+            result.add(position)
+        else:
+            in_table = False
+    return result
+
+
+def index_rules(rules: Iterable[Rule]) -> Dict[Opcode, List[Tuple[Rule, tuple]]]:
+    # rules by the last opcode of their pattern, patterns normalized to sets
+    index = {}
+    for rule in rules:
+        pattern = tuple(
+            element if isinstance(element, frozenset) else frozenset((element,))
+            for element in rule.pattern
+        )
+        for opcode in pattern[-1]:
+            index.setdefault(opcode, []).append((rule, pattern))
+    return index
+
+
+def peephole(
+    symbolic_code: Iterable[Instruction],
+    rules: Iterable[Rule] = RULES,
+    stats: Optional[PeepholeStats] = None,
+) -> List[Instruction]:
+    symbolic_code = list(symbolic_code)
+    index = index_rules(rules)
+    entries = table_entries(symbolic_code)
+    out = []
+    pending = []
+    # windows start behind the last table entry, which must stay
+    fixed = 0
+
+    for position, instruction in enumerate(thread_jumps(symbolic_code, stats)):
+        if position in entries:
+            out.append(instruction)
+            fixed = len(out)
+            continue
+        pending.append(instruction)
+        while pending:
+            out.append(pending.pop())
+            for rule, pattern in index.get(out[-1].opcode, ()):
+                k = len(pattern)
+                if len(out) - fixed < k:
+                    continue
+                window = out[-k:]
+                if not all(
+                    matched.opcode in opcodes
+                    for matched, opcodes in zip(window, pattern)
+                ):
+                    continue
+                replacement = rule.rewrite(*window)
+                if replacement is None:
+                    continue
+                del out[-k:]
+                # the replacement is appended one by one and matched again
+                pending.extend(reversed(replacement))
+                if stats is not None:
+                    stats.applied[rule.name] += 1
+                break
+
+    if stats is not None:
+        stats.before += count_instructions(symbolic_code)
+        stats.after += count_instructions(out)
+    return out
+
+
+def count_instructions(symbolic_code: Iterable[Instruction]):
+    return sum(1 for instruction in symbolic_code if instruction.opcode != Opcode.LABEL)
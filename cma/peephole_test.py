@@ -0,0 +1,144 @@
+import unittest
+
+from cma.backend import (
+    Array,
+    Basic,
+    EnvEntry,
+    Struct,
+    SymbolicAddress,
+    code,
+    link,
+    render,
+)
+from cma.backend_test import basic_addr
+from cma.frontend import C
+from cma.instructions import Instruction, Opcode, parse
+from cma.peephole import RULES, PeepholeStats, Rule, peephole
+from cma.vm import run
+
+
+def optimize(lines, rules=RULES, stats=None):
+    return list(render(link(peephole(map(parse, lines), rules, stats))))
+
+
+def label(address):
+    return Instruction(Opcode.LABEL, address)
+
+
+class TestRules(unittest.TestCase):
+    def test_neutral_operands(self):
+        result = optimize(["loadc 1", "load", "loadc 1", "mul", "loadc 0", "add"])
+        self.assertEqual(result, ["loadc 1", "load"])
+
+    def test_constant_folding(self):
+        result = optimize(["loadc 3", "loadc 2", "loadc 1", "mul", "add", "neg"])
+        self.assertEqual(result, ["loadc -5"])
+
+    def test_division_by_zero_is_not_folded(self):
+        lines = ["loadc 1", "loadc 0", "div"]
+        self.assertEqual(optimize(lines), lines)
+
+    def test_discarded_values(self):
+        result = optimize(["loadc 4", "load", "neg", "pop", "loadc 1", "dup", "pop"])
+        self.assertEqual(result, ["loadc 1"])
+
+    def test_reuse_stored(self):
+        lines = ["loadc 7", "loadc 4", "store", "pop", "loadc 4", "load", "pop"]
+        self.assertEqual(optimize(lines), ["loadc 7", "loadc 4", "store", "pop"])
+        lines = ["loadc 7", "loadc 4", "store", "pop", "loadc 5", "load"]
+        self.assertEqual(optimize(lines), lines)
+
+    def test_windows_do_not_span_labels(self):
+        a = SymbolicAddress(0)
+        symbolic_code = [parse("loadc 1"), label(a), parse("pop")]
+        symbolic_code += [Instruction(Opcode.JUMP, a)]
+        result = list(render(link(peephole(symbolic_code))))
+        self.assertEqual(result, ["loadc 1", "pop", "jump 1"])
+
+    def test_custom_rules(self):
+        rules = [Rule("drop_neg", (Opcode.NEG,), lambda _neg: [])]
+        self.assertEqual(optimize(["loadc 1", "neg"], rules), ["loadc 1"])
+        self.assertEqual(optimize(["loadc 1", "neg"], []), ["loadc 1", "neg"])
+
+    def test_stats(self):
+        stats = PeepholeStats()
+        optimize(["loadc 1", "load", "loadc 1", "mul", "loadc 2", "pop"], stats=stats)
+        self.assertEqual((stats.before, stats.after, stats.removed), (6, 2, 4))
+        self.assertEqual(stats.applied, {"mul_one": 1, "pop_constant": 1})
+
+
+class TestJumps(unittest.TestCase):
+    def test_jump_to_next(self):
+        a = SymbolicAddress(0)
+        symbolic_code = [
+            parse("loadc 1"),
+            Instruction(Opcode.JUMP, a),
+            label(a),
+            parse("pop"),
+        ]
+        self.assertEqual(
+            list(render(link(peephole(symbolic_code)))), ["loadc 1", "pop"]
+        )
+
+    def test_thread_jumps(self):
+        a, b, c = SymbolicAddress(0), SymbolicAddress(1), SymbolicAddress(2)
+        symbolic_code = [label(a), parse("loadc 1"), Instruction(Opcode.JUMPZ, b)]
+        symbolic_code += [
+            Instruction(Opcode.JUMPI, b),
+            label(b),
+            Instruction(Opcode.JUMP, c),
+        ]
+        symbolic_code += [label(c), Instruction(Opcode.JUMP, a)]
+        result = list(render(link(peephole(symbolic_code))))
+        self.assertEqual(result, ["loadc 1", "jumpz 0", "jumpi 3", "jump 0", "jump 0"])
+
+
+class TestPrograms(unittest.TestCase):
+    def assert_same_result(self, c_code, environment, memory=None):
+        (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+        plain = list(link(code(node, environment)))
+        stats = PeepholeStats()
+        optimized = list(link(peephole(code(node, environment), stats=stats)))
+        desired = run(plain, environment, memory)
+        result = run(optimized, environment, memory)
+        self.assertEqual(result.state(), desired.state())
+        self.assertEqual(len(optimized), stats.after)
+        return stats, desired.instructions - result.instructions
+
+    def test_nested_control_flow(self):
+        c_code = "while (x > y) { if (2 * y > x) { y = y + x; } else { x = x - y; } }"
+        environment = {"x": basic_addr(2), "y": basic_addr(3)}
+        stats, saved = self.assert_same_result(c_code, environment, {2: 50, 3: 3})
+        self.assertEqual(stats.applied["thread_jumps"], 1)
+        self.assertGreater(saved, 0)
+
+    def test_arrays_structs_and_switch(self):
+        c_code = """
+        for (i = 0; i < 10; i = i + 1) a[i] = i * 2;
+        for (i = 0; i < 10; i = i + 1) {
+            s = s + a[i];
+            p.x = p.x + a[i];
+            switch (i) {
+                case 0: s = s + 1; break;
+                case 1: break;
+                default: s = s - 1;
+            }
+        }
+        """
+        environment = {
+            "i": basic_addr(1),
+            "s": basic_addr(2),
+            "a": EnvEntry(3, Array(Basic(), 10)),
+            "p": EnvEntry(13, Struct(("x", Basic()), ("y", Basic()))),
+        }
+        stats, saved = self.assert_same_result(c_code, environment)
+        self.assertGreater(stats.removed, 0)
+        self.assertGreater(saved, 0)
+
+    def test_empty_trailing_cases(self):
+        # the entries of the empty cases and the default jump behind the
+        # switch, right in front of its end, but the table must keep them
+        c_code = "switch (x) { case 0: y = 1; break; case 1: break; case 2: break; default: } z = 5; w = 7;"  # fmt: skip
+        environment = {name: basic_addr(i) for i, name in enumerate("xyzw")}
+        for x in range(-1, 5):
+            self.assert_same_result(c_code, environment, {0: x})
@@ -0,0 +1,496 @@
+"""
+Hand-written alternative to the pyparsing grammar in cma.frontend.
+
+A regex tokenizer feeds a recursive descent parser which uses precedence
+climbing for operations. The parser builds the same AST classes and mirrors
+the ordered-choice semantics of the pyparsing grammar, including the places
+where the grammar backtracks, so both frontends produce identical trees.
+
+``P`` exposes the same entry points as ``C`` (``P.Expression``,
+``P.Statement``, ``P.StatementSequence``), each with a pyparsing compatible
+``parseString`` that raises ``ParseException`` on malformed input.
+"""
+
+import re
+
+from pyparsing import ParseException, ParseResults
+
+from cma.frontend import (
+    AddressOf,
+    ArrayAccess,
+    Assignment,
+    BinaryOp,
+    C,
+    Case,
+    Cases,
+    Constant,
+    For,
+    FreeCall,
+    FuncCall,
+    FuncCallArguments,
+    Identifier,
+    IfElse,
+    MallocCall,
+    PlainStatement,
+    PointerDereference,
+    StatementSequence,
+    StructAccess,
+    StructPointerAccess,
+    Switch,
+    UnaryOp,
+    While,
+)
+
+KEYWORDS = frozenset(
+    ("for", "while", "switch", "case", "break", "default", "malloc", "free")
+)
+
+# characters which prevent a keyword from matching, see pyparsing.Keyword
+IDENT_CHARS = frozenset("0123456789_$")
+
+# https://en.cppreference.com/w/c/language/operator_precedence
+BINARY_OP_PRECEDENCE = {
+    "*": 7,
+    "/": 7,
+    "%": 7,
+    "+": 6,
+    "-": 6,
+    "<": 5,
+    "<=": 5,
+    ">": 5,
+    ">=": 5,
+    "==": 4,
+    "!=": 4,
+    "^": 3,
+    "&&": 2,
+    "||": 1,
+}
+
+UNARY_OPS = frozenset(("-", "!"))
+
+NUMBER, NAME, KEYWORD, PUNCTUATION, ERROR, END = range(6)
+
+# "&&" and "||" are not tokens on their own, pyparsing only matches them as
+# binary operators, whereas "&&x" in operand position is "&(&x)"
+TOKEN = re.compile(
+    r"[ \t\r\n]*(?:([0-9]+)|([A-Za-z]+)|(->|<=|>=|==|!=|[-+*/%<>=!^&|()\[\]{};:,.])|([^ \t\r\n]))",
+    re.DOTALL,
+)
+
+
+def tokenize(source: str):
+    kinds = []
+    texts = []
+    starts = []
+    ends = []
+    for match in TOKEN.finditer(source):
+        kind = match.lastindex
+        if kind is None:
+            # trailing whitespace
+            break
+        start, end = match.span(kind)
+        text = match.group(kind)
+        if kind == 2:
+            if text in KEYWORDS and source[end : end + 1] not in IDENT_CHARS:
+                kinds.append(KEYWORD)
+            else:
+                kinds.append(NAME)
+        else:
+            kinds.append((NUMBER, NAME, PUNCTUATION, ERROR)[kind - 1])
+        texts.append(text)
+        starts.append(start)
+        ends.append(end)
+    kinds.append(END)
+    texts.append("")
+    starts.append(len(source))
+    ends.append(len(source))
+    return kinds, texts, starts, ends
+
+
+class ParseFailure(Exception):
+    pass
+
+
+class Parser:
+    def __init__(self, source: str):
+        self.source = source
+        self.kinds, self.texts, self.starts, self.ends = tokenize(source)
+        self.pos = 0
+        self.furthest = 0
+        self.expected = None
+        # results of the bracketed "(*" and "(&" forms by position, avoids
+        # exponential backtracking for nested brackets
+        self.bracketed = {}
+
+    def fail(self, expected: str):
+        if self.pos >= self.furthest:
+            self.furthest = self.pos
+            self.expected = expected
+        raise ParseFailure()
+
+    def expect(self, text: str):
+        if self.texts[self.pos] != text:
+            self.fail(repr(text))
+        self.pos += 1
+
+    def expect_adjacent(self, first: str, second: str):
+        # pyparsing matches literals such as "break;" without skipping whitespace
+        pos = self.pos
+        if (
+            self.texts[pos] != first
+            or self.texts[pos + 1] != second
+            or self.ends[pos] != self.starts[pos + 1]
+        ):
+            self.fail(repr(first + second))
+        self.pos += 2
+
+    def at_adjacent(self, first: str, second: str):
+        pos = self.pos
+        return (
+            self.texts[pos] == first
+            and self.texts[pos + 1] == second
+            and self.ends[pos] == self.starts[pos + 1]
+        )
+
+    def expect_end(self):
+        if self.kinds[self.pos] != END:
+            self.fail("end of text")
+
+    def parse_exception(self):
+        loc = self.starts[self.furthest]
+        return ParseException(self.source, loc, f"Expected {self.expected}")
+
+    def identifier(self):
+        if self.kinds[self.pos] != NAME:
+            self.fail("identifier")
+        self.pos += 1
+        return Identifier(self.texts[self.pos - 1])
+
+    def constant(self):
+        if self.kinds[self.pos] != NUMBER:
+            self.fail("integer")
+        self.pos += 1
+        return Constant(int(self.texts[self.pos - 1]))
+
+    def expression(self):
+        kinds = self.kinds
+        texts = self.texts
+        pos = self.pos
+        if kinds[pos] == NAME and texts[pos + 1] == "(":
+            # cannot be an assignment, the left hand side would end before "("
+            return self.operation()
+        try:
+            left = self.left_hand_side()
+        except ParseFailure:
+            self.pos = pos
+            return self.operation()
+        if texts[self.pos] == "=":
+            after_left = self.pos
+            self.pos += 1
+            try:
+                return Assignment(left, self.expression())
+            except ParseFailure:
+                self.pos = after_left
+        # a left hand side which is not assigned to is the first operand
+        return self.climb(left, 1)
+
+    def operation(self):
+        return self.climb(self.unary(), 1)
+
+    def climb(self, left, min_precedence: int):
+        texts = self.texts
+        while True:
+            pos = self.pos
+            op = texts[pos]
+            if op == "&" or op == "|":
+                if not self.at_adjacent(op, op):
+                    return left
+                op += op
+                width = 2
+            else:
+                width = 1
+            precedence = BINARY_OP_PRECEDENCE.get(op)
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.pos = pos + width
+            try:
+                right = self.unary()
+                while True:
+                    next_op = texts[self.pos]
+                    if next_op == "&" or next_op == "|":
+                        next_op += next_op
+                    next_precedence = BINARY_OP_PRECEDENCE.get(next_op)
+                    if next_precedence is None or next_precedence <= precedence:
+                        break
+                    before = self.pos
+                    right = self.climb(right, precedence + 1)
+                    if self.pos == before:
+                        break
+            except ParseFailure:
+                # the operator is not followed by an operand
+                self.pos = pos
+                return left
+            left = BinaryOp(left, op, right)
+
+    def unary(self):
+        op = self.texts[self.pos]
+        if op in UNARY_OPS:
+            self.pos += 1
+            return UnaryOp(op, self.unary())
+        return self.primary()
+
+    def primary(self):
+        pos = self.pos
+        try:
+            return self.operand()
+        except ParseFailure:
+            self.pos = pos
+        self.expect("(")
+        result = self.operation()
+        self.expect(")")
+        return result
+
+    def operand(self):
+        kind = self.kinds[self.pos]
+        if kind == NUMBER:
+            return self.constant()
+        if kind == NAME and self.texts[self.pos + 1] == "(":
+            pos = self.pos
+            try:
+                return self.func_call()
+            except ParseFailure:
+                self.pos = pos
+        elif kind == KEYWORD and self.texts[self.pos] == "malloc":
+            return self.malloc_call()
+        return self.left_hand_side()
+
+    def func_call(self):
+        identifier = self.identifier()
+        self.expect("(")
+        arguments = [self.expression()]
+        while self.texts[self.pos] == ",":
+            pos = self.pos
+            self.pos += 1
+            try:
+                arguments.append(self.expression())
+            except ParseFailure:
+                self.pos = pos
+                break
+        self.expect(")")
+        return FuncCall(identifier, FuncCallArguments(*arguments))
+
+    def malloc_call(self):
+        self.pos += 1
+        self.expect("(")
+        expr = self.expression()
+        self.expect(")")
+        return MallocCall(expr)
+
+    def left_hand_side(self):
+        texts = self.texts
+        text = texts[self.pos]
+        if self.kinds[self.pos] == NAME:
+            self.pos += 1
+            node = Identifier(text)
+        elif text == "*":
+            self.pos += 1
+            node = PointerDereference(self.left_hand_side())
+        elif text == "&":
+            self.pos += 1
+            node = AddressOf(self.left_hand_side())
+        elif self.at_adjacent("(", "*") or self.at_adjacent("(", "&"):
+            node = self.bracketed_left_hand_side()
+        else:
+            self.fail("left hand side")
+
+        while True:
+            text = texts[self.pos]
+            if text == "[":
+                pos = self.pos
+                self.pos += 1
+                try:
+                    expr = self.expression()
+                    self.expect("]")
+                except ParseFailure:
+                    self.pos = pos
+                    return node
+                node = ArrayAccess(node, expr)
+            elif text == "->" or text == ".":
+                if self.kinds[self.pos + 1] != NAME:
+                    return node
+                field = Identifier(texts[self.pos + 1])
+                self.pos += 2
+                if text == "->":
+                    node = StructPointerAccess(node, field)
+                else:
+                    node = StructAccess(node, field)
+            else:
+                return node
+
+    def bracketed_left_hand_side(self):
+        pos = self.pos
+        if pos in self.bracketed:
+            node, self.pos = self.bracketed[pos]
+            if node is None:
+                self.fail("left hand side")
+            return node
+        cls = PointerDereference if self.texts[pos + 1] == "*" else AddressOf
+        self.pos += 2
+        try:
+            node = cls(self.left_hand_side())
+            self.expect(")")
+        except ParseFailure:
+            self.bracketed[pos] = (None, pos)
+            self.pos = pos
+            raise
+        self.bracketed[pos] = (node, self.pos)
+        return node
+
+    def statement(self):
+        pos = self.pos
+        try:
+            expr = self.expression()
+            self.expect(";")
+            return PlainStatement(expr)
+        except ParseFailure:
+            self.pos = pos
+        text = self.texts[pos]
+        if text == "if":
+            return self.if_else()
+        elif text == "while":
+            return self.while_loop()
+        elif text == "for":
+            return self.for_loop()
+        elif text == "switch":
+            return self.switch()
+        elif text == "free" and self.kinds[pos] == KEYWORD:
+            return self.free_call()
+        self.fail("statement")
+
+    def statement_sequence(self):
+        statements = []
+        while True:
+            pos = self.pos
+            try:
+                statements.append(self.statement())
+            except ParseFailure:
+                self.pos = pos
+                return StatementSequence(*statements)
+
+    def block_or_statement(self):
+        if self.texts[self.pos] != "{":
+            return self.statement()
+        self.pos += 1
+        statements = self.statement_sequence()
+        self.expect("}")
+        return statements
+
+    def condition(self):
+        self.expect("(")
+        expr = self.expression()
+        self.expect(")")
+        return expr
+
+    def if_else(self):
+        self.pos += 1
+        expr = self.condition()
+        then_branch = self.block_or_statement()
+        if self.texts[self.pos] == "else":
+            pos = self.pos
+            self.pos += 1
+            try:
+                return IfElse(expr, then_branch, self.block_or_statement())
+            except ParseFailure:
+                self.pos = pos
+        return IfElse(expr, then_branch)
+
+    def while_loop(self):
+        self.pos += 1
+        expr = self.condition()
+        return While(expr, self.block_or_statement())
+
+    def for_loop(self):
+        self.pos += 1
+        self.expect("(")
+        expr1 = self.expression()
+        self.expect(";")
+        expr2 = self.expression()
+        self.expect(";")
+        expr3 = self.expression()
+        self.expect(")")
+        return For(expr1, expr2, expr3, self.block_or_statement())
+
+    def switch(self):
+        self.pos += 1
+        expr = self.condition()
+        self.expect("{")
+        cases = []
+        while self.texts[self.pos] == "case":
+            pos = self.pos
+            try:
+                cases.append(self.case())
+            except ParseFailure:
+                self.pos = pos
+                break
+        self.expect_adjacent("default", ":")
+        default_case = self.statement_sequence()
+        self.expect("}")
+        return Switch(expr, Cases(*cases), default_case)
+
+    def case(self):
+        self.pos += 1
+        value = self.constant()
+        self.expect(":")
+        body = self.statement_sequence()
+        self.expect_adjacent("break", ";")
+        return Case(value, body)
+
+    def free_call(self):
+        self.pos += 1
+        self.expect("(")
+        expr = self.expression()
+        self.expect_adjacent(")", ";")
+        return FreeCall(expr)
+
+
+class Rule:
+    def __init__(self, parse):
+        self.parse = parse
+
+    def parseString(self, instring: str, parseAll: bool = False):
+        parser = Parser(instring)
+        try:
+            result = self.parse(parser)
+            if parseAll:
+                parser.expect_end()
+        except ParseFailure:
+            raise parser.parse_exception() from None
+        return ParseResults([result])
+
+
+def parse_statements(source: str):
+    """
+    Parses a statement sequence like ``P.StatementSequence`` with
+    ``parseAll=True``, but returns a list of the top-level statements, each
+    with the offsets in source where it starts and ends.
+    """
+    parser = Parser(source)
+    statements = []
+    try:
+        while parser.kinds[parser.pos] != END:
+            first = parser.pos
+            statement = parser.statement()
+            end = parser.ends[parser.pos - 1]
+            statements.append((statement, parser.starts[first], end))
+    except ParseFailure:
+        raise parser.parse_exception() from None
+    return statements
+
+
+class P:
+    Expression = Rule(Parser.expression)
+    Statement = Rule(Parser.statement)
+    StatementSequence = Rule(Parser.statement_sequence)
+
+
+FRONTENDS = {"pyparsing": C, "pratt": P}
@@ -0,0 +1,113 @@
+import unittest
+
+from pyparsing import ParseException
+
+from cma import frontend_test
+from cma.frontend import C
+from cma.pratt_frontend import P
+
+
+class TestPrattParserConstant(frontend_test.TestParserConstant):
+    grammar = P
+
+
+class TestPrattParserIdentifier(frontend_test.TestParserIdentifier):
+    grammar = P
+
+
+class TestPrattParserBinOp(frontend_test.TestParserBinOp):
+    grammar = P
+
+
+class TestPrattParserUnaryOp(frontend_test.TestParserUnaryOp):
+    grammar = P
+
+
+class TestPrattParserExpression(frontend_test.TestParserExpression):
+    grammar = P
+
+
+class TestPrattParserAssignment(frontend_test.TestParserAssignment):
+    grammar = P
+
+
+class TestPrattParserFuncCall(frontend_test.TestParserFuncCall):
+    grammar = P
+
+
+class TestPrattLeftHandSide(frontend_test.TestLeftHandSide):
+    grammar = P
+
+
+class TestPrattParserStatement(frontend_test.TestParserStatement):
+    grammar = P
+
+
+class TestSameTreeAsPyparsing(unittest.TestCase):
+    def assert_same_tree(self, rule, data):
+        try:
+            desired = getattr(C, rule).parseString(data, parseAll=True).asList()
+        except ParseException:
+            with self.assertRaises(ParseException):
+                getattr(P, rule).parseString(data, parseAll=True)
+        else:
+            result = getattr(P, rule).parseString(data, parseAll=True).asList()
+            self.assertEqual(result, desired)
+
+    def test_expressions(self):
+        for data in [
+            "a - b + c * d / e % f",
+            "-a * -b - !c",
+            "a < b <= c > d >= e == f != g ^ h && i || j",
+            "a || b && c ^ d != e < f + g * -h",
+            "(a + b) * (c - (d))",
+            "x = y = z + 1",
+            "a[b = 3] = c",
+            "f(a, b = 2, g(c))",
+            "(*a + b)",
+            "(*a)->b[1].c",
+            "(&a)[1]",
+            "&&a",
+            "(&&a.b)",
+            "**a",
+            "malloc(a) + 1",
+            "a & b",
+            "a | b",
+            "a + ",
+            "a == = b",
+            "(a = b)",
+            "!(x = y)",
+            "f()",
+            "for2",
+            "format",
+        ]:
+            with self.subTest(data=data):
+                self.assert_same_tree("Expression", data)
+
+    def test_statements(self):
+        for data in [
+            "if (x) -y;",
+            "if (x) *p = 3; else if (y) z = 1; else { z = 2; }",
+            "while (a) for (i = 0; i < 3; i = i + 1) { free(a); }",
+            "switch (x) { case 1: x = 1; break; case 0: break; default: }",
+            "switch (x) { case 1: break ; default: }",
+            "switch (x) { default : }",
+            "free(a) ;",
+            "x = 1; if (y) z = 2; else",
+        ]:
+            with self.subTest(data=data):
+                self.assert_same_tree("StatementSequence", data)
+
+    def test_exercises(self):
+        data = """
+        z = 1;
+        while (n > 0) {
+            j = 1;
+            y = x;
+            while (2 * j <= n) { y = y * y; j = j * 2; }
+            z = y * z;
+            n = n - j;
+        }
+        for (x=0; x < 42; x = x + z){ if(x = y){z = z + 1;}}
+        """
+        self.assert_same_tree("StatementSequence", data)
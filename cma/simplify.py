@@ -0,0 +1,278 @@
+"""
+Simplifies the AST before code generation: folds constant subexpressions,
+applies algebraic identities and drops branches whose condition is constant.
+
+Folding uses the same operations as the VM, so `/` and `%` truncate towards
+zero. Division by a constant zero is left alone to fail at runtime. Nodes
+which do not change are returned as they are.
+
+Like code generation in cma.backend, the AST is walked on an explicit stack
+instead of recursively, so that deeply nested programs do not exceed the
+recursion limit. The simplifying functions are generators which yield the
+simplification of a child, see walk, and receive the result.
+"""
+
+from dataclasses import replace
+from types import GeneratorType
+from typing import Any, Generator, List
+
+from cma.backend import BINARY_OP_TO_INSTR, UNARY_OP_TO_INSTR
+from cma.frontend import (
+    AddressOf,
+    ArrayAccess,
+    Assignment,
+    BinaryOp,
+    Case,
+    Cases,
+    Constant,
+    For,
+    FreeCall,
+    Identifier,
+    IfElse,
+    MallocCall,
+    PlainStatement,
+    PointerDereference,
+    StatementSequence,
+    StructAccess,
+    StructPointerAccess,
+    Switch,
+    UnaryOp,
+    While,
+)
+from cma.instructions import BINARY_OPERATIONS, UNARY_OPERATIONS
+
+
+def is_constant(node: Any, value: int = None):
+    return isinstance(node, Constant) and (value is None or node.value == value)
+
+
+def is_pure(node: Any):
+    """
+    Whether evaluating the expression has no effect besides its value, so
+    that it may be skipped.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (Constant, Identifier)):
+            continue
+        elif isinstance(node, BinaryOp):
+            if node.op in ("/", "%") and not (
+                is_constant(node.right) and node.right.value != 0
+            ):
+                # might divide by zero
+                return False
+            stack += (node.left, node.right)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.expr)
+        elif isinstance(node, ArrayAccess):
+            stack += (node.accessee, node.expr)
+        elif isinstance(node, StructAccess):
+            stack.append(node.accessee)
+        elif isinstance(node, (PointerDereference, StructPointerAccess)):
+            stack.append(node.pointer)
+        elif isinstance(node, AddressOf):
+            stack.append(node.value)
+        else:
+            # assignments, malloc and function calls
+            return False
+    return True
+
+
+def walk(step: Any):
+    """
+    Runs the generator which simplifies a node and returns the result. A
+    generator yields the simplification of a child, e.g.
+    expression(node.left), which is either another generator, run on the
+    stack before it is resumed, or the child itself if it cannot change.
+    """
+    if type(step) is not GeneratorType:
+        return step
+    # the generators waiting for the one which is running
+    stack: List[Generator] = []
+    # what step receives when it is resumed
+    value = None
+    while True:
+        try:
+            child = step.send(value)
+        except StopIteration as stop:
+            value = stop.value
+            if not stack:
+                return value
+            step = stack.pop()
+            continue
+        if type(child) is GeneratorType:
+            stack.append(step)
+            step, value = child, None
+        else:
+            value = child
+
+
+def simplify_binary_op(node: BinaryOp):
+    left = yield expression(node.left)
+    right = yield expression(node.right)
+    op = node.op
+
+    if is_constant(left) and is_constant(right):
+        if not (op in ("/", "%") and right.value == 0):
+            operation = BINARY_OPERATIONS[BINARY_OP_TO_INSTR[op].opcode]
+            return Constant(operation(left.value, right.value))
+    elif op == "+" and is_constant(left, 0):
+        return right
+    elif op in ("+", "-") and is_constant(right, 0):
+        return left
+    elif op == "*" and is_constant(left, 1):
+        return right
+    elif op in ("*", "/") and is_constant(right, 1):
+        return left
+    elif op == "*" and (
+        (is_constant(left, 0) and is_pure(right))
+        or (is_constant(right, 0) and is_pure(left))
+    ):
+        return Constant(0)
+
+    if left is node.left and right is node.right:
+        return node
+    return BinaryOp(left, op, right)
+
+
+def simplify_unary_op(node: UnaryOp):
+    expr = yield expression(node.expr)
+    if is_constant(expr):
+        operation = UNARY_OPERATIONS[UNARY_OP_TO_INSTR[node.op].opcode]
+        return Constant(operation(expr.value))
+    elif node.op == "-" and isinstance(expr, UnaryOp) and expr.op == "-":
+        return expr.expr
+    elif expr is node.expr:
+        return node
+    return UnaryOp(node.op, expr)
+
+
+def expression(node: Any):
+    # the generator which simplifies an expression, or the node itself
+    if isinstance(node, (Constant, Identifier)):
+        # the most common nodes, checked first
+        return node
+    elif isinstance(node, BinaryOp):
+        return simplify_binary_op(node)
+    elif isinstance(node, UnaryOp):
+        return simplify_unary_op(node)
+    elif isinstance(node, Assignment):
+        return rebuild(node, left=node.left, right=node.right)
+    elif isinstance(node, ArrayAccess):
+        return rebuild(node, accessee=node.accessee, expr=node.expr)
+    elif isinstance(node, StructAccess):
+        return rebuild(node, accessee=node.accessee)
+    elif isinstance(node, (PointerDereference, StructPointerAccess)):
+        return rebuild(node, pointer=node.pointer)
+    elif isinstance(node, AddressOf):
+        return rebuild(node, value=node.value)
+    elif isinstance(node, MallocCall):
+        return rebuild(node, expr=node.expr)
+    else:
+        return node
+
+
+def unchanged(new: tuple, old: tuple):
+    return all(a is b for a, b in zip(new, old))
+
+
+def rebuild(node: Any, **children):
+    # simplifies the given children, keeps node if none of them changes
+    simplified = {}
+    for name, child in children.items():
+        simplified[name] = yield expression(child)
+    if unchanged(simplified.values(), children.values()):
+        return node
+    return replace(node, **simplified)
+
+
+def simplify_statement_sequence(node: StatementSequence):
+    statements = []
+    for statement_node in node:
+        statements.append((yield statement(statement_node)))
+    if unchanged(statements, node):
+        return node
+    return StatementSequence(*statements)
+
+
+def simplify_if_else(node: IfElse):
+    expr = yield expression(node.expr)
+    then_branch = yield statement(node.then_branch)
+    else_branch = None
+    if node.else_branch is not None:
+        else_branch = yield statement(node.else_branch)
+    if is_constant(expr):
+        if expr.value != 0:
+            return then_branch
+        return StatementSequence() if else_branch is None else else_branch
+    new = (expr, then_branch, else_branch)
+    if unchanged(new, (node.expr, node.then_branch, node.else_branch)):
+        return node
+    return IfElse(*new)
+
+
+def simplify_while(node: While):
+    expr = yield expression(node.expr)
+    if is_constant(expr, 0):
+        return StatementSequence()
+    body = yield statement(node.body)
+    if unchanged((expr, body), (node.expr, node.body)):
+        return node
+    return While(expr, body)
+
+
+def simplify_for(node: For):
+    expr1 = yield expression(node.expr1)
+    expr2 = yield expression(node.expr2)
+    if is_constant(expr2, 0):
+        # the loop is never entered, but expr1 is still evaluated
+        return PlainStatement(expr1)
+    expr3 = yield expression(node.expr3)
+    body = yield statement(node.body)
+    new = (expr1, expr2, expr3, body)
+    if unchanged(new, (node.expr1, node.expr2, node.expr3, node.body)):
+        return node
+    return For(*new)
+
+
+def simplify_switch(node: Switch):
+    expr = yield expression(node.expr)
+    bodies = []
+    for case in node.cases:
+        bodies.append((yield statement(case.body)))
+    default_case = yield statement(node.default_case)
+    old = (node.expr, *(case.body for case in node.cases), node.default_case)
+    if unchanged((expr, *bodies, default_case), old):
+        return node
+    cases = Cases(*(Case(case.value, body) for case, body in zip(node.cases, bodies)))
+    return Switch(expr, cases, default_case)
+
+
+def statement(node: Any):
+    # the generator which simplifies a statement, expressions as a fallback
+    if isinstance(node, StatementSequence):
+        return simplify_statement_sequence(node)
+    elif isinstance(node, (PlainStatement, FreeCall)):
+        return rebuild(node, expr=node.expr)
+    elif isinstance(node, IfElse):
+        return simplify_if_else(node)
+    elif isinstance(node, While):
+        return simplify_while(node)
+    elif isinstance(node, For):
+        return simplify_for(node)
+    elif isinstance(node, Switch):
+        return simplify_switch(node)
+    else:
+        return expression(node)
+
+
+def simplify_expression(node: Any):
+    return walk(expression(node))
+
+
+def simplify(node: Any):
+    """
+    Simplifies a statement (sequence) or, as a fallback, an expression.
+    """
+    return walk(statement(node))
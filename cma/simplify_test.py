@@ -0,0 +1,121 @@
+import unittest
+
+from cma.backend import code, link
+from cma.backend_test import basic_addr
+from cma.frontend import (
+    Assignment,
+    BinaryOp,
+    C,
+    Constant,
+    Identifier,
+    PlainStatement,
+    StatementSequence,
+)
+from cma.simplify import simplify
+from cma.vm import run
+
+
+def simplify_expression(c_code):
+    (node,) = C.Expression.parseString(c_code, parseAll=True)
+    return simplify(node)
+
+
+def simplify_statements(c_code):
+    (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+    return simplify(node)
+
+
+class TestExpressions(unittest.TestCase):
+    def test_constant_folding(self):
+        self.assertEqual(simplify_expression("1 + 2 * 3 - (4 < 5)"), Constant(6))
+        self.assertEqual(simplify_expression("!(3 == 3) || 2 && 7"), Constant(1))
+
+    def test_integer_division(self):
+        self.assertEqual(simplify_expression("-7 / 2"), Constant(-3))
+        self.assertEqual(simplify_expression("7 % -2"), Constant(1))
+        self.assertEqual(simplify_expression("-7 % 2"), Constant(-1))
+
+    def test_division_by_zero_is_kept(self):
+        self.assertEqual(
+            simplify_expression("x / (1 - 1)"),
+            BinaryOp(Identifier("x"), "/", Constant(0)),
+        )
+
+    def test_identities(self):
+        for c_code in ["x + 0", "0 + x", "x - 0", "1 * x", "x * 1", "x / 1", "- -x"]:
+            with self.subTest(c_code=c_code):
+                self.assertEqual(simplify_expression(c_code), Identifier("x"))
+
+    def test_partial_folding(self):
+        self.assertEqual(
+            simplify_expression("2 * (c + (b - (1 + 2)))"),
+            simplify_expression("2 * (c + (b - 3))"),
+        )
+        self.assertEqual(
+            simplify_expression("y = x * (3 - 2) + (0 * 5)"),
+            Assignment(Identifier("y"), Identifier("x")),
+        )
+
+    def test_multiplication_by_zero(self):
+        self.assertEqual(simplify_expression("a[x - 1] * 0"), Constant(0))
+        self.assertEqual(simplify_expression("0 * *p"), Constant(0))
+        # side effects and possible division by zero are kept
+        for c_code in ["0 * malloc(2)", "(x / y) * 0"]:
+            with self.subTest(c_code=c_code):
+                self.assertIsInstance(simplify_expression(c_code), BinaryOp)
+        node = BinaryOp(Assignment(Identifier("x"), Constant(1)), "*", Constant(0))
+        self.assertIs(simplify(node), node)
+
+    def test_unchanged_nodes_are_kept(self):
+        (node,) = C.StatementSequence.parseString(
+            "x = a[i + 1]; while (x) { if (y) x = x - 1; }", parseAll=True
+        )
+        self.assertIs(simplify(node), node)
+
+
+class TestStatements(unittest.TestCase):
+    def test_if_else(self):
+        x_is = lambda value: PlainStatement(
+            Assignment(Identifier("x"), Constant(value))
+        )
+        self.assertEqual(
+            simplify_statements("if (2 > 1) x = 1; else x = 2;"),
+            StatementSequence(x_is(1)),
+        )
+        self.assertEqual(
+            simplify_statements("if (2 < 1) x = 1; else { x = 2; }"),
+            StatementSequence(StatementSequence(x_is(2))),
+        )
+        self.assertEqual(
+            simplify_statements("if (0) x = 1;"),
+            StatementSequence(StatementSequence()),
+        )
+
+    def test_loops(self):
+        self.assertEqual(
+            simplify_statements("while (1 - 1) x = 1;"),
+            StatementSequence(StatementSequence()),
+        )
+        self.assertEqual(
+            simplify_statements("for (i = 0; 0; i = i + 1) x = 1;"),
+            StatementSequence(PlainStatement(Assignment(Identifier("i"), Constant(0)))),
+        )
+
+    def test_same_result(self):
+        c_code = """
+        for (i = 0 * 7; i < 2 + 3; i = i + 1 * 1) {
+            if (1 == 2) x = 100;
+            else x = x + i * (4 / 2) - 0;
+            while (0) x = 0;
+            y = -(-(x % (2 + 1))) + 10 / -3;
+        }
+        """
+        environment = {"i": basic_addr(1), "x": basic_addr(2), "y": basic_addr(3)}
+        (node,) = C.StatementSequence.parseString(c_code, parseAll=True)
+        plain = list(link(code(node, environment)))
+        simplified = list(link(code(simplify(node), environment)))
+        desired = run(plain, environment)
+        result = run(simplified, environment)
+        self.assertEqual(result.state(), desired.state())
+        self.assertLess(len(simplified), len(plain))
+        self.assertLess(result.instructions, desired.instructions)
@@ -0,0 +1,150 @@
+"""
+Static analysis of the operand stack of linked code.
+
+Every reachable instruction gets the depth of the operand stack in front of
+it, counted in values above the globals, by following the flow of control
+from the first instruction. Indexed jumps are followed into their jump table
+if their index is bounded the way the backend bounds it for switch
+statements, see cma.backend.check:
+
+    dup; loadc start; geq; jumpz A; dup; loadc end; le; jumpz A; jumpi B
+    A: pop; loadc end; jumpi B
+
+Every instruction is visited once and every edge is checked once, so the
+analysis takes linear time in the size of the code and its jump tables.
+Code from the backend always arrives at an instruction with the same depth.
+Where it does not, or where the stack would underflow, or an indexed jump
+cannot be bounded, the analysis records a problem and goes on.
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple, Union
+
+from cma.instructions import Instruction, Opcode, decode
+
+# change of the depth by each opcode
+EFFECT = {opcode: -1 for opcode in Opcode}
+EFFECT.update(
+    {
+        Opcode.LOADC: 1,
+        Opcode.LOADA: 1,
+        Opcode.DUP: 1,
+        Opcode.STOREA: 0,
+        Opcode.LOAD: 0,
+        Opcode.NEW: 0,
+        Opcode.NEG: 0,
+        Opcode.NOT: 0,
+        Opcode.JUMP: 0,
+        Opcode.HALT: 0,
+    }
+)
+# values an opcode reads from the stack
+OPERANDS = {opcode: 2 for opcode in Opcode}
+OPERANDS.update(
+    {
+        Opcode.LOADC: 0,
+        Opcode.LOADA: 0,
+        Opcode.JUMP: 0,
+        Opcode.HALT: 0,
+        Opcode.LOAD: 1,
+        Opcode.STOREA: 1,
+        Opcode.POP: 1,
+        Opcode.DUP: 1,
+        Opcode.JUMPZ: 1,
+        Opcode.JUMPI: 1,
+        Opcode.NEW: 1,
+        Opcode.NEG: 1,
+        Opcode.NOT: 1,
+    }
+)
+
+BOUNDS_CHECK = (
+    Opcode.DUP,
+    Opcode.LOADC,
+    Opcode.GEQ,
+    Opcode.JUMPZ,
+    Opcode.DUP,
+    Opcode.LOADC,
+    Opcode.LE,
+    Opcode.JUMPZ,
+)
+
+
+@dataclass(frozen=True)
+class StackDepth:
+    # depth in front of every instruction, None where control never arrives
+    depths: List[Optional[int]]
+    # the deepest the stack gets, including the values pushed by the last
+    # instruction
+    maximum: int
+    # (address, message), sorted by address
+    problems: List[Tuple[int, str]]
+
+    @property
+    def consistent(self):
+        return not self.problems
+
+
+def jump_table(opcodes, operands, pc: int) -> Optional[range]:
+    """
+    The addresses which the indexed jump at pc can go to, or None if its
+    index is not bounded.
+    """
+    base = operands[pc]
+    if pc >= 1 and opcodes[pc - 1] == Opcode.LOADC:
+        return range(base + operands[pc - 1], base + operands[pc - 1] + 1)
+    start = pc - len(BOUNDS_CHECK)
+    if start >= 0 and tuple(opcodes[start:pc]) == BOUNDS_CHECK:
+        return range(base + operands[start + 1], base + operands[start + 5])
+    return None
+
+
+def stack_depth(code: Iterable[Union[Instruction, str]]) -> StackDepth:
+    opcodes, operands = decode(code)
+    n = len(opcodes)
+    # a jump to n ends the program like running off its end
+    depths: List[Optional[int]] = [None] * (n + 1)
+    problems = []
+    maximum = 0
+    pending = [0]
+    depths[0] = 0
+
+    def arrive(source: int, target: int, depth: int):
+        if not 0 <= target <= n:
+            problems.append((source, f"Jump to {target} outside of the code"))
+        elif depths[target] is None:
+            depths[target] = depth
+            pending.append(target)
+        elif depths[target] != depth:
+            problems.append(
+                (target, f"Depth {depth} from {source}, but {depths[target]} before")
+            )
+
+    while pending:
+        pc = pending.pop()
+        if pc == n:
+            continue
+        opcode = opcodes[pc]
+        depth = depths[pc]
+        if depth < OPERANDS[opcode]:
+            problems.append((pc, f"Stack underflow at depth {depth}"))
+            continue
+        after = depth + EFFECT[opcode]
+        maximum = max(maximum, after)
+        if opcode == Opcode.JUMP:
+            arrive(pc, operands[pc], after)
+        elif opcode == Opcode.JUMPZ:
+            arrive(pc, operands[pc], after)
+            arrive(pc, pc + 1, after)
+        elif opcode == Opcode.JUMPI:
+            targets = jump_table(opcodes, operands, pc)
+            if targets is None:
+                problems.append((pc, "Indexed jump with unbounded index"))
+            else:
+                for target in targets:
+                    arrive(pc, target, after)
+        elif opcode != Opcode.HALT:
+            arrive(pc, pc + 1, after)
+
+    problems.sort()
+    return StackDepth(depths[:n], maximum, problems)
@@ -0,0 +1,87 @@
+import unittest
+
+from cma.backend_test import basic_addr
+from cma.compiler import compile_statements
+from cma.instructions import Opcode
+from cma.options import Options
+from cma.stack_depth import stack_depth
+
+ENVIRONMENT = {name: basic_addr(i) for i, name in enumerate("xyz")}
+
+
+class TestStackDepth(unittest.TestCase):
+    def test_expression(self):
+        code = compile_statements("x = (x + 1) * (y + (z - 2));", ENVIRONMENT)
+        result = stack_depth(code)
+        self.assertEqual(result.problems, [])
+        self.assertEqual(result.maximum, 4)
+        self.assertEqual(result.depths[0], 0)
+        self.assertEqual(result.depths[-1], 1)
+
+    def test_loops(self):
+        source = "while (x) { x = x - 1; for (y = 0; y < x; y = y + 1) z = z + y; }"
+        result = stack_depth(compile_statements(source, ENVIRONMENT))
+        self.assertTrue(result.consistent)
+        self.assertNotIn(None, result.depths)
+        self.assertEqual(result.maximum, 2)
+
+    def test_jump_tables(self):
+        for values in ["0 1 2 3", "4 5 6 7", "1 50 100 1000"]:
+            cases = " ".join(f"case {v}: y = {v}; break;" for v in values.split())
+            source = f"switch (x) {{ {cases} default: y = 0; }}"
+            code = compile_statements(source, ENVIRONMENT)
+            result = stack_depth(code)
+            self.assertEqual(result.problems, [], values)
+            # the tables are reached
+            for instruction in code:
+                if instruction.opcode == Opcode.JUMPI:
+                    self.assertEqual(result.depths[instruction.operand], 0, values)
+
+    def test_options(self):
+        source = """
+        while (x > 0 && y != 3) {
+            switch (x % 4) {
+                case 0: y = y + 1; break;
+                case 2: if (!(y || z)) z = 1; else z = z * 2; break;
+                default: x = x - 1;
+            }
+            for (z = 0; z < 3 || y < 2; z = z + 1) y = y + z;
+            x = x - 1;
+        }
+        """
+        for options in [
+            Options(),
+            Options(simplify=True, peephole=True),
+            Options(short_circuit=True),
+        ]:
+            code = compile_statements(source, ENVIRONMENT, options)
+            result = stack_depth(code)
+            self.assertEqual(result.problems, [], options)
+            self.assertEqual(len(result.depths), len(code))
+            self.assertEqual(result.depths[0], 0)
+
+    def test_inconsistent_join(self):
+        result = stack_depth(["loadc 1", "jumpz 4", "loadc 2", "loadc 3", "halt"])
+        self.assertEqual(result.problems, [(4, "Depth 2 from 3, but 0 before")])
+        self.assertFalse(result.consistent)
+        self.assertEqual(result.maximum, 2)
+
+    def test_underflow(self):
+        result = stack_depth(["loadc 1", "add"])
+        self.assertEqual(result.problems, [(1, "Stack underflow at depth 1")])
+
+    def test_unbounded_indexed_jump(self):
+        result = stack_depth(["loadc 0", "load", "jumpi 3", "halt"])
+        self.assertEqual(result.problems, [(2, "Indexed jump with unbounded index")])
+        self.assertEqual(result.depths, [0, 1, 1, None])
+
+    def test_jump_outside(self):
+        result = stack_depth(["jump 7"])
+        self.assertEqual(result.problems, [(0, "Jump to 7 outside of the code")])
+
+    def test_long_code(self):
+        n = 100000
+        lines = ["loadc 1"] * n + ["pop"] * n
+        result = stack_depth(lines)
+        self.assertEqual(result.maximum, n)
+        self.assertEqual(result.depths[-1], 1)
@@ -0,0 +1,31 @@
+"""
+Selection of the combined instructions of the CMa for symbolic code, i.e.
+the output of code() or peephole() before linking.
+
+The address of a global is a constant, so the backend reads and writes
+globals with
+
+    loadc a; load       ->  loada a
+    loadc a; store      ->  storea a
+
+which the VM then executes as a single instruction. Only consecutive
+instructions are combined. A label in between keeps them apart, so no jump
+can arrive in the middle of a combined instruction.
+"""
+
+from typing import Iterable, List
+
+from cma.instructions import Instruction, Opcode
+
+COMBINED = {Opcode.LOAD: Opcode.LOADA, Opcode.STORE: Opcode.STOREA}
+
+
+def select(symbolic_code: Iterable[Instruction]) -> List[Instruction]:
+    out = []
+    for instruction in symbolic_code:
+        combined = COMBINED.get(instruction.opcode)
+        if combined is not None and out and out[-1].opcode == Opcode.LOADC:
+            out[-1] = Instruction(combined, out[-1].operand)
+        else:
+            out.append(instruction)
+    return out
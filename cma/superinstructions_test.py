@@ -0,0 +1,76 @@
+import unittest
+
+from cma.backend import SymbolicAddress, link, render
+from cma.backend_test import basic_addr
+from cma.compiler import compile_statements
+from cma.instructions import Instruction, Opcode, parse
+from cma.jit import JIT
+from cma.options import Options
+from cma.stack_depth import stack_depth
+from cma.superinstructions import select
+from cma.vm import VM, globals_size
+
+# e3 of exercises_book.py: z = x ** n
+E3 = """
+z = 1;
+while (n > 0) {
+    j = 1; y = x;
+    while (2 * j <= n) { y = y * y; j = j * 2; }
+    z = y * z; n = n - j;
+}
+"""
+E3_ENVIRONMENT = {name: basic_addr(i + 1) for i, name in enumerate("njxyz")}
+
+
+def selected(lines):
+    return list(render(link(select(map(parse, lines)))))
+
+
+class TestSelect(unittest.TestCase):
+    def test_globals(self):
+        lines = ["loadc 1", "load", "loadc 2", "store", "pop", "loadc 3"]
+        self.assertEqual(selected(lines), ["loada 1", "storea 2", "pop", "loadc 3"])
+
+    def test_computed_addresses(self):
+        lines = ["loadc 1", "loadc 2", "add", "load", "loadc 4", "load", "load"]
+        self.assertEqual(
+            selected(lines), ["loadc 1", "loadc 2", "add", "load", "loada 4", "load"]
+        )
+
+    def test_label_in_between(self):
+        a = SymbolicAddress(0)
+        symbolic_code = [
+            parse("loadc 1"),
+            Instruction(Opcode.LABEL, a),
+            parse("load"),
+            Instruction(Opcode.JUMP, a),
+        ]
+        self.assertEqual(
+            list(render(link(select(symbolic_code)))), ["loadc 1", "load", "jump 1"]
+        )
+
+
+class TestExecution(unittest.TestCase):
+    def execute(self, options, executor=VM):
+        code = compile_statements(E3, E3_ENVIRONMENT, options)
+        self.assertEqual(stack_depth(code).problems, [])
+        vm = executor(code, globals_size(E3_ENVIRONMENT))
+        return vm.run({1: 10, 3: 3})
+
+    def test_e3(self):
+        plain = self.execute(Options())
+        for executor in [VM, JIT]:
+            for options in [
+                Options(superinstructions=True),
+                Options(simplify=True, peephole=True, superinstructions=True),
+            ]:
+                execution = self.execute(options, executor)
+                self.assertEqual(execution.memory[5], 3**10)
+                self.assertEqual(execution.state(), plain.state())
+        combined = self.execute(Options(superinstructions=True))
+        # every access of a variable saves one instruction
+        self.assertLess(combined.instructions, 0.75 * plain.instructions)
+
+    def test_default_is_lecture_code(self):
+        code = compile_statements(E3, E3_ENVIRONMENT)
+        self.assertNotIn(Opcode.LOADA, [instruction.opcode for instruction in code])
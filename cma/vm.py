@@ -0,0 +1,220 @@
+"""
+Interpreter for the CMa instructions emitted by the backend.
+
+The linked code, or its textual form, is decoded once into opcode and operand
+arrays, which are then executed by a single dispatch loop on a preallocated
+memory. The memory layout follows the lecture: the globals occupy the lowest
+addresses, the stack grows upwards right above them and the heap grows
+downwards from the top. Accesses outside of the memory, jumps outside of
+the code and popping more values than were pushed raise a VMError, a jump
+right behind the last instruction ends the program.
+"""
+
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Union
+
+from cma.backend import EnvEntry, sizeof
+from cma.instructions import Instruction, Opcode, c_div, c_mod, decode
+from cma.stack_depth import OPERANDS
+
+DEFAULT_MEMORY_SIZE = 1 << 16
+
+
+class VMError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Execution:
+    memory: List[int]
+    sp: int
+    np: int
+    instructions: int
+    wall_time: float
+
+    def state(self):
+        """
+        The observable memory: globals and the live part of the stack, and
+        the heap. Dead stack slots above SP are left out.
+        """
+        return self.memory[: self.sp + 1], self.memory[self.np :]
+
+
+def globals_size(environment: Dict[str, EnvEntry]):
+    return max(
+        (entry.address + sizeof(entry.datatype) for entry in environment.values()),
+        default=0,
+    )
+
+
+class VM:
+    def __init__(
+        self,
+        code: Iterable[Union[Instruction, str]],
+        globals_size: int = 0,
+        memory_size: int = DEFAULT_MEMORY_SIZE,
+    ):
+        self.opcodes, self.operands = decode(code)
+        self.globals_size = globals_size
+        self.memory_size = memory_size
+        # the targets of the other jumps are only known at runtime
+        n = len(self.opcodes)
+        for pc, opcode in enumerate(self.opcodes):
+            if opcode in (Opcode.JUMP, Opcode.JUMPZ):
+                if not 0 <= self.operands[pc] <= n:
+                    target = self.operands[pc]
+                    raise VMError(f"Jump to {target} outside of the code at {pc}")
+
+    def initial_memory(self, memory: Optional[Dict[int, int]]):
+        s = [0] * self.memory_size
+        if memory:
+            for address, value in memory.items():
+                s[address] = value
+        return s
+
+    def run(
+        self, memory: Optional[Dict[int, int]] = None, max_steps: Optional[int] = None
+    ) -> Execution:
+        # local names are cheaper to look up in the dispatch loop
+        LOADC, LOAD, STORE, POP = Opcode.LOADC, Opcode.LOAD, Opcode.STORE, Opcode.POP
+        DUP, JUMP, JUMPZ, JUMPI = Opcode.DUP, Opcode.JUMP, Opcode.JUMPZ, Opcode.JUMPI
+        NEW, ADD, SUB, MUL = Opcode.NEW, Opcode.ADD, Opcode.SUB, Opcode.MUL
+        DIV, MOD, LE, LEQ, GR = Opcode.DIV, Opcode.MOD, Opcode.LE, Opcode.LEQ, Opcode.GR
+        GEQ, EQ, NEQ, XOR = Opcode.GEQ, Opcode.EQ, Opcode.NEQ, Opcode.XOR
+        AND, OR, NEG, NOT = Opcode.AND, Opcode.OR, Opcode.NEG, Opcode.NOT
+        LOADA, STOREA = Opcode.LOADA, Opcode.STOREA
+
+        opcodes = list(self.opcodes)
+        operands = self.operands
+        # values each instruction takes from the stack
+        reads = [OPERANDS[opcode] for opcode in opcodes]
+        s = self.initial_memory(memory)
+        n = len(opcodes)
+        pc = 0
+        sp = bottom = self.globals_size - 1
+        np = self.memory_size
+        # counts down, never reaches zero without a limit
+        budget = -1 if max_steps is None else max_steps + 1
+
+        start = perf_counter()
+        try:
+            while pc < n:
+                budget -= 1
+                if not budget:
+                    raise VMError(f"Exceeded {max_steps} steps")
+                if sp - bottom < reads[pc]:
+                    raise VMError(f"Stack underflow at {pc}")
+                op = opcodes[pc]
+                pc += 1
+                if op == LOADC:
+                    sp += 1
+                    s[sp] = operands[pc - 1]
+                elif op == LOAD:
+                    if s[sp] < 0:
+                        raise VMError(f"Memory access out of bounds at {pc - 1}")
+                    s[sp] = s[s[sp]]
+                elif op == STORE:
+                    if s[sp] < 0:
+                        raise VMError(f"Memory access out of bounds at {pc - 1}")
+                    s[s[sp]] = s[sp - 1]
+                    sp -= 1
+                elif op == LOADA:
+                    if operands[pc - 1] < 0:
+                        raise VMError(f"Memory access out of bounds at {pc - 1}")
+                    sp += 1
+                    s[sp] = s[operands[pc - 1]]
+                elif op == STOREA:
+                    if operands[pc - 1] < 0:
+                        raise VMError(f"Memory access out of bounds at {pc - 1}")
+                    s[operands[pc - 1]] = s[sp]
+                elif op == POP:
+                    sp -= 1
+                elif op == JUMPZ:
+                    if s[sp] == 0:
+                        pc = operands[pc - 1]
+                    sp -= 1
+                elif op == JUMP:
+                    pc = operands[pc - 1]
+                elif op == ADD:
+                    sp -= 1
+                    s[sp] = s[sp] + s[sp + 1]
+                elif op == SUB:
+                    sp -= 1
+                    s[sp] = s[sp] - s[sp + 1]
+                elif op == MUL:
+                    sp -= 1
+                    s[sp] = s[sp] * s[sp + 1]
+                elif op == LE:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] < s[sp + 1] else 0
+                elif op == LEQ:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] <= s[sp + 1] else 0
+                elif op == GR:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] > s[sp + 1] else 0
+                elif op == GEQ:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] >= s[sp + 1] else 0
+                elif op == EQ:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] == s[sp + 1] else 0
+                elif op == NEQ:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] != s[sp + 1] else 0
+                elif op == DUP:
+                    s[sp + 1] = s[sp]
+                    sp += 1
+                elif op == JUMPI:
+                    pc = operands[pc - 1] + s[sp]
+                    sp -= 1
+                    if pc < 0:
+                        raise VMError(f"Indexed jump to {pc}")
+                elif op == DIV:
+                    sp -= 1
+                    s[sp] = c_div(s[sp], s[sp + 1])
+                elif op == MOD:
+                    sp -= 1
+                    s[sp] = c_mod(s[sp], s[sp + 1])
+                elif op == AND:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] != 0 and s[sp + 1] != 0 else 0
+                elif op == OR:
+                    sp -= 1
+                    s[sp] = 1 if s[sp] != 0 or s[sp + 1] != 0 else 0
+                elif op == XOR:
+                    sp -= 1
+                    s[sp] = s[sp] ^ s[sp + 1]
+                elif op == NEG:
+                    s[sp] = -s[sp]
+                elif op == NOT:
+                    s[sp] = 1 if s[sp] == 0 else 0
+                elif op == NEW:
+                    if np - s[sp] <= sp:
+                        s[sp] = 0
+                    else:
+                        np -= s[sp]
+                        s[sp] = np
+                else:
+                    break
+        except ZeroDivisionError:
+            raise VMError(f"Division by zero at {pc - 1}") from None
+        except IndexError:
+            raise VMError(f"Memory access out of bounds at {pc - 1}") from None
+        if pc > n:
+            # checked once here rather than for every jump
+            raise VMError(f"Jump to {pc} outside of the code")
+        wall_time = perf_counter() - start
+
+        executed = -1 - budget if max_steps is None else max_steps + 1 - budget
+        return Execution(s, sp, np, executed, wall_time)
+
+
+def run(
+    code: Iterable[Union[Instruction, str]],
+    environment: Dict[str, EnvEntry],
+    memory: Optional[Dict[int, int]] = None,
+    **kwargs,
+) -> Execution:
+    return VM(code, globals_size(environment)).run(memory, **kwargs)
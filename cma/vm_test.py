@@ -0,0 +1,139 @@
+import unittest
+
+from cma.backend import Array, Basic, EnvEntry
+from cma.backend_test import basic_addr, generate_statement_code
+from cma.instructions import Instruction, Opcode, c_div, c_mod, decode
+from cma.vm import VM, VMError, globals_size, run
+
+
+class TestDecode(unittest.TestCase):
+    def test_decode(self):
+        opcodes, operands = decode(["loadc 42", "load", "jumpz 0"])
+        self.assertEqual(list(opcodes), [Opcode.LOADC, Opcode.LOAD, Opcode.JUMPZ])
+        self.assertEqual(list(operands), [42, 0, 0])
+
+    def test_decode_instructions(self):
+        opcodes, operands = decode(
+            [Instruction(Opcode.LOADC, 42), Instruction(Opcode.LOAD)]
+        )
+        self.assertEqual(list(opcodes), [Opcode.LOADC, Opcode.LOAD])
+        self.assertEqual(list(operands), [42, 0])
+
+    def test_unknown_instruction(self):
+        with self.assertRaises(AssertionError):
+            decode(["loadz 1"])
+
+    def test_missing_operand(self):
+        with self.assertRaises(AssertionError):
+            decode(["loadc"])
+
+
+class TestArithmetic(unittest.TestCase):
+    def test_division_truncates_towards_zero(self):
+        self.assertEqual(c_div(7, 2), 3)
+        self.assertEqual(c_div(-7, 2), -3)
+        self.assertEqual(c_div(7, -2), -3)
+        self.assertEqual(c_mod(-7, 2), -1)
+        self.assertEqual(c_mod(7, -2), 1)
+
+    def test_expression(self):
+        code = ["loadc 7", "neg", "loadc 2", "div", "loadc 1", "store"]
+        execution = VM(code, globals_size=2).run()
+        self.assertEqual(execution.memory[1], -3)
+
+    def test_division_by_zero(self):
+        with self.assertRaises(VMError):
+            VM(["loadc 1", "loadc 0", "div"]).run()
+
+    def test_negative_addresses(self):
+        for code in [
+            ["loadc -1", "load"],
+            ["loadc 5", "loadc -1", "store"],
+            ["loada -1"],
+            ["loadc 5", "storea -1"],
+        ]:
+            with self.assertRaises(VMError, msg=code):
+                VM(code).run()
+
+    def test_jumps_outside_of_the_code(self):
+        for code in [["jump 3"], ["loadc 0", "jumpz 5"], ["loadc 2", "jumpi 1"]]:
+            with self.assertRaises(VMError, msg=code):
+                VM(code).run()
+        # right behind the last instruction is the end of the program
+        self.assertEqual(VM(["jump 1"]).run().instructions, 1)
+        for code in [["jump -2", "loadc 1"], ["loadc 0", "jumpz 3"]]:
+            with self.assertRaises(VMError, msg=code):
+                VM(code, 1).run()
+
+    def test_stack_underflow(self):
+        for code in [["pop"], ["loadc 1", "add"], ["jumpz 0"], ["pop", "loadc 1"]]:
+            with self.assertRaises(VMError, msg=code):
+                VM(code, 1).run()
+
+
+class TestExecution(unittest.TestCase):
+    def test_power(self):
+        c_code = """
+        z = 1;
+        while (n > 0) {
+            j = 1;
+            y = x;
+            while (2 * j <= n) { y = y * y; j = j * 2; }
+            z = y * z;
+            n = n - j;
+        }
+        """
+        environment = {
+            "n": basic_addr(1),
+            "j": basic_addr(2),
+            "x": basic_addr(3),
+            "y": basic_addr(4),
+            "z": basic_addr(5),
+        }
+        code = generate_statement_code(c_code, environment)
+        execution = run(code, environment, {1: 13, 3: 3})
+        self.assertEqual(execution.memory[5], 3**13)
+        # the stack is empty again
+        self.assertEqual(execution.sp, globals_size(environment) - 1)
+        self.assertGreater(execution.instructions, len(code))
+
+    def test_switch(self):
+        c_code = """
+        switch (x) {
+            case 0: y = 10; break;
+            case 1: y = 11; break;
+            default: y = 12;
+        }
+        """
+        environment = {"x": basic_addr(1), "y": basic_addr(2)}
+        code = generate_statement_code(c_code, environment)
+        for x, y in [(0, 10), (1, 11), (2, 12), (-1, 12)]:
+            with self.subTest(x=x):
+                execution = run(code, environment, {1: x})
+                self.assertEqual(execution.memory[2], y)
+
+    def test_array(self):
+        c_code = "for (i = 0; i < 5; i = i + 1) a[i] = i * i;"
+        environment = {"i": basic_addr(1), "a": EnvEntry(2, Array(Basic(), 5))}
+        code = generate_statement_code(c_code, environment)
+        execution = run(code, environment)
+        self.assertEqual(execution.memory[2:7], [0, 1, 4, 9, 16])
+
+    def test_malloc(self):
+        code = ["loadc 3", "new", "loadc 1", "store", "pop"]
+        execution = VM(code, globals_size=2, memory_size=100).run()
+        self.assertEqual(execution.memory[1], 97)
+        self.assertEqual(execution.np, 97)
+
+    def test_malloc_out_of_memory(self):
+        code = ["loadc 200", "new", "loadc 1", "store", "pop"]
+        execution = VM(code, globals_size=2, memory_size=100).run()
+        self.assertEqual(execution.memory[1], 0)
+
+    def test_max_steps(self):
+        with self.assertRaises(VMError):
+            VM(["jump 0"]).run(max_steps=100)
+
+    def test_instruction_count(self):
+        execution = VM(["loadc 1", "jumpz 0", "loadc 0", "jumpz 5", "pop"]).run()
+        self.assertEqual(execution.instructions, 4)
@@ -0,0 +1,23 @@
+from typing import Callable
+
+
+class DispatchTable(dict):
+    """
+    Maps classes to handlers. A class without a handler of its own uses the
+    handler of its closest registered base class, which is then cached.
+    """
+
+    def register(self, *classes: type):
+        def decorator(handler: Callable):
+            for cls in classes:
+                self[cls] = handler
+            return handler
+
+        return decorator
+
+    def __missing__(self, cls: type):
+        for base in cls.__mro__[1:]:
+            if dict.__contains__(self, base):
+                handler = self[cls] = dict.__getitem__(self, base)
+                return handler
+        raise KeyError(cls)